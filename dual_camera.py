@@ -13,11 +13,17 @@
 # For better performance, the next step would be to experiment with having the window display
 # in a separate thread
 
+import os
+import sys
 import cv2
-import threading
 import numpy as np
 
-# gstreamer_pipeline returns a GStreamer pipeline for capturing from the CSI camera
+# the camera class is the shared core in modules/ws_csi_camera.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules"))
+import ws_csi_camera as ws
+from ws_pacing import FramePacer, poll_key
+from ws_startup import open_cameras, release_cameras
+
 # Flip the image by setting the flip_method (most common values: 0 and 2)
 # display_width and display_height determine the size of each camera pane in the window on the screen
 
@@ -25,171 +31,50 @@ left_camera = None
 right_camera = None
 
 
-class CSI_Camera:
-
-    def __init__ (self) :
-        # Initialize instance variables
-        # OpenCV video capture element
-        self.video_capture = None
-        # The last captured image from the camera
-        self.frame   = None
-        self.grabbed = False
-        # The thread where the video capture runs
-        self.read_thread = None
-        self.read_lock   = threading.Lock()
-        self.running     = False
-
-    def open(self, gstreamer_pipeline_string):
-        try:
-            self.video_capture = cv2.VideoCapture(gstreamer_pipeline_string, cv2.CAP_GSTREAMER)
-            
-        except RuntimeError:
-            self.video_capture = None
-            print("Unable to open camera")
-            print("Pipeline: " + gstreamer_pipeline_string)
-            return
-
-        # Grab the first frame to start the video capturing
-        self.grabbed, self.frame = self.video_capture.read()
-
-    def start(self):
-        if self.running:
-            print('Video capturing is already running')
-            return None
-        # create a thread to read the camera image
-        if self.video_capture != None:
-            self.running = True
-            self.read_thread = threading.Thread(target=self.updateCamera)
-            self.read_thread.start()
-        return self
-
-    def stop(self):
-        self.running=False
-        self.read_thread.join()
-
-    def updateCamera(self):
-        # This is the thread to read images from the camera
-        while self.running:
-            try:
-                grabbed, frame = self.video_capture.read()
-                with self.read_lock:
-                    self.grabbed=grabbed
-                    self.frame=frame
-            except RuntimeError:
-                print("Could not read image from camera")
-                #self.stop() # WS mod
-
-    def read(self):
-        with self.read_lock:
-            frame = self.frame.copy()
-            grabbed=self.grabbed
-        return grabbed, frame
-
-    def release(self):
-        if self.video_capture != None:
-            self.video_capture.release()
-            self.video_capture = None
-        # Now kill the thread
-        if self.read_thread != None:
-            self.read_thread.join()
-
-
-# Currently there are setting frame rate on CSI Camera on Nano through gstreamer
-# Here we directly select sensor_mode 3 (1280x720, 59.9999 fps)
-def gstreamer_pipeline(
-    sensor_id=0,
-    #sensor_mode=3,  # WS mod
-    capture_width=1280,
-    capture_height=720,
-    display_width=1280,
-    display_height=720,
-    framerate=30,
-    flip_method=0,
-):
-    #"sensor-mode=%d ! "  # WS removed sensor-mode to be able to override it
-    return (
-        "nvarguscamerasrc sensor-id=%d ! "
-        "video/x-raw(memory:NVMM), "
-        "width=(int)%d, height=(int)%d, "
-        "format=(string)NV12, framerate=(fraction)%d/1 ! "
-        "nvvidconv flip-method=%d ! "
-        "video/x-raw, width=(int)%d, height=(int)%d, format=(string)BGRx ! "
-        "videoconvert ! "
-        "video/x-raw, format=(string)BGR ! appsink"
-        % (
-            sensor_id,
-            #sensor_mode, # WS mod
-            capture_width,
-            capture_height,
-            framerate,
-            flip_method,
-            display_width,
-            display_height,
-        )
-    )
-
-
 def start_cameras():
 
-    left_camera = CSI_Camera()
-    left_camera.open(
-        gstreamer_pipeline(
-            sensor_id=0,
-            #sensor_mode=3,   # WS mod from 3 to 0: mode 0 gave error; removed sensor-mode
-            flip_method=0,
-            framerate=21, #30, #21,         # WS mod: overwriting sensor_mode
-            capture_width=3264, #1280, #1920, #3264,   # WS mod: overwriting sensor_mode
-            capture_height=2464, #720, #1080, #2464,   # WS mod: overwriting sensor_mode
-            display_width=640,  #960,        # WS mod
-            display_height=480, #360, #480, #540   # WS mod
-        )
-    )
-    left_camera.start()
-
+    # both cameras are opened concurrently, so their warm-up times overlap (ws_startup.py)
+    # no FPS labels here, so no frame-rate statistics either (stats 'none')
+    # WS mod: mode 0 (3264x2464 @ 21 fps) is the only 4:3 picam mode, to match the webcam
     # WS mod webcam: this has just 4:3 ratio: not sure how to control its params: it is a black box;
     # when running with picam, need picam at 3264x2464 to get 4:3; all other picam modes are 16:9
-    right_camera = CSI_Camera()
-    right_camera.open(1)
-    '''
-        gstreamer_pipeline(
-            sensor_id=1,
-            sensor_mode=3,
-            flip_method=0,
-            display_height=540,
-            display_width=960,))
-    '''
-    right_camera.start()
-
-    cv2.namedWindow("CSI Cameras", cv2.WINDOW_AUTOSIZE)
-
-    if (
-        not left_camera.video_capture.isOpened()
-        or not right_camera.video_capture.isOpened()
-    ):
+    reports = open_cameras([dict(sensor_id=0, sensor_mode=ws.S_MODE_0_3264_2464_21,
+                                 flip_method=0,
+                                 display_width=640,  #960,        # WS mod
+                                 display_height=480, #360, #480, #540   # WS mod
+                                 display_fps=False),
+                            dict(device=1, display_fps=False)])
+    if not all(r.ok and not r.timed_out for r in reports):
         # Cameras did not open, or no camera attached
-
         print("Unable to open any cameras")
-        # TODO: Proper Cleanup
-        SystemExit(0)
+        release_cameras(reports)
+        return
+    left_camera, right_camera = [r.camera for r in reports]
+    # WS mod when a webcam is used as the right camera: the capture thread resizes it to
+    # the picam pane
+    right_camera.set_output_size(640, 480)
 
+    cv2.namedWindow("CSI Cameras", cv2.WINDOW_AUTOSIZE)
+
+    # WS NOTE: waitKey(30) used to be the frame limiter (30 had less video latency than 1);
+    # the pacer wakes the loop once per picam frame instead, just after it arrives
+    pacer = FramePacer(camera=left_camera)
     while cv2.getWindowProperty("CSI Cameras", 0) >= 0 :
         
-        _ , left_image=left_camera.read()
-        _ , right_image=right_camera.read()
-        # WS mod when a webcam is used as the right camera
-        right_image = cv2.resize(right_image, (left_image.shape[1], left_image.shape[0]))
-        camera_images = np.hstack((left_image, right_image))
-        cv2.imshow("CSI Cameras", camera_images)
-
-        # WS NOTE: 30 has less video latency than 1: it gives the threads time to process
-        keyCode = cv2.waitKey(30) & 0xFF
+        left_ok , left_image=left_camera.read()
+        right_ok , right_image=right_camera.read()
+        if left_ok and right_ok:
+            camera_images = np.hstack((left_image, right_image))
+            cv2.imshow("CSI Cameras", camera_images)
+
+        pacer.wait()
+        keyCode = poll_key()
         # Stop the program on the ESC key
         if keyCode == 27:
             break
 
-    left_camera.stop()
+    print(pacer)
     left_camera.release()
-    right_camera.stop()
     right_camera.release()
     cv2.destroyAllWindows()
 
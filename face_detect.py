@@ -5,62 +5,50 @@
 # https://docs.opencv.org/3.3.1/d7/d8b/tutorial_py_face_detection.html
 # On the Jetson Nano, OpenCV comes preinstalled
 # Data files are in /usr/sharc/OpenCV
+import os
+import sys
 import numpy as np
 import cv2
 
-# gstreamer_pipeline returns a GStreamer pipeline for capturing from the CSI camera
-# Defaults to 1280x720 @ 30fps
+# the camera class is the shared core in modules/ws_csi_camera.py; it builds the GStreamer
+# pipeline for the CSI camera from a sensor mode, with the framerate that mode needs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules"))
+import ws_csi_camera as ws
+from ws_pacing import FramePacer, poll_key
+
 # Flip the image by setting the flip_method (most common values: 0 and 2)
 # display_width and display_height determine the size of the window on the screen
 
 
-def gstreamer_pipeline(
-    capture_width=3280,
-    capture_height=2464,
-    display_width=820,
-    display_height=616,
-    framerate=21,
-    flip_method=0,
-):
-    return (
-        "nvarguscamerasrc ! "
-        "video/x-raw(memory:NVMM), "
-        "width=(int)%d, height=(int)%d, "
-        "format=(string)NV12, framerate=(fraction)%d/1 ! "
-        "nvvidconv flip-method=%d ! "
-        "video/x-raw, width=(int)%d, height=(int)%d, format=(string)BGRx ! "
-        "videoconvert ! "
-        "video/x-raw, format=(string)BGR ! appsink"
-        % (
-            capture_width,
-            capture_height,
-            framerate,
-            flip_method,
-            display_width,
-            display_height,
-        )
-    )
-
-
 def face_detect():
 
     face_cascade = cv2.CascadeClassifier("/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml")
     eye_cascade  = cv2.CascadeClassifier("/usr/share/opencv4/haarcascades/haarcascade_eye.xml")
 
-    capText = gstreamer_pipeline(capture_width=1280, capture_height=720, framerate=60,
-                                flip_method=0, display_width=320, display_height=180) # WS values
-
-    cap = cv2.VideoCapture(capText, cv2.CAP_GSTREAMER)  # WS mod
+    camera = ws.CSI_Camera(display_fps=False)
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=ws.S_MODE_3_1280_720_60,
+                                     flip_method=0, display_width=320, display_height=180) # WS values
+    camera.open(camera.gstreamer_pipeline)  # WS mod
+    camera.start()
 
     #if cap.isOpened():  # WS mod
     cv2.namedWindow("Face Detect", cv2.WINDOW_AUTOSIZE)
 
     #while cv2.getWindowProperty("Face Detect", 0) >= 0:  # WS mod to try to reduce latency
+    pacer = FramePacer(camera=camera)   # WS mod: wakes just after each frame arrives
     while True: # WS mod
 
-        ret, img = cap.read()
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        ret, frame = camera.latest()
+        if not ret:
+            if not camera.running:
+                break
+            pacer.wait()
+            poll_key()
+            continue
+        # WS mod: detect on the luma the camera already has; BGR only for drawing
+        gray = camera.gray_of(frame)
         faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+        img = camera.bgr_of(frame)
 
         for (x, y, w, h) in faces:
             cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
@@ -74,12 +62,15 @@ def face_detect():
         cv2.imshow("Face Detect", img)
         cv2.moveWindow("Face Detect", 0, 0)  # WS mod
 
-        keyCode = cv2.waitKey(1) & 0xFF  # WS mod: 30 to 1: improved latency a little
+        # WS mod: waitKey 30 to 1 improved latency a little; deadline pacing replaces it
+        pacer.wait()
+        keyCode = poll_key()
 
         if keyCode == 27:  # Stop the program on the ESC key
             break
 
-    cap.release()
+    print(pacer)
+    camera.release()
     cv2.destroyAllWindows()
 
     #else:
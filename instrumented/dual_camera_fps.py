@@ -13,25 +13,25 @@
 
 import cv2
 import numpy as np
-from csi_camera import CSI_Camera
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modules"))
+from ws_pacing import FramePacer, poll_key
+from ws_startup import open_cameras, release_cameras
 
 show_fps = True
 
-# Simple draw label on an image; in our case, the video frame
-def draw_label(cv_image, label_text, label_position):
-    font_face = cv2.FONT_HERSHEY_SIMPLEX
-    scale = 0.5
-    color = (255,255,255)
-    # You can get the size of the string with cv2.getTextSize here
-    cv2.putText(cv_image, label_text, label_position, font_face, scale, color, 1, cv2.LINE_AA)
+# The cameras count the frames grabbed and displayed per second (ws_stats.WindowedStats,
+# which replaced the RepeatTimer counters) and keep the labels as cached sprites in their
+# overlay: they are only re-rendered when the counts change, and only their rectangles
+# are blended into the image
+def draw_fps(csi_camera, cv_image, offset=(0,0)):
+    return csi_camera.draw_overlay(cv_image, offset)
 
-# Read a frame from the camera, and draw the FPS on the image if desired
-# Return an image
-def read_camera(csi_camera,display_fps):
+# Read a frame from the camera
+# Return an image (None while there is no frame); it is never drawn on here
+def read_camera(csi_camera):
     _ , camera_image=csi_camera.read()
-    if display_fps:
-        draw_label(camera_image, "Frames Displayed (PS): "+str(csi_camera.last_frames_displayed),(10,20))
-        draw_label(camera_image, "Frames Read (PS): "+str(csi_camera.last_frames_read),(10,40))
     return camera_image
 
 # Good for 1280x720
@@ -47,59 +47,47 @@ SENSOR_MODE_1080=2
 SENSOR_MODE_720=3
 
 def start_cameras():
-    left_camera = CSI_Camera()
-    left_camera.create_gstreamer_pipeline(
-            sensor_id=0,
-            sensor_mode=SENSOR_MODE_720,
-            framerate=30,
-            flip_method=0,
-            display_height=DISPLAY_HEIGHT,
-            display_width=DISPLAY_WIDTH,
-    )
-    left_camera.open(left_camera.gstreamer_pipeline)
-    left_camera.start()
-
-    right_camera = CSI_Camera()
-    right_camera.create_gstreamer_pipeline(
-            sensor_id=1,
-            sensor_mode=SENSOR_MODE_720,
-            framerate=30,
-            flip_method=0,
-            display_height=DISPLAY_HEIGHT,
-            display_width=DISPLAY_WIDTH,
-    )
-    right_camera.open(right_camera.gstreamer_pipeline)
-    right_camera.start()
-
-    cv2.namedWindow("CSI Cameras", cv2.WINDOW_AUTOSIZE)
-
-    if (
-        not left_camera.video_capture.isOpened()
-        or not right_camera.video_capture.isOpened()
-    ):
+    # both cameras are opened concurrently, so their warm-up times overlap
+    reports = open_cameras([dict(sensor_id=sensor_id, sensor_mode=SENSOR_MODE_720,
+                                 flip_method=0, display_height=DISPLAY_HEIGHT,
+                                 display_width=DISPLAY_WIDTH, display_fps=show_fps,
+                                 stats='windowed')
+                            for sensor_id in (0, 1)])
+    if not all(r.ok and not r.timed_out for r in reports):
         # Cameras did not open, or no camera attached
-
         print("Unable to open any cameras")
-        # TODO: Proper Cleanup
-        SystemExit(0)
+        release_cameras(reports)
+        return
+    left_camera, right_camera = [r.camera for r in reports]
+
+    cv2.namedWindow("CSI Cameras", cv2.WINDOW_AUTOSIZE)
+    # paced to the left camera's frames instead of a waitKey delay
+    pacer = FramePacer(camera=left_camera)
     try:
-        # Start counting the number of frames read and displayed
-        left_camera.start_counting_fps()
-        right_camera.start_counting_fps()
         while cv2.getWindowProperty("CSI Cameras", 0) >= 0 :
-            left_image=read_camera(left_camera,show_fps)
-            right_image=read_camera(right_camera,show_fps)
+            left_image=read_camera(left_camera)
+            right_image=read_camera(right_camera)
+            if left_image is None or right_image is None:
+                # no frame while a camera reconnects
+                pacer.wait()
+                poll_key()
+                continue
             # We place both images side by side to show in the window
             camera_images = np.hstack((left_image, right_image))
+            # The labels go on the composite, not on the camera frames
+            if show_fps:
+                draw_fps(left_camera, camera_images)
+                draw_fps(right_camera, camera_images, (left_image.shape[1], 0))
             cv2.imshow("CSI Cameras", camera_images)
-            left_camera.frames_displayed += 1
-            right_camera.frames_displayed += 1
-            # This also acts as a frame limiter
+            left_camera.displayed()
+            right_camera.displayed()
+            pacer.wait()
             # Stop the program on the ESC key
-            if (cv2.waitKey(20) & 0xFF) == 27:
+            if poll_key() == 27:
                 break   
 
     finally:
+        print(pacer)
         left_camera.stop()
         left_camera.release()
         right_camera.stop()
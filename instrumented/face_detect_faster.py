@@ -8,26 +8,42 @@
 
 import cv2
 import numpy as np
-from csi_camera import CSI_Camera
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modules"))
+from ws_csi_camera import CSI_Camera, SENSOR_SIZE
+from ws_tiled_detect import TiledDetector
+from ws_pacing import FramePacer, poll_key
+from ws_governor import Governor, LEVELS
+from ws_buffers import BufferPool, AllocationAudit
+from ws_face_store import FaceCropStore
+from time import time
 
 show_fps = True
 
-# Simple draw label on an image; in our case, the video frame
-def draw_label(cv_image, label_text, label_position):
-    font_face = cv2.FONT_HERSHEY_SIMPLEX
-    scale = 0.5
-    color = (255,255,255)
-    # You can get the size of the string with cv2.getTextSize here
-    cv2.putText(cv_image, label_text, label_position, font_face, scale, color, 1, cv2.LINE_AA)
-
-# Read a frame from the camera, and draw the FPS on the image if desired
-# Return an image
-def read_camera(csi_camera,display_fps):
-    _ , camera_image=csi_camera.read()
-    if display_fps:
-        draw_label(camera_image, "Frames Displayed (PS): "+str(csi_camera.last_frames_displayed),(10,20))
-        draw_label(camera_image, "Frames Read (PS): "+str(csi_camera.last_frames_read),(10,40))
-    return camera_image
+# The cameras count the frames grabbed and displayed per second (ws_stats.WindowedStats,
+# which replaced the RepeatTimer counters) and keep the labels as cached sprites in their
+# overlay: they are only re-rendered when the counts change, and only their rectangles
+# are blended into the image
+def draw_fps(csi_camera, cv_image, offset=(0,0)):
+    return csi_camera.draw_overlay(cv_image, offset)
+
+# Read a frame from the camera
+# Return the frame as captured (None while there is no frame), without a copy: detection
+# runs on its luma (gray_image) and only frames that are drawn on get a BGR copy
+# (color_image). With a pool both are written into the pool's buffers instead of new arrays
+def read_camera(csi_camera):
+    _ , frame=csi_camera.latest()
+    return frame
+
+def gray_image(csi_camera, frame, pool=None):
+    # a view in GRAY8/NV12 mode; converted (into the pool's 'gray' buffer) in BGR mode
+    out = pool.get('gray', frame.shape[:2]) if pool is not None and frame.ndim == 3 else None
+    return csi_camera.gray_of(frame, out)
+
+def color_image(csi_camera, frame, gray, pool=None):
+    h, w = gray.shape[:2]
+    return csi_camera.bgr_of(frame, pool.get('frame', (h, w, 3)) if pool is not None else None)
 
 # WS mods/additions
 
@@ -77,7 +93,23 @@ S_MODE_4_1280_720_120 = 4
 
 def face_detect(sensor_mode=S_MODE_3_1280_720_60,
                 dispW=DISP_W_M3_M4_one_half,
-                dispH=DISP_H_M3_M4_one_half):
+                dispH=DISP_H_M3_M4_one_half,
+                tiled=False,
+                target_latency=0.1,
+                pooled=True,
+                audit=False,
+                crops=None):
+
+    # tiled: capture at full sensor resolution and detect on overlapping tiles across a
+    # thread pool (see modules/ws_tiled_detect.py), so small and distant faces are not
+    # lost to downscaling; only the display is scaled to dispW x dispH
+    # target_latency: seconds from grab to display that the overload governor (see
+    # modules/ws_governor.py) keeps to by skipping eyes, detecting less often or on a
+    # smaller image, and refreshing the display less often; None always does everything
+    # pooled: per-frame images are written into preallocated buffers (modules/ws_buffers.py)
+    # audit: report the bytes allocated per frame (tracemalloc), e.g. with and without pool
+    # crops: directory to collect deduplicated face crops in, written in the background
+    # (see modules/ws_face_store.py)
 
     face_cascade = cv2.CascadeClassifier(
         "/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml"
@@ -85,16 +117,19 @@ def face_detect(sensor_mode=S_MODE_3_1280_720_60,
     eye_cascade = cv2.CascadeClassifier(
         "/usr/share/opencv4/haarcascades/haarcascade_eye.xml"
     )
-    left_camera = CSI_Camera()
+    left_camera = CSI_Camera(display_fps=show_fps, stats='windowed')
+    capW, capH = SENSOR_SIZE[sensor_mode] if tiled else (dispW, dispH)
+    detector = TiledDetector() if tiled else None
+    thickness = 2 * capW // dispW   # box lines stay visible after scaling down
 
-    # WS mod: IMPORTANT use lowest fps = 21 as default, otherwise modes 0 or 1 crash: reboot required
+    # WS mod: IMPORTANT the framerate must suit the sensor mode, otherwise modes 0 or 1 crash:
+    # reboot required. The camera core takes it from its framerate table.
     left_camera.create_gstreamer_pipeline(
             sensor_id=0,
             sensor_mode=sensor_mode,
-            framerate=21,
             flip_method=0,
-            display_height=dispH,
-            display_width=dispW,
+            display_height=capH,
+            display_width=capW,
     )
     left_camera.open(left_camera.gstreamer_pipeline)
     left_camera.start()
@@ -109,33 +144,104 @@ def face_detect(sensor_mode=S_MODE_3_1280_720_60,
         print("Unable to open any cameras")
         # TODO: Proper Cleanup
         SystemExit(0)
+    # paced to the camera's frames instead of a waitKey delay; detection that overruns a
+    # frame shows up as missed deadlines
+    pacer = FramePacer(camera=left_camera)
+    governor = Governor(target_latency or float('inf'),
+                        budget=1.0 / left_camera.framerate[sensor_mode],
+                        levels=LEVELS if target_latency else LEVELS[:1])
+    faces = ()
+    pool = BufferPool() if pooled else None
+    audit = AllocationAudit(label='pooled' if pooled else 'unpooled') if audit else None
+    store = FaceCropStore(crops) if crops else None
     try:
-        # Start counting the number of frames read and displayed
-        left_camera.start_counting_fps()
         while cv2.getWindowProperty(txt, 0) >= 0 :
-            img=read_camera(left_camera,False)
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-
-            for (x, y, w, h) in faces:
-                cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
-                roi_gray = gray[y : y + h, x : x + w]
-                roi_color = img[y : y + h, x : x + w]
-                eyes = eye_cascade.detectMultiScale(roi_gray)
-                for (ex, ey, ew, eh) in eyes:
-                    cv2.rectangle(
-                        roi_color, (ex, ey), (ex + ew, ey + eh), (0, 255, 0), 2
-                    )
-            if show_fps:
-                draw_label(img, "Frames Displayed (PS): "+str(left_camera.last_frames_displayed),(10,20))
-                draw_label(img, "Frames Read (PS): "+str(left_camera.last_frames_read),(10,40))
-            cv2.imshow(txt, img)
-            left_camera.frames_displayed += 1
-            keyCode = cv2.waitKey(5) & 0xFF
+            if audit is not None:
+                audit.begin()
+            frame=read_camera(left_camera)
+            t_grab = left_camera.last_grab
+            if frame is None:
+                # no frame while the camera reconnects
+                pacer.wait()
+                poll_key()
+                continue
+            settings = governor.settings
+            with governor.stage('gray'):
+                gray = gray_image(left_camera, frame, pool)
+            detected = governor.detect_now()
+            if detected:
+                # between detections the last boxes are reused
+                with governor.stage('detect'):
+                    scale = settings['detect_scale']
+                    if detector is not None:
+                        faces = detector.detect(gray)
+                    elif scale != 1.0:
+                        size = (int(gray.shape[1] * scale), int(gray.shape[0] * scale))
+                        small = cv2.resize(gray, size,
+                                           pool.get('small', size[::-1]) if pool else None,
+                                           interpolation=cv2.INTER_AREA)
+                        faces = face_cascade.detectMultiScale(small, 1.3, 5)
+                        faces = (np.asarray(faces).reshape(-1, 4) / scale).astype(int)
+                    else:
+                        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+
+            # BGR only for frames that are shown or cropped; the rest are never converted
+            show = governor.display_now()
+            img = None
+            if show or (store is not None and detected and len(faces)):
+                with governor.stage('color'):
+                    img = color_image(left_camera, frame, gray, pool)
+
+            if store is not None and detected:
+                # crops are cut before anything is drawn on the frame
+                for box in faces:
+                    store.add(img, box)
+
+            if show:
+                with governor.stage('eyes'):
+                    for (x, y, w, h) in faces:
+                        cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), thickness)
+                        if not settings['eyes']:
+                            continue
+                        roi_gray = gray[y : y + h, x : x + w]
+                        roi_color = img[y : y + h, x : x + w]
+                        eyes = eye_cascade.detectMultiScale(roi_gray)
+                        for (ex, ey, ew, eh) in eyes:
+                            cv2.rectangle(
+                                roi_color, (ex, ey), (ex + ew, ey + eh), (0, 255, 0), thickness
+                            )
+                with governor.stage('display'):
+                    if tiled:
+                        img = cv2.resize(img, (dispW, dispH),
+                                         pool.get('display', (dispH, dispW, 3)) if pool else None,
+                                         interpolation=cv2.INTER_AREA)
+                    if show_fps:
+                        draw_fps(left_camera, img)
+                    cv2.imshow(txt, img)
+                left_camera.displayed()
+            if audit is not None:
+                audit.end()
+            level = governor.level
+            if governor.update(time() - t_grab) != level:
+                print(governor)
+            if show_fps and target_latency:
+                left_camera.overlay.set_text('governor', "Governor: {} ({})".format(
+                    governor.level, settings['name']), (10,80))
+            pacer.wait()
+            keyCode = poll_key()
             # Stop the program on the ESC key
             if keyCode == 27:
                 break
     finally:
+        print(pacer)
+        print(governor)
+        if audit is not None and not audit.done:
+            print(audit)
+        if store is not None:
+            store.close()
+            print(store)
+        if detector is not None:
+            detector.close()
         left_camera.stop()
         left_camera.release()
         cv2.destroyAllWindows()
@@ -144,4 +250,8 @@ def face_detect(sensor_mode=S_MODE_3_1280_720_60,
 if __name__ == "__main__":
     face_detect(sensor_mode=S_MODE_0_3264_2464_21,
                 dispW=DISP_W_M0_one_quarter,
-                dispH=DISP_H_M0_one_quarter)
+                dispH=DISP_H_M0_one_quarter,
+                tiled='tiled' in sys.argv[1:],
+                pooled='unpooled' not in sys.argv[1:],
+                audit='audit' in sys.argv[1:],
+                crops='known' if 'crops' in sys.argv[1:] else None)
@@ -0,0 +1,11 @@
+# __main__.py
+# Entry point for  python3 -m modules <workload> [options]  (see ws_cli.py)
+
+# The ws_* modules import each other by their bare names, so this directory goes on the path
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ws_cli import main
+
+main()
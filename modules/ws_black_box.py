@@ -0,0 +1,170 @@
+# ws_black_box.py
+# Pre-trigger ring recorder ("black box")
+
+# Keeps the last few seconds of frames of a camera in a ring of preallocated slots, sized
+# in bytes, so memory use is fixed no matter how long it runs. When trigger() is called
+# (e.g. a face was detected) a background thread dumps the frames from pre_seconds before
+# the trigger up to post_seconds after it to a raw capture (see ws_raw_capture.py).
+
+# The ring is written by the camera's capture thread (BlackBox.write is a CSI_Camera sink)
+# and that never waits for the dump: each write is one copy into the next slot. The dump
+# thread follows behind; if the disk is so slow that the writer laps it, the overwritten
+# frames are counted in .dropped instead of blocking capture. A frame is copied out of its
+# slot before it is written to disk, and only written if the slot still holds it after the
+# copy, so a frame overwritten mid-copy never reaches the dump.
+
+#   box = BlackBox(max_bytes=200 << 20, pre_seconds=5, post_seconds=5, fps=60)
+#   camera.add_sink(box.write)
+#   ...
+#   if len(faces):
+#       box.trigger('face')
+
+import os
+import threading
+import time
+import numpy as np
+from ws_raw_capture import RawWriter
+
+
+class BlackBox:
+
+    def __init__(self, max_bytes, pre_seconds=5.0, post_seconds=5.0, fps=30,
+                 directory='black_box'):
+
+        self.max_bytes    = max_bytes
+        self.pre_seconds  = pre_seconds
+        self.post_seconds = post_seconds
+        self.fps          = fps
+        self.directory    = directory
+        self.frames       = None   # ring storage, allocated from the first frame's shape
+        self.timestamps   = None
+        self.seqs         = None   # sequence held by each slot, -1 while being written
+        self.head         = 0      # sequence of the newest complete frame
+        self.new_frame    = threading.Event()
+        self.dump_thread  = None
+        self.dump_until   = 0.0    # post-trigger end time of the dump in progress
+        self.dumps        = 0
+        self.dropped      = 0      # frames overwritten before the dump could save them
+        self.closing      = False
+
+    def _allocate(self, frame):
+        # enough slots for pre + post seconds (so a dump normally never loses frames),
+        # but never more than max_bytes
+        wanted = int((self.pre_seconds + self.post_seconds) * self.fps) + 1
+        slots = max(min(wanted, self.max_bytes // frame.nbytes), 2)
+        if slots < wanted:
+            print("Black box holds {:.1f} sec at {} fps".format(slots / self.fps, self.fps))
+        self.frames = np.empty((slots,) + frame.shape, frame.dtype)
+        self.timestamps = np.zeros(slots)
+        self.seqs = np.full(slots, -1, np.int64)
+
+    def write(self, frame, timestamp, seq=None):
+        # capture-thread sink: copy the frame into the next slot
+        if self.frames is None:
+            self._allocate(frame)
+        elif frame.shape != self.frames.shape[1:]:
+            return   # the camera was reconfigured; frames of another size are not kept
+        n = self.head + 1
+        i = n % len(self.frames)
+        self.seqs[i] = -1
+        np.copyto(self.frames[i], frame)
+        self.timestamps[i] = timestamp
+        self.seqs[i] = n
+        self.head = n
+        self.new_frame.set()
+
+    def trigger(self, tag='event'):
+        # start a dump of [now - pre_seconds, now + post_seconds]; a trigger during a dump
+        # extends it instead
+        now = time.time()
+        self.dump_until = now + self.post_seconds
+        if self.dump_thread is not None and self.dump_thread.is_alive():
+            return False
+        if self.frames is None:
+            return False
+        name = os.path.join(self.directory, time.strftime('%Y%m%d_%H%M%S_') + tag)
+        self.dump_thread = threading.Thread(target=self._dump, args=(name, now), daemon=True)
+        self.dump_thread.start()
+        return True
+
+    def _dump(self, name, t_trigger):
+        os.makedirs(self.directory, exist_ok=True)
+        writer = RawWriter(name)
+        slots = len(self.frames)
+        scratch = np.empty_like(self.frames[0])
+        # oldest frame still in the ring that is inside the pre-trigger window
+        seq = max(self.head - slots + 2, 1)
+        while seq <= self.head and self.timestamps[seq % slots] < t_trigger - self.pre_seconds:
+            seq += 1
+        while not self.closing:
+            if seq > self.head:
+                if time.time() > self.dump_until:
+                    break
+                self.new_frame.wait(0.1)
+                self.new_frame.clear()
+                continue
+            i = seq % slots
+            ts = self.timestamps[i]
+            if self.seqs[i] != seq:
+                # lapped by the capture thread
+                self.dropped += 1
+                seq += 1
+                continue
+            if ts > self.dump_until:
+                break
+            np.copyto(scratch, self.frames[i])
+            if self.seqs[i] != seq:
+                # overwritten while it was being copied: torn, not written
+                self.dropped += 1
+                seq += 1
+                continue
+            writer.write(scratch, ts, seq)
+            seq += 1
+        writer.close()
+        self.dumps += 1
+        print("Black box: {} frames written to {}".format(writer.frames, name))
+
+    def close(self):
+        self.closing = True
+        if self.dump_thread is not None:
+            self.dump_thread.join()
+
+
+if __name__ == "__main__":
+
+    # face detection on the picam, dumping the seconds around every face to black_box/
+    import cv2
+    import ws_csi_camera as ws
+    from ws_pacing import FramePacer, poll_key
+
+    sensor_mode = ws.S_MODE_3_1280_720_60
+    dispW, dispH = ws.DISP_ONE_QUARTER[sensor_mode]
+    camera = ws.CSI_Camera(display_fps=False)
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=sensor_mode,
+                                     display_width=dispW, display_height=dispH)
+    camera.open(camera.gstreamer_pipeline)
+    box = BlackBox(max_bytes=200 << 20, fps=camera.framerate[sensor_mode])
+    camera.add_sink(box.write)
+    camera.start()
+
+    face_cascade = cv2.CascadeClassifier(
+        "/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml")
+    pacer = FramePacer(camera=camera)
+    while True:
+        ok, img = camera.read()
+        if ok:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+            if len(faces):
+                box.trigger('face')
+            for (x, y, w, h) in faces:
+                cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
+            cv2.imshow("Black box", img)
+        pacer.wait()
+        if poll_key() == ord('q'):
+            break
+    print(pacer)
+    camera.release()
+    box.close()
+    print("{} dumps, {} frames dropped".format(box.dumps, box.dropped))
+    cv2.destroyAllWindows()
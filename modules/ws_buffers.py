@@ -0,0 +1,104 @@
+# ws_buffers.py
+# Preallocated scratch buffers for per-frame processing, and an allocation audit
+
+# At 60-120 fps every per-frame temporary (the frame copy, the grayscale image, resized
+# images, display images) is a fresh multi-hundred-kilobyte allocation, which on the Nano's
+# small RAM means allocator churn and GC pauses. A BufferPool hands out one persistent
+# buffer per (name, shape, dtype), and OpenCV writes into it through dst=:
+#   pool = BufferPool()
+#   gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, pool.get('gray', img.shape[:2]))
+# A buffer is overwritten the next time the same name is used, so a consumer that keeps a
+# frame beyond the iteration must copy it.
+
+# AllocationAudit measures what one iteration allocates, with tracemalloc (numpy and
+# OpenCV's numpy-backed images are traced too):
+#   audit = AllocationAudit(frames=300)
+#   while ...:
+#       audit.begin()
+#       ...one frame...
+#       audit.end()
+#   print(audit)
+# Per frame it records the transient peak above the starting point (what the iteration
+# had allocated at once) and the net growth. Tracing slows everything down, so only use it
+# to compare variants, e.g. with and without a pool.
+
+import tracemalloc
+import numpy as np
+
+
+class BufferPool:
+
+    def __init__(self):
+        self.buffers = {}   # (name, shape, dtype) -> ndarray
+
+    def get(self, name, shape, dtype=np.uint8):
+        key = (name, tuple(shape), np.dtype(dtype))
+        buf = self.buffers.get(key)
+        if buf is None:
+            buf = self.buffers[key] = np.empty(shape, dtype)
+        return buf
+
+    def like(self, name, array):
+        return self.get(name, array.shape, array.dtype)
+
+    def clear(self):
+        # e.g. after a change of frame size, so the old sizes are not kept around
+        self.buffers = {}
+
+    @property
+    def nbytes(self):
+        return sum(b.nbytes for b in self.buffers.values())
+
+
+class AllocationAudit:
+
+    def __init__(self, frames=300, warmup=30, label='', report=True):
+
+        self.frames  = frames    # frames to measure, after the warmup
+        self.warmup  = warmup    # first frames are not counted (caches, pools filling)
+        self.label   = label
+        self.report_when_done = report
+        self.count   = 0
+        self.start   = 0
+        self.peaks   = []        # bytes per measured frame
+        self.nets    = []
+        self.done    = False
+        self.started = False     # this audit started tracemalloc (and stops it)
+
+    def begin(self):
+        if self.done:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.start = tracemalloc.get_traced_memory()[0]
+
+    def end(self):
+        if self.done:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        self.count += 1
+        if self.count > self.warmup:
+            # without reset_peak (Python < 3.9) only the net growth is measurable
+            if hasattr(tracemalloc, 'reset_peak'):
+                self.peaks.append(peak - self.start)
+            self.nets.append(current - self.start)
+        if self.count >= self.warmup + self.frames:
+            self.done = True
+            if self.started:
+                tracemalloc.stop()
+            if self.report_when_done:
+                print(self)
+
+    def report(self):
+        peaks = np.array(self.peaks or [0])
+        nets = np.array(self.nets or [0])
+        return {'frames': len(self.nets), 'peak_mean': peaks.mean(), 'peak_max': peaks.max(),
+                'net_mean': nets.mean()}
+
+    def __str__(self):
+        return ("Allocation audit{}: {frames} frames, {peak_mean:,.0f} bytes allocated per "
+                "frame (max {peak_max:,.0f}), net {net_mean:,.0f}".format(
+                    ' (' + self.label + ')' if self.label else '', **self.report()))
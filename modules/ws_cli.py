@@ -0,0 +1,444 @@
+# ws_cli.py
+# One command line for the camera workloads, with a headless run-for-N-frames mode
+
+# Run from the repository root as
+#   python3 -m modules <workload> [options]
+# workloads:
+#   simple       one camera in a window                       (simple_camera.py)
+#   dual         two cameras side by side                     (dual_camera.py)
+#   face_detect  Haar cascade face (and eye) detection        (face_detect.py)
+#   ws_dual      picam + webcam with FPS labels, keys 0-4 switch the picam's sensor mode
+#                                                             (ws_dual_camera.py)
+#   grab_frame   save frames of a camera for a face dataset   (grab_frame_from_video.py)
+# Every workload runs on CSI_Camera, so any source works: the CSI camera, a V4L2 device, a
+# video file, a raw capture or synthetic frames (see ws_sources.py).
+
+# With --headless no window is opened and nothing of HighGUI is called; together with
+# --frames N the workload runs for N frames and prints a performance summary (add --json
+# for a machine-readable one), so the same workloads run under an orchestrator and in CI:
+#   python3 -m modules face_detect --source synthetic --headless --frames 300 --json
+# face_detect --offline OUT processes a video file as fast as possible instead, on a pool
+# of --workers threads, and writes the detections of every frame to OUT (ws_offline.py).
+# That works for every recorded source (a file, raw:NAME, or synthetic with --frames):
+#   python3 -m modules face_detect --source walk.mp4 --offline walk_faces.jsonl
+
+# Options can also come from a JSON config file whose keys are the option names (with
+# underscores, e.g. "sensor_mode"); options given on the command line take precedence:
+#   python3 -m modules dual --config picam_webcam.json
+
+import argparse
+import json
+import os
+from time import sleep, time
+
+import cv2
+import numpy as np
+import ws_csi_camera as ws
+from ws_pacing import FramePacer, poll_key
+from ws_sources import open_source
+
+
+def open_camera(args, source=None, sensor_id=None, display_fps=False):
+    # an opened and started CSI_Camera for the source, per the common options
+    source = args.source if source is None else source
+    camera = ws.CSI_Camera(display_fps=display_fps, stats=args.stats)
+    if args.policy:
+        from ws_threading import POLICIES
+        camera.thread_policy = POLICIES[args.policy]
+    if source == 'csi':
+        camera.create_gstreamer_pipeline(sensor_id=args.sensor_id if sensor_id is None
+                                         else sensor_id,
+                                         sensor_mode=args.sensor_mode,
+                                         display_width=args.width, display_height=args.height,
+                                         flip_method=args.flip, color_format=args.color_format)
+        camera.open(camera.gstreamer_pipeline)
+    else:
+        camera.open(open_source(source, args.width, args.height))
+    if camera.video_capture is None or camera.frame is None:
+        camera.release()
+        raise SystemExit("Unable to open source {}".format(source))
+    camera.start()
+    return camera
+
+
+class Workload:
+
+    # a workload opens its cameras, makes one display image per step() (None when there
+    # is no new frame) and may react to keys; the runner does display, pacing and timing
+
+    def __init__(self, args):
+        self.args    = args
+        self.cameras = []
+
+    def open(self):
+        pass
+
+    def step(self):
+        return None
+
+    def key(self, key):
+        return True   # False ends the run
+
+    def running(self):
+        return any(c.running for c in self.cameras)
+
+    def summary(self):
+        return {}
+
+    def close(self):
+        for camera in self.cameras:
+            camera.release()
+
+
+class Simple(Workload):
+
+    title = "CSI Camera"
+
+    def open(self):
+        self.cameras = [open_camera(self.args)]
+
+    def step(self):
+        ok, img = self.cameras[0].read()
+        return img if ok else None
+
+
+class Dual(Workload):
+
+    title = "CSI Cameras"
+    display_fps = False
+
+    def open(self):
+        a = self.args
+        left = open_camera(a, display_fps=self.display_fps)
+        right = open_camera(a, a.source2, sensor_id=1, display_fps=self.display_fps)
+        # the right camera's frames are resized to the left pane in its capture thread
+        h, w = left.frame.shape[:2]
+        right.set_output_size(w, h)
+        self.cameras = [left, right]
+
+    def step(self):
+        left, right = self.cameras
+        okL, imgL = left.read()
+        okR, imgR = right.read()
+        if not (okL and okR):
+            return None
+        if imgR.shape != imgL.shape:
+            return None   # the right camera has not delivered a resized frame yet
+        img = np.hstack((imgL, imgR))
+        if self.display_fps:
+            left.draw_overlay(img)
+            right.draw_overlay(img, offset=(imgL.shape[1], 0))
+        return img
+
+
+class WSDual(Dual):
+
+    title = "Picam on left"
+    display_fps = True
+
+    def key(self, key):
+        if ord('0') <= key <= ord('4') and self.args.source == 'csi':
+            # switch the picam to another sensor mode
+            sensor_mode = key - ord('0')
+            dispW, dispH = ws.DISP_ONE_QUARTER[sensor_mode]
+            self.cameras[1].set_output_size(dispW, dispH)
+            if self.cameras[0].reconfigure(sensor_mode, dispW, dispH):
+                print("Sensor mode {}: first frame after {:.2f} sec".format(
+                    sensor_mode, self.cameras[0].reconfigure_time))
+        return True
+
+
+class FaceDetect(Workload):
+
+    title = "Face Detect"
+
+    def open(self):
+        from ws_buffers import BufferPool
+        self.detector = None
+        self.store = None
+        self.index = None
+        self.cameras = [open_camera(self.args)]
+        cascades = "/usr/share/opencv4/haarcascades/"
+        self.face_cascade = cv2.CascadeClassifier(cascades + "haarcascade_frontalface_default.xml")
+        self.eye_cascade = cv2.CascadeClassifier(cascades + "haarcascade_eye.xml")
+        if self.args.tiled:
+            from ws_tiled_detect import TiledDetector
+            self.detector = TiledDetector()
+        self.pool = BufferPool()
+        if self.args.known:
+            from ws_face_index import FaceIndex
+            # grab_frame saves whole frames: the cascade finds the face in each of them
+            self.index = FaceIndex(self.args.known, threshold=self.args.match_threshold,
+                                   cascade=self.face_cascade)
+        if self.args.crops:
+            from ws_face_store import FaceCropStore
+            self.store = FaceCropStore(self.args.crops, identity=self.args.identity)
+        self.faces = 0
+        self.frames_with_faces = 0
+
+    def step(self):
+        # detection runs on the camera's luma (a view in GRAY8/NV12 mode); the BGR copy
+        # of the same frame is only made for the crops and the display
+        camera = self.cameras[0]
+        ok, frame = camera.latest()
+        if not ok:
+            return None
+        gray = camera.gray_of(frame, self.pool.get('gray', frame.shape[:2])
+                                     if frame.ndim == 3 else None)
+        img = camera.bgr_of(frame, self.pool.get('frame', gray.shape[:2] + (3,)))
+        if self.detector is not None:
+            faces = self.detector.detect(gray)
+        else:
+            faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+        self.faces += len(faces)
+        self.frames_with_faces += len(faces) > 0
+        if self.store is not None:
+            # crops are cut before anything is drawn on the frame
+            for box in faces:
+                self.store.add(img, box)
+        names = None
+        if self.index is not None:
+            self.index.poll()
+            names = self.index.match_faces(gray, faces)
+        for i, (x, y, w, h) in enumerate(faces):
+            cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
+            if names is not None:
+                identity, score = names[i]
+                cv2.putText(img, "{} {:.2f}".format(identity or '?', score), (x, y - 6),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+            if self.args.eyes:
+                for (ex, ey, ew, eh) in self.eye_cascade.detectMultiScale(gray[y:y+h, x:x+w]):
+                    cv2.rectangle(img, (x + ex, y + ey), (x + ex + ew, y + ey + eh),
+                                  (0, 255, 0), 2)
+        return img
+
+    def summary(self):
+        s = {'faces': self.faces, 'frames_with_faces': self.frames_with_faces}
+        if self.store is not None:
+            s['crops'] = dict(added=self.store.added, written=self.store.written,
+                              duplicates=self.store.duplicates,
+                              over_quota=self.store.over_quota, dropped=self.store.dropped)
+        if self.index is not None:
+            s['known'] = dict(enrolled=self.index.count, identities=len(self.index.labels),
+                              matched=self.index.matches)
+        return s
+
+    def close(self):
+        if self.detector is not None:
+            self.detector.close()
+        if self.store is not None:
+            self.store.close()
+        Workload.close(self)
+
+
+class GrabFrame(Workload):
+
+    title = "Grab frame"
+
+    def open(self):
+        self.cameras = [open_camera(self.args)]
+        self.cameras[0].set_output_size(self.args.width, self.args.height)
+        os.makedirs(self.args.dest, exist_ok=True)
+        self.saved = 0
+        self.count = 0
+        self.last = None
+
+    def save(self, img):
+        name = os.path.join(self.args.dest, '{}_{}.{}'.format(self.args.base, self.saved,
+                                                              self.args.suffix))
+        cv2.imwrite(name, img)
+        self.saved += 1
+
+    def step(self):
+        ok, img = self.cameras[0].read()
+        if not ok:
+            return None
+        self.count += 1
+        self.last = img
+        # headless there is no 's' key: save every --save-every frames instead
+        if self.args.save_every and self.count % self.args.save_every == 0:
+            self.save(img)
+        return img
+
+    def key(self, key):
+        if key == ord('s') and self.last is not None:
+            self.save(self.last)
+        return True
+
+    def summary(self):
+        return {'saved': self.saved, 'dest': self.args.dest}
+
+
+WORKLOADS = {'simple': Simple, 'dual': Dual, 'face_detect': FaceDetect, 'ws_dual': WSDual,
+             'grab_frame': GrabFrame}
+
+
+def run(workload, args):
+    # the display/headless loop shared by all workloads; returns the summary dict
+    try:
+        workload.open()
+    except BaseException:
+        workload.close()   # cameras opened so far have running capture threads
+        raise
+    pacer = FramePacer(camera=workload.cameras[0]) if args.pace else None
+    gaps = []
+    if args.gaps:
+        from ws_frame_gaps import FrameGapMonitor
+        gaps = [FrameGapMonitor(camera) for camera in workload.cameras]
+    title = workload.title
+    if not args.headless:
+        cv2.namedWindow(title, cv2.WINDOW_AUTOSIZE)
+    frames = 0
+    busy = 0.0          # time spent in step(), i.e. processing
+    last_seq = None
+    t0 = time()
+    try:
+        while args.frames is None or frames < args.frames:
+            if not workload.running():
+                break
+            seq = workload.cameras[0].frames_grabbed
+            if seq == last_seq and pacer is None:
+                sleep(0.001)   # unpaced: do not process the same frame twice
+                continue
+            last_seq = seq
+            t1 = time()
+            img = workload.step()
+            busy += time() - t1
+            if img is not None:
+                frames += 1
+                if not args.headless:
+                    cv2.imshow(title, img)
+                    for camera in workload.cameras:
+                        camera.displayed()
+            if pacer is not None:
+                pacer.wait()
+            if not args.headless:
+                key = poll_key()
+                if key in (27, ord('q')) or not workload.key(key):
+                    break
+    finally:
+        elapsed = time() - t0
+        workload.close()
+        if not args.headless:
+            cv2.destroyAllWindows()
+
+    summary = {'workload': args.workload, 'frames': frames, 'seconds': elapsed,
+               'fps': frames / elapsed if elapsed > 0 else 0.0,
+               'processing_ms': busy / frames * 1000 if frames else 0.0,
+               'cameras': [dict(grabbed=c.frames_grabbed,
+                                grab_fps=c.frames_grabbed / elapsed if elapsed > 0 else 0.0,
+                                **{k: v for k, v in c.status().items()
+                                   if k != 'since_last_frame'})
+                           for c in workload.cameras]}
+    for camera, monitor in zip(summary['cameras'], gaps):
+        camera['gaps'] = monitor.summary()
+    if pacer is not None:
+        summary['pacing'] = pacer.report()
+    summary.update(workload.summary())
+    return summary
+
+
+def print_summary(s):
+    print("{workload}: {frames} frames in {seconds:.2f} sec, {fps:.1f} fps, "
+          "{processing_ms:.1f} ms processing per frame".format(**s))
+    for i, c in enumerate(s['cameras']):
+        print("  camera {}: {grabbed} frames grabbed ({grab_fps:.1f} fps), {health}, "
+              "{failed_grabs} failed grabs, {stalls} stalls, {reconnects} reconnects".format(
+                  i, **c))
+        if 'gaps' in c:
+            print("    {gaps} gaps, {missed} frames missed (source {missed_source}, capture "
+                  "{missed_capture}, unknown {missed_unknown}), longest interval "
+                  "{worst_ms:.1f} ms".format(**c['gaps']))
+    if 'pacing' in s:
+        print("  pacing: {missed} deadlines missed, wake-up jitter {jitter_ms:.2f} ms".format(
+            **s['pacing']))
+    for k, v in s.items():
+        if k not in ('workload', 'frames', 'seconds', 'fps', 'processing_ms', 'cameras',
+                     'pacing'):
+            print("  {}: {}".format(k, v))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='python3 -m modules',
+                                     description='CSI camera workloads')
+    parser.add_argument('workload', choices=sorted(WORKLOADS))
+    parser.add_argument('--config', help='JSON file of option defaults')
+    parser.add_argument('--source', default='csi',
+                        help="'csi', a device number, a video file, raw:NAME or 'synthetic'")
+    parser.add_argument('--source2', default='1', help='second source for dual and ws_dual')
+    parser.add_argument('--sensor-id', type=int, default=0)
+    parser.add_argument('--sensor-mode', type=int, default=ws.S_MODE_3_1280_720_60)
+    parser.add_argument('--width', type=int, help='frame width (default: 1/4 of the mode)')
+    parser.add_argument('--height', type=int)
+    parser.add_argument('--flip', type=int, default=0)
+    parser.add_argument('--color-format', default='BGR', choices=('BGR', 'GRAY8', 'NV12'))
+    parser.add_argument('--policy', help='thread policy from ws_threading.POLICIES')
+    parser.add_argument('--stats', help="frame-rate statistics: none, ema, windowed, histogram")
+    parser.add_argument('--headless', action='store_true', help='no window, no HighGUI')
+    parser.add_argument('--frames', type=int, help='stop after this many frames')
+    parser.add_argument('--no-pace', dest='pace', action='store_false',
+                        help='process every new frame as it comes instead of pacing')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    parser.add_argument('--gaps', action='store_true',
+                        help='count dropped frames from the intervals between grabs')
+    # face_detect
+    parser.add_argument('--eyes', action='store_true', help='face_detect: detect eyes too')
+    parser.add_argument('--tiled', action='store_true', help='face_detect: tiled detection')
+    parser.add_argument('--crops', help='face_detect: save deduplicated face crops here')
+    parser.add_argument('--identity', default='unknown', help='face_detect: crop file prefix')
+    parser.add_argument('--known', help='face_detect: label faces from this enrollment directory')
+    parser.add_argument('--match-threshold', type=float, default=0.8,
+                        help='face_detect: lowest correlation that counts as a match')
+    parser.add_argument('--offline', metavar='OUTPUT',
+                        help='face_detect: process the --source video file as fast as '
+                             'possible and write the detections to OUTPUT (JSON lines)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='face_detect --offline: detection threads')
+    # grab_frame
+    parser.add_argument('--dest', default='known', help='grab_frame: output directory')
+    parser.add_argument('--base', default='frame', help='grab_frame: file name prefix')
+    parser.add_argument('--suffix', default='jpg')
+    parser.add_argument('--save-every', type=int, default=0,
+                        help='grab_frame: save every Nth frame (0: only on the s key)')
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.config:
+        with open(args.config) as f:
+            parser.set_defaults(**json.load(f))
+        args = parser.parse_args(argv)
+    if args.width is None or args.height is None:
+        args.width, args.height = ws.DISP_ONE_QUARTER.get(args.sensor_mode, (640, 480))
+    if args.policy:
+        from ws_threading import POLICIES
+        POLICIES[args.policy].apply_processing()
+    if args.offline:
+        if args.workload != 'face_detect':
+            parser.error('--offline only applies to face_detect')
+        if args.source == 'csi' or str(args.source).isdigit():
+            parser.error('--offline needs a recorded --source: a video file, raw:NAME or '
+                         'synthetic')
+        if args.source == 'synthetic' and not args.frames:
+            parser.error('--offline with synthetic frames needs --frames')
+        import ws_offline
+        # raw captures and synthetic frames unpaced: as fast as they can be processed
+        capture = open_source(args.source, args.width, args.height, paced=False,
+                              frames=args.frames)
+        summary = ws_offline.process_video(capture, args.offline, workers=args.workers,
+                                           eyes=args.eyes, name=args.source)
+        report = ws_offline.print_summary
+    else:
+        summary = run(WORKLOADS[args.workload](args), args)
+        report = print_summary
+    if args.json:
+        print(json.dumps(summary, default=float))
+    else:
+        report(summary)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -8,16 +8,35 @@
 
 # The class also tracks how many frames/sec are grabbed in the thread from the camera, and
 # how many frames/sec are read by the outside program. Both of these can be displayed on 
-# the image as 'frames grabbed' and 'frames read' respectively. Frames 'grabbed' are closest
+# the display image as 'frames grabbed' and 'frames read' respectively (see draw_overlay;
+# the frame returned by read() is never drawn on). Frames 'grabbed' are closest
 # to the camera's actual framerate. Frames 'read' will be slower, depending upon how much 
 # processing per frame is performed in the calling program.
 
+# How those rates are measured is a pluggable strategy (see ws_stats.py): smoothed rates,
+# per-second counters, interval histograms, or none at all, in which case neither the
+# capture thread nor read() does any statistics work. This is the one camera core shared by
+# every script in the repo (the top-level examples and instrumented/ included).
+
 # Modified to ws_csi_camera.py 12/23/20 by WSmith to get everything associated with the
 # CSI camera in one place, and simplify the frame-rate estimates. 
 
+# Region of interest (digital zoom): set_roi((left, top, right, bottom)) captures only that
+# part of the frame. For the CSI camera nvvidconv crops it in hardware (its left/right/
+# top/bottom properties), so a face can be seen at full sensor resolution while only the
+# small cropped region crosses into Python; moving it rebuilds the pipeline like
+# reconfigure(). For every other source (files, raw replays, synthetic frames) the capture
+# thread crops instead, and a move takes effect with the next frame. See ws_roi.py for
+# following a detected face with it.
+
+import asyncio
 import cv2
+import numpy as np
 import threading
 from time import time
+from ws_overlay import Overlay
+from ws_stats import EMAStats, NoStats, make_stats
+from ws_frame_bus import FramePublisher
 
 # WS mods/additions
 
@@ -64,10 +83,34 @@ S_MODE_3_1280_720_60  = 3
 # 1280x720, 120 fps 16:9 ratio
 S_MODE_4_1280_720_120 = 4
 
+# full sensor frame size of each mode
+SENSOR_SIZE = {S_MODE_0_3264_2464_21: (3264, 2464),
+               S_MODE_1_3264_1848_28: (3264, 1848),
+               S_MODE_2_1920_1080_30: (1920, 1080),
+               S_MODE_3_1280_720_60:  (1280, 720),
+               S_MODE_4_1280_720_120: (1280, 720)}
+
+# where each mode's frame lies on the 3264x2464 pixel array of the IMX219 (Raspberry Pi
+# camera v2) with the Jetson driver: (left, top) of the centred crop and the binning
+# factor, i.e. sensor pixel = (left, top) + binning * mode pixel. Used to carry a lens
+# calibration from one mode to another (ws_stereo.scaled_intrinsics)
+SENSOR_GEOMETRY = {S_MODE_0_3264_2464_21: (0,   0,   1),
+                   S_MODE_1_3264_1848_28: (0,   308, 1),
+                   S_MODE_2_1920_1080_30: (672, 692, 1),
+                   S_MODE_3_1280_720_60:  (352, 512, 2),   # 2x2 binned 2560x1440
+                   S_MODE_4_1280_720_120: (352, 512, 2)}
+
+# one-quarter display size for each sensor mode, e.g. when switching modes at runtime
+DISP_ONE_QUARTER = {S_MODE_0_3264_2464_21: (DISP_W_M0_one_quarter, DISP_H_M0_one_quarter),
+                    S_MODE_1_3264_1848_28: (DISP_W_M1_one_quarter, DISP_H_M1_one_quarter),
+                    S_MODE_2_1920_1080_30: (DISP_W_M2_one_quarter, DISP_H_M2_one_quarter),
+                    S_MODE_3_1280_720_60:  (DISP_W_M3_M4_one_quarter, DISP_H_M3_M4_one_quarter),
+                    S_MODE_4_1280_720_120: (DISP_W_M3_M4_one_quarter, DISP_H_M3_M4_one_quarter)}
+
 
 class CSI_Camera:
 
-    def __init__ (self, display_fps=True, alpha=0.95):
+    def __init__ (self, display_fps=True, alpha=0.95, stats=None):
 
         # OpenCV video capture element
         self.display_fps = display_fps
@@ -79,29 +122,131 @@ class CSI_Camera:
         self.read_thread = None
         self.read_lock = threading.Lock()
         self.running = False
-        self.font_face = cv2.FONT_HERSHEY_SIMPLEX
-        self.scale = .6             # for FPS text size
-        self.color = (255,255,255) # for FPS text color
+        # FPS text is pre-rendered and only blended in at display time
+        self.overlay = Overlay(scale=.6, color=(255,255,255))
         self.last_grab = time()
-        self.last_time = time()
-        self.fps       = 0         # grabbed frames/sec in camera thread
-        self.FRS       = 0         # frames/sec read by external program
-        self.alpha     = alpha     # smoothing factor for estimating fps and FRS
+        # frame-rate statistics strategy (see ws_stats.py): by default the smoothed
+        # rates for the FPS labels, or nothing at all when they are not displayed
+        if stats is None:
+            stats = EMAStats(alpha) if display_fps else NoStats()
+        self.set_stats(stats)
+        # optional shared-memory frame bus that other processes can read (see publish)
+        self.publisher = None
+        # bumped every time the pipeline is rebuilt (see reconfigure); consumers compare
+        # it with the value they last saw to notice a new mode or frame size
+        self.generation    = 0
+        self.open_time     = 0     # seconds spent constructing the pipeline
+        self.first_frame_time = 0  # seconds from pipeline open to the first frame
+        self.reconfigure_time = 0  # seconds from quiescing to the first new frame
+        self.sensor_id      = 0
+        self.sensor_mode    = None
+        self.display_width  = None
+        self.display_height = None
+        self.flip_method    = 0
+        self.color_format   = 'BGR'   # appsink format: 'BGR', 'GRAY8' or 'NV12'
+        # Capture watchdog: the capture is reopened (with exponential backoff) after
+        # max_failures failed grabs in a row, or when no frame has arrived for
+        # stall_periods frame periods. The watchdog thread only flags the stall; the
+        # capture thread, the only one that touches the VideoCapture, releases and
+        # reopens it. A GStreamer read() is given a timeout of the same length (where
+        # OpenCV supports CAP_PROP_READ_TIMEOUT_MSEC) so a hung pipeline returns to it;
+        # until the first frame it is first_frame_timeout instead, since nvargus takes
+        # far longer than a few frame periods to deliver its first buffer.
+        self.source        = None   # what open() was last called with
+        self.health        = 'stopped'  # 'ok', 'stalled', 'reconnecting' or 'stopped'
+        self.failed_grabs  = 0
+        self.stalls        = 0
+        self.reconnects    = 0
+        self.max_failures  = 10
+        self.stall_periods = 5
+        self.first_frame_timeout = 10.0   # seconds
+        self.backoff_min   = 0.1    # seconds
+        self.backoff_max   = 5.0
+        self.watch_thread  = None
+        self.stopping      = threading.Event()
+        # optional ws_threading.ThreadPolicy, applied by the capture thread when it starts
+        self.thread_policy = None
+        # optional deque: when set, the capture thread appends the time of every grab
+        self.grab_log      = None
+        # callables sink(frame, timestamp, seq) run in the capture thread for every
+        # grabbed frame, e.g. ws_raw_capture.RawWriter.write
+        self.sinks          = []
+        self.consumer_errors  = 0    # exceptions from sinks and the publisher
+        self.failed_consumers = []   # the sinks/publishers that raised, reported once
+        self.frames_grabbed = 0     # sequence number of the last grabbed frame
+        self.async_skipped  = 0     # frames that frames() consumers were too slow to see
+        # optional resize in the capture thread (see set_output_size)
+        self.output_size    = None
+        self.interpolation  = cv2.INTER_LINEAR
+        self.output_buffers = []
+        self.output_index   = 0
+        # region of interest (see set_roi): in sensor pixels for the CSI pipeline, where
+        # nvvidconv crops it, else in source pixels, cropped here by the capture thread
+        self.roi            = None  # (left, top, right, bottom) or None for the full frame
+        self.crop           = None  # the ROI when the capture thread crops it
+        self.source_size    = None  # (width, height) of the uncropped source frames
+        self.full_output    = None  # output size without an ROI, restored by set_roi(None)
         # explicitly set the correct framerate per mode or there can be trouble
         self.framerate = {0:21, 1:28, 2:30, 3:60, 4:120}
  
     def open(self, gstreamer_pipeline_string):
+        # gstreamer_pipeline_string may also be a device number, or any object with the
+        # VideoCapture read()/isOpened()/release() methods (e.g. ws_raw_capture.RawReplay)
+        self.source = gstreamer_pipeline_string
+        t0 = time()
         try:
-            self.video_capture = cv2.VideoCapture(gstreamer_pipeline_string, 
-                                                  cv2.CAP_GSTREAMER)
+            if hasattr(gstreamer_pipeline_string, 'read'):
+                self.video_capture = gstreamer_pipeline_string
+            else:
+                self.video_capture = self._open_capture(gstreamer_pipeline_string)
+                if self.color_format != 'BGR':
+                    # hand over GRAY8/NV12 buffers as they are
+                    self.video_capture.set(cv2.CAP_PROP_CONVERT_RGB, 0)
             
         except RuntimeError:
             self.video_capture = None
             print("Unable to open camera")
-            print("Pipeline: " + gstreamer_pipeline_string)
+            print("Pipeline: " + str(gstreamer_pipeline_string))
             return
+        t1 = time()
         # Grab the first frame to start the video capturing
-        self.grabbed, self.frame = self.video_capture.read()
+        grabbed, frame = self.video_capture.read()
+        if grabbed and not hasattr(gstreamer_pipeline_string, 'read'):
+            # from now on a read that takes a few frame periods has stalled
+            self._set_read_timeout(self.stall_periods * self.frame_period())
+        if grabbed and frame is not None:
+            self.source_size = (frame.shape[1], frame.shape[0])
+            frame = self.at_source(frame)
+        with self.read_lock:
+            self.grabbed, self.frame = grabbed, frame
+            self.last_grab = time()
+        self.open_time = t1 - t0
+        self.first_frame_time = self.last_grab - t1
+
+    def _open_capture(self, pipeline):
+        if hasattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC'):
+            timeout = int(self.first_frame_timeout * 1000)
+            try:
+                return cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER,
+                                        [cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout])
+            except (TypeError, cv2.error):
+                pass   # no open parameters in this OpenCV build
+        return cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+
+    def _set_read_timeout(self, seconds):
+        # where the build cannot change it after opening, the first-frame timeout stays and
+        # the watchdog alone detects stalls
+        if hasattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC') and hasattr(self.video_capture, 'set'):
+            try:
+                self.video_capture.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(seconds * 1000))
+            except cv2.error:
+                pass
+
+    def frame_period(self):
+        # seconds between frames the capture should deliver
+        if self.sensor_mode in self.framerate:
+            return 1.0 / self.framerate[self.sensor_mode]
+        return 1.0 / 30    # webcams and other sources
 
     def start(self):
         if self.running:
@@ -110,51 +255,462 @@ class CSI_Camera:
         # create a thread to read the camera image
         if self.video_capture != None:
             self.running=True
+            self.health = 'ok'
+            self.last_grab = time()   # the watchdog measures stalls from here
+            self.stopping.clear()
             self.read_thread = threading.Thread(target=self.updateCamera)
             self.read_thread.start()
+            self.watch_thread = threading.Thread(target=self.watchCamera, daemon=True)
+            self.watch_thread.start()
         return self
 
     def stop(self):
         self.running=False
-        self.read_thread.join()
+        self.stopping.set()
+        # the threads may never have been started (e.g. the camera did not open)
+        if self.read_thread is not None:
+            self.read_thread.join()
+            self.read_thread = None
+        if self.watch_thread is not None:
+            self.watch_thread.join()
+            self.watch_thread = None
+        self.health = 'stopped'
 
     def updateCamera(self):
         # This is the thread to read images from the camera
+        if self.thread_policy is not None:
+            self.thread_policy.apply_capture()
+        failures = 0
         while self.running:
+            capture = self.video_capture
             try:
-                grabbed, frame = self.video_capture.read()
+                grabbed, frame = capture.read() if capture is not None else (False, None)
+            except (RuntimeError, cv2.error):
+                grabbed, frame = False, None
+            if not grabbed or frame is None:
+                # keep the last good frame out of read(): consumers get an explicit
+                # 'no frame' until the capture recovers
+                failures += 1
+                self.failed_grabs += 1
                 with self.read_lock:
-                    self.grabbed = grabbed
-                    self.frame   = frame
-                    dt           = time() - self.last_grab
-                    self.last_grab = time()
-                    # estimate grabbing rate
-                    self.fps = self.alpha * self.fps + (1 - self.alpha) / dt
-            except RuntimeError:
-                print("Could not read image from camera")
-        
-    def read(self):
+                    self.grabbed = False
+                if failures >= self.max_failures or self.health == 'stalled' or \
+                   capture is None:
+                    self.reconnect()
+                    failures = 0
+                continue
+            failures = 0
+            if self.health == 'stalled':
+                # the frame came late but it came: the capture recovered by itself
+                self.health = 'ok'
+            frame = self.at_source(frame)
+            t = time()
+            with self.read_lock:
+                self.grabbed   = grabbed
+                self.frame     = frame
+                self.last_grab = t
+            if self.on_grab is not None:
+                self.on_grab(t)
+            if self.grab_log is not None:
+                self.grab_log.append(t)
+            self.frames_grabbed += 1
+            # a failing consumer is reported, but must not end the capture thread
+            for sink in self.sinks:
+                try:
+                    sink(frame, t, self.frames_grabbed)
+                except Exception as e:
+                    self._consumer_failed(sink, e)
+            publisher = self.publisher
+            if publisher is not None:
+                try:
+                    if frame.nbytes > publisher.slot_bytes:
+                        # set_output_size()/set_roi() made the frames larger than the slots
+                        publisher = self._resize_publisher(frame)
+                    publisher.write(frame, t)
+                except Exception as e:
+                    self._consumer_failed(publisher, e)
+
+    def _consumer_failed(self, consumer, e):
+        # reported once per consumer, counted every time
+        self.consumer_errors += 1
+        if consumer not in self.failed_consumers:
+            self.failed_consumers.append(consumer)
+            print("Camera consumer {!r} failed: {!r}".format(consumer, e))
+
+    def watchCamera(self):
+        # Watchdog thread: a stalled pipeline blocks inside read() without ever returning
+        # an error, so it is detected here from the time since the last frame. It only
+        # flags the stall: releasing a VideoCapture while another thread is inside read()
+        # is not safe in OpenCV. The capture thread reconnects when its read() fails (or
+        # times out) while the camera is flagged, and clears the flag if a frame arrives.
+        period = self.frame_period()
+        while not self.stopping.wait(period):
+            if self.health == 'ok' and time() - self.last_grab > self.stall_time(period):
+                print("Camera stalled: no frame for {:.2f} sec".format(time() - self.last_grab))
+                self.health = 'stalled'
+                self.stalls += 1
+
+    def stall_time(self, period):
+        # seconds without a frame that count as a stall; a paced source such as a raw
+        # replay reports how long it is deliberately waiting for its next frame
+        allowed = self.stall_periods * period
+        interval = getattr(self.video_capture, 'frame_interval', None)
+        expected = interval() if interval is not None else None
+        return allowed + expected if expected else allowed
+
+    def reconnect(self):
+        # Reopen the capture, backing off exponentially between attempts. Called from the
+        # capture thread; returns when a frame arrives or the camera is stopped.
+        if hasattr(self.source, 'read'):
+            # a replay or other object source has ended; it cannot be reopened
+            self.running = False
+            self.health = 'stopped'
+            return
+        delay = self.backoff_min
+        while self.running:
+            self.health = 'reconnecting'
+            if self.video_capture is not None:
+                self.video_capture.release()
+                self.video_capture = None
+            if self.stopping.wait(delay):
+                return
+            self.reconnects += 1
+            print("Reopening camera (attempt {}, waited {:.1f} sec)".format(self.reconnects, delay))
+            self.open(self.source)
+            if self.video_capture is not None and self.grabbed:
+                self.health = 'ok'
+                return
+            delay = min(delay * 2, self.backoff_max)
+
+    def status(self):
+        # capture health and watchdog counters, e.g. for logging or a HUD
+        return {'health': self.health, 'failed_grabs': self.failed_grabs,
+                'stalls': self.stalls, 'reconnects': self.reconnects,
+                'since_last_frame': time() - self.last_grab}
+
+    def set_output_size(self, width, height, interpolation=cv2.INTER_LINEAR, buffers=4):
+        # Have the capture thread resize every new frame to (width, height), once, into a
+        # ring of preallocated buffers, e.g. to match a webcam to the picam pane of a
+        # composite. Consumers then get frames at that size without resizing on every
+        # iteration. Frames handed out without a copy (latest(), read_gray(), sinks,
+        # frames()) stay valid for `buffers` grabs. width=None turns resizing off.
+        if self.color_format == 'NV12':
+            raise ValueError("Resizing at the source is not supported for NV12 capture")
         with self.read_lock:
-            frame   = self.frame.copy()
-            grabbed = self.grabbed
-            dt      = time() - self.last_time
-            self.last_time = time()
+            self.output_size    = (width, height) if width else None
+            self.interpolation  = interpolation
+            self.output_buffers = [None] * buffers
+            self.output_index   = 0
+
+    def at_source(self, frame):
+        # capture thread: the crop and resize of every new frame. The settings are read
+        # once per frame, under the lock, so a concurrent set_output_size or set_roi takes
+        # effect between two frames and never half-way through one
+        with self.read_lock:
+            crop = self.crop
+            size, interpolation = self.output_size, self.interpolation
+            if size is not None:
+                buffers = self.output_buffers
+                self.output_index = i = (self.output_index + 1) % len(buffers)
+        if crop is not None:
+            frame = self.crop_at_source(frame, crop)
+        if size is not None:
+            frame = self.resize_at_source(frame, size, interpolation, buffers, i)
+        return frame
+
+    def resize_at_source(self, frame, size, interpolation, buffers, i):
+        # resize into buffer i of the ring
+        w, h = size
+        if frame.shape[0] == h and frame.shape[1] == w:
+            return frame
+        buf = buffers[i]
+        shape = (h, w) + frame.shape[2:]
+        if buf is None or buf.shape != shape or buf.dtype != frame.dtype:
+            buf = buffers[i] = np.empty(shape, frame.dtype)
+        return cv2.resize(frame, (w, h), buf, interpolation=interpolation)
+
+    def crop_at_source(self, frame, crop):
+        # the ROI of a source that cannot crop itself. A compact copy, so consumers and
+        # sinks get a contiguous frame no larger than the ROI
+        left, top, right, bottom = crop
+        return np.ascontiguousarray(frame[top:bottom, left:right])
+
+    def hardware_roi(self):
+        # True when the ROI is cropped by nvvidconv in this camera's own CSI pipeline
+        return self.sensor_mode is not None and \
+               self.source == getattr(self, '_gstreamer_pipeline', None)
+
+    def full_size(self):
+        # (width, height) of the uncropped frame the ROI coordinates refer to
+        if self.hardware_roi():
+            return SENSOR_SIZE[self.sensor_mode]
+        return self.source_size
+
+    def set_roi(self, roi, width=None, height=None):
+        # Capture only roi = (left, top, right, bottom) of the full frame (see full_size),
+        # delivered at width x height (default: the ROI's own size, i.e. full resolution);
+        # roi=None goes back to the whole frame at the size it had before. The ROI is
+        # clipped to the frame and rounded to even pixels (NV12 chroma). Consumers notice
+        # the change through self.generation. Returns False if the camera did not deliver
+        # a frame afterwards (CSI pipeline only).
+        full = self.full_size()
+        if roi is not None:
+            if full is None:
+                raise ValueError("No frame yet: the ROI cannot be placed")
+            left, top, right, bottom = [int(v) & ~1 for v in roi]
+            left, top = max(left, 0), max(top, 0)
+            right, bottom = min(right, full[0] & ~1), min(bottom, full[1] & ~1)
+            if right - left < 2 or bottom - top < 2:
+                raise ValueError("Empty ROI: {}".format(roi))
+            roi = (left, top, right, bottom)
+            if width is None:
+                width, height = right - left, bottom - top
+        if self.hardware_roi():
+            if roi is not None and self.roi is None:
+                self.full_output = (self.display_width, self.display_height)
+            if roi is None:
+                width, height = self.full_output or SENSOR_SIZE[self.sensor_mode]
+            return self.reconfigure(self.sensor_mode, width, height, roi=roi)
+        if roi is not None and self.roi is None:
+            self.full_output = self.output_size
+        # frames come at the ROI's own size unless another one was asked for
+        if roi is None:
+            size = self.full_output
+        elif (width, height) != (roi[2] - roi[0], roi[3] - roi[1]):
+            size = (width, height)
+        else:
+            size = None
+        if size != self.output_size:
+            self.set_output_size(*(size or (None, None)), interpolation=self.interpolation)
+        with self.read_lock:
+            self.roi = self.crop = roi
+            self.generation += 1
+        return True
+
+    def latest(self):
+        # the newest frame as grabbed (no copy, in the capture format) and the read-rate
+        # bookkeeping shared by read() and read_gray(). The capture thread only ever
+        # replaces self.frame, never writes into it (with set_output_size, not for the
+        # next few grabs), so the frame can be used without holding the lock. Returns
+        # (False, None) while there is no valid frame (failed grab, camera reconnecting)
+        # instead of raising.
+        with self.read_lock:
+            if not self.grabbed or self.frame is None:
+                return False, None
+            frame = self.frame
+        if self.on_read is not None:
+            self.on_read(time())
+            if self.display_fps:
+                for i, txt in enumerate(self.stats.labels()):
+                    self.overlay.set_text(i, txt, (10, 20 + 30 * i))
+        return True, frame
+
+    def displayed(self):
+        # tell the stats strategy that the application has shown a frame
+        if self.on_display is not None:
+            self.on_display(time())
+
+    def set_stats(self, stats):
+        # switch the statistics strategy: a ws_stats.Stats instance or a name from
+        # ws_stats.STATS. With 'none' the capture and read paths skip statistics entirely.
+        self.stats = make_stats(stats)
+        enabled = self.stats.enabled
+        self.on_grab    = self.stats.grabbed   if enabled else None
+        self.on_read    = self.stats.read      if enabled else None
+        self.on_display = self.stats.displayed if enabled else None
+        self.overlay.clear()
+        return self.stats
+
+    @property
+    def fps(self):
+        # grabbed frames/sec as estimated by the stats strategy (0 without statistics)
+        return self.stats.summary().get('grab_fps', 0.0)
+
+    def read(self, out=None):
+        # a BGR frame the caller owns (and may draw on). In GRAY8/NV12 capture mode the
+        # conversion to BGR happens here, only for consumers that need color. out is an
+        # optional preallocated BGR buffer (see ws_buffers.BufferPool) that is filled
+        # instead of allocating a new copy; it is replaced if its size does not match.
+        grabbed, frame = self.latest()
+        if not grabbed:
+            return False, None
+        return True, self.bgr_of(frame, out)
+
+    def read_gray(self):
+        # a grayscale frame for detection. In GRAY8 mode it is the frame itself and in
+        # NV12 mode a view of its Y plane: no conversion and no copy. Treat it as
+        # read-only; in BGR mode it is converted.
+        grabbed, frame = self.latest()
+        if not grabbed:
+            return False, None
+        return True, self.gray_of(frame)
+
+    def gray_of(self, frame, out=None):
+        # read_gray() of a frame from latest(). Detection loops that also draw take the
+        # frame once and derive both images from it, so the boxes found in the gray image
+        # belong to the color image they are drawn on:
+        #   ok, frame = camera.latest()
+        #   faces = cascade.detectMultiScale(camera.gray_of(frame), 1.3, 5)
+        #   img = camera.bgr_of(frame)      # only if it is drawn or shown
+        # out is an optional buffer for the conversion in BGR mode
+        if frame.ndim == 3:
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, out)
+        if self.color_format == 'NV12':
+            return frame[:frame.shape[0] * 2 // 3]
+        return frame
+
+    def bgr_of(self, frame, out=None):
+        # read() of a frame from latest(): a BGR copy the caller owns
+        if frame.ndim == 2:
+            code = cv2.COLOR_YUV2BGR_NV12 if self.color_format == 'NV12' \
+                   else cv2.COLOR_GRAY2BGR
+            return cv2.cvtColor(frame, code, out)
+        if out is None or out.shape != frame.shape or out.dtype != frame.dtype:
+            return frame.copy()
+        np.copyto(out, frame)
+        return out
+
+    def draw_overlay(self, img, offset=(0,0)):
+        # blend the FPS labels into a display image (in place); offset positions them
+        # within a composite of several cameras
         if self.display_fps:
-            # estimate reading rate
-            self.FRS = self.alpha * self.FRS + (1 - self.alpha) / dt
-            txt = "Frames Read/   Sec: {:3.1f}".format(self.FRS)
-            cv2.putText(frame, txt, (10,20), self.font_face, self.scale, self.color, 1, cv2.LINE_AA)
-            txt = "Frames Grabbed/Sec: {:3.1f}".format(self.fps)
-            cv2.putText(frame, txt, (10,50), self.font_face, self.scale, self.color, 1, cv2.LINE_AA)
-        return grabbed, frame
+            self.overlay.compose(img, offset)
+        return img
+
+    # asyncio interface:
+    #   await camera.astart()
+    #   async for frame in camera.frames():
+    #       ...
+    #   await camera.astop()
+    # The capture thread wakes the event loop through call_soon_threadsafe; there is no
+    # executor hop per frame.
+
+    async def astart(self):
+        # open (if needed) and start without blocking the event loop
+        loop = asyncio.get_running_loop()
+        if self.video_capture is None:
+            await loop.run_in_executor(None, self.open, self.gstreamer_pipeline)
+        await loop.run_in_executor(None, self.start)
+        return self
+
+    async def astop(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.stop)
+
+    async def frames(self, gray=False, stop_on_exit=False):
+        # Yields every new frame as it is grabbed. A slow consumer is not queued up: it
+        # gets the newest frame when it asks for the next one (latest wins) and the
+        # skipped frames are counted in self.async_skipped. Frames are not copied, so
+        # treat them as read-only (gray=True yields luma, as read_gray() does). When the
+        # consumer stops iterating or is cancelled, the sink is removed; with
+        # stop_on_exit the capture thread is stopped too. (After a break, Python only
+        # closes the generator later; wrap it in contextlib.aclosing to close at once.)
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        state = {'frame': None, 'pending': False}
+
+        def deliver():
+            state['pending'] = False
+            ready.set()
+
+        def on_frame(frame, timestamp, seq):
+            # capture thread: keep only the newest frame, wake the loop at most once
+            if state['frame'] is not None:
+                self.async_skipped += 1
+            state['frame'] = frame
+            if not state['pending']:
+                state['pending'] = True
+                try:
+                    loop.call_soon_threadsafe(deliver)
+                except RuntimeError:
+                    pass   # the event loop is closed
+
+        self.add_sink(on_frame)
+        try:
+            while self.running:
+                try:
+                    await asyncio.wait_for(ready.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    continue
+                ready.clear()
+                frame, state['frame'] = state['frame'], None
+                if frame is None:
+                    continue
+                if gray:
+                    frame = self.gray_of(frame)
+                elif frame.ndim == 2:
+                    frame = self.bgr_of(frame)
+                yield frame
+        finally:
+            self.remove_sink(on_frame)
+            if stop_on_exit:
+                await loop.run_in_executor(None, self.stop)
+
+    def add_sink(self, sink):
+        self.sinks = self.sinks + [sink]   # swapped, not mutated, under the capture thread
+
+    def remove_sink(self, sink):
+        self.sinks = [s for s in self.sinks if s != sink]
+
+    def publish(self, name, slots=4):
+        # Publisher mode: every grabbed frame is also written to a shared-memory ring
+        # (see ws_frame_bus.py) so that other processes can read this camera through a
+        # FrameSubscriber. Call after open(); the slots are sized from the first frame.
+        if self.frame is None:
+            print("Open the camera before publishing it")
+            return None
+        self.publisher = FramePublisher(name, self.frame.shape, self.frame.dtype, slots)
+        return self.publisher
+
+    def _resize_publisher(self, frame):
+        # a frame bus with slots for frame, under the same name; closing the old one bumps
+        # the generation, so subscribers attach again to the resized ring
+        old = self.publisher
+        name, slots, generation = old.name, old.slots, old.generation + 1
+        old.close()
+        self.publisher = FramePublisher(name, frame.shape, frame.dtype, slots, generation)
+        return self.publisher
+
+    def reconfigure(self, sensor_mode, display_width, display_height, roi=None):
+        # Switch sensor mode and output size (and ROI, see set_roi) in place: quiesce the
+        # capture thread, rebuild and reopen the pipeline, resize the frame bus if needed
+        # and resume capturing. The camera object (and so every consumer's handle) stays
+        # the same; consumers notice the switch through self.generation. Returns False if
+        # the new pipeline did not deliver a frame.
+        t0 = time()
+        was_running = self.running
+        if roi is None:
+            self.full_output = None
+        self.stop()
+        if self.video_capture is not None:
+            self.video_capture.release()
+            self.video_capture = None
+        self.create_gstreamer_pipeline(sensor_id=self.sensor_id, sensor_mode=sensor_mode,
+                                       display_width=display_width,
+                                       display_height=display_height,
+                                       flip_method=self.flip_method,
+                                       color_format=self.color_format, roi=roi)
+        self.open(self.gstreamer_pipeline)
+        if self.video_capture is None or self.frame is None:
+            return False
+        if self.publisher is not None and self.frame.nbytes > self.publisher.slot_bytes:
+            self._resize_publisher(self.frame)
+        self.stats.reset()
+        with self.read_lock:
+            self.generation += 1
+        self.reconfigure_time = time() - t0
+        if was_running:
+            self.start()
+        return True
 
     def release(self):
+        # kill the thread first, so it never reads from a released capture
+        self.stop()
         if self.video_capture != None:
             self.video_capture.release()
             self.video_capture = None
-        # kill the thread
-        if self.read_thread != None:
-            self.read_thread.join()
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
 
     @property
     def gstreamer_pipeline(self):
@@ -166,20 +722,51 @@ class CSI_Camera:
     #         will be overridden and slower than desired. To get around this, the framerate is
     #         set using a dictionary that explicitly maps sensor mode to framerate. 
 
+    # color_format selects what appsink delivers:
+    #   'BGR'    the usual BGRx -> videoconvert -> BGR path
+    #   'GRAY8'  nvvidconv outputs luma only; no videoconvert at all
+    #   'NV12'   nvvidconv outputs NV12 (Y plane followed by interleaved UV), which
+    #            OpenCV hands over unconverted as a (3/2 height) x width single-channel
+    #            image; read_gray() returns the Y plane as a view and read() converts
+    #            to BGR on demand
+
+    # roi=(left, top, right, bottom) in sensor pixels crops in nvvidconv, before scaling
+    # to display_width x display_height
+
     def create_gstreamer_pipeline(self, sensor_id=0, sensor_mode=3, display_width=1280,
-                                  display_height=720, flip_method=0):
+                                  display_height=720, flip_method=0, color_format='BGR',
+                                  roi=None):
+
+        # remembered so that reconfigure() can rebuild the pipeline
+        self.sensor_id      = sensor_id
+        self.sensor_mode    = sensor_mode
+        self.display_width  = display_width
+        self.display_height = display_height
+        self.flip_method    = flip_method
+        self.color_format   = color_format
+        self.roi            = roi
+        self.crop           = None
+
+        if color_format == 'BGR':
+            output = ("video/x-raw, width=(int)%d, height=(int)%d, format=(string)BGRx ! "
+                      "videoconvert ! "
+                      "video/x-raw, format=(string)BGR ! appsink"
+                      % (display_width, display_height))
+        elif color_format in ('GRAY8', 'NV12'):
+            output = ("video/x-raw, width=(int)%d, height=(int)%d, format=(string)%s ! "
+                      "appsink"
+                      % (display_width, display_height, color_format))
+        else:
+            raise ValueError("color_format must be 'BGR', 'GRAY8' or 'NV12'")
 
         self._gstreamer_pipeline = (
             "nvarguscamerasrc sensor-id=%d sensor-mode=%d ! "
             "video/x-raw(memory:NVMM), "
             "format=(string)NV12, framerate=(fraction)%d/1 ! "
-            "nvvidconv flip-method=%d ! "
-            "video/x-raw, width=(int)%d, height=(int)%d, format=(string)BGRx ! "
-            "videoconvert ! "
-            "video/x-raw, format=(string)BGR ! appsink"
-            % (sensor_id, sensor_mode, self.framerate[sensor_mode], flip_method, 
-               display_width, display_height)
-        )
+            "nvvidconv flip-method=%d%s ! "
+            % (sensor_id, sensor_mode, self.framerate[sensor_mode], flip_method,
+               " left=%d top=%d right=%d bottom=%d" % roi if roi is not None else "")
+        ) + output
 
 
     
@@ -5,6 +5,8 @@
 import cv2
 import numpy as np
 import ws_csi_camera as ws
+from ws_startup import open_cameras, release_cameras
+from ws_pacing import FramePacer, poll_key
 from importlib import reload
 
 reload(ws)  # ws is under development
@@ -16,39 +18,61 @@ def display(sensor_mode=ws.S_MODE_3_1280_720_60,
 
     # at present, display the picam and a webcam: in the future, display two picams
 
-    picam  = ws.CSI_Camera(display_fps=display_fps)
-    webcam = ws.CSI_Camera(display_fps=display_fps)
+    # open both cameras concurrently, so their warm-up times overlap
+    reports = open_cameras([dict(sensor_id=0, sensor_mode=sensor_mode, flip_method=0,
+                                 display_height=dispH, display_width=dispW,
+                                 display_fps=display_fps),
+                            dict(device=1, display_fps=display_fps)])
+    picam, webcam = [r.camera for r in reports]
+    if not all(r.ok and not r.timed_out for r in reports):
+        print("Unable to open both cameras")
+        release_cameras(reports)
+        return
 
-    # this only needed for the picam
-    picam.create_gstreamer_pipeline(sensor_id=0, sensor_mode=sensor_mode, flip_method=0,
-                                    display_height=dispH, display_width=dispW)
-
-    picam.open(picam.gstreamer_pipeline)
-    webcam.open(1)
-
-    picam.start()
-    webcam.start()
+    # the webcam's capture thread resizes its frames to the picam pane, once per frame
+    webcam.set_output_size(dispW, dispH)
 
     txt = "Picam on left: Sensor Mode {}, Display {} x {}".format(sensor_mode, dispW, dispH)
     cv2.namedWindow(txt, cv2.WINDOW_AUTOSIZE)
 
+    # one iteration per picam frame, woken just after it arrives
+    pacer = FramePacer(camera=picam)
+
     while True:
 
-        _, imgL = picam.read()
-        _, imgR = webcam.read()
+        okL, imgL = picam.read()
+        okR, imgR = webcam.read()
+
+        # a camera that is reconnecting returns no frame: keep showing the last composite
+        if okL and okR:
+            img = np.hstack((imgL, imgR))
 
-        imgR = cv2.resize(imgR, (imgL.shape[1], imgL.shape[0]))
-        img = np.hstack((imgL, imgR))
+            # FPS labels go on the composite only, never on the frames themselves
+            picam.draw_overlay(img)
+            webcam.draw_overlay(img, offset=(imgL.shape[1], 0))
 
-        cv2.imshow(txt, img)
+            cv2.imshow(txt, img)
 
-        keyCode = cv2.waitKey(5) & 0xFF
+        pacer.wait()
+        keyCode = poll_key()
         
         if keyCode == ord('q'):
             break
 
-    picam.stop()
-    webcam.stop()
+        if ord('0') <= keyCode <= ord('4'):
+            # switch the picam to another sensor mode without restarting the script
+            sensor_mode = keyCode - ord('0')
+            dispW, dispH = ws.DISP_ONE_QUARTER[sensor_mode]
+            webcam.set_output_size(dispW, dispH)
+            if picam.reconfigure(sensor_mode, dispW, dispH):
+                print("Sensor mode {}: first frame after {:.2f} sec".format(
+                    sensor_mode, picam.reconfigure_time))
+            cv2.destroyWindow(txt)
+            txt = "Picam on left: Sensor Mode {}, Display {} x {}".format(sensor_mode, dispW, dispH)
+            cv2.namedWindow(txt, cv2.WINDOW_AUTOSIZE)
+            pacer.reset()
+
+    print(pacer)
     picam.release()
     webcam.release()
     cv2.destroyAllWindows()
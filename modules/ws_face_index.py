@@ -0,0 +1,256 @@
+# ws_face_index.py
+# Index of enrolled face images, matching all faces of a frame in one matrix product
+
+# The known/ directory (grab_frame_from_video.py, FaceCropStore) holds images named
+# <identity>_<n>.<suffix>. Comparing every face in a frame with every image, one pair at a
+# time, does not scale past a few dozen people. A FaceIndex instead keeps one feature
+# vector per enrolled image:
+#   - the face as grayscale, downsampled to size (32x32 by default), with the mean
+#     subtracted and scaled to unit length; the dot product of two vectors is then the
+#     correlation of the two faces, 1.0 for identical images, independent of brightness
+#     and contrast
+#   - all vectors in one contiguous float32 matrix, n x (32*32), kept in the directory
+#     (.face_index/features.f32) and memory-mapped, so startup does not recompute or even
+#     read the whole index
+# match_faces() computes the vectors of all faces of a frame and multiplies them with the
+# matrix in a single product (faces x enrolled), then takes the best match per face.
+#   index = FaceIndex('known', cascade=face_cascade)
+#   for (x, y, w, h), (identity, score) in zip(faces, index.match_faces(img, faces)): ...
+# update() adds images that appeared since the last scan, appending their rows to the
+# matrix file; poll() does that at most every `interval` seconds, and only if the
+# directory changed, so it can be called every frame. If images were removed the index is
+# rebuilt.
+# Images should be face crops (FaceCropStore). Whole frames, as grab_frame saves them, are
+# cropped to their largest face when a cascade is given; frames without a face are skipped.
+# Images no larger than crop_size are crops already and used as they are. Without a
+# cascade every image is taken as a face crop. An index built one way is rebuilt
+# when opened the other way.
+
+import json
+import os
+import re
+from time import time
+import cv2
+import numpy as np
+from ws_face_store import crop_face
+
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def face_feature(img, size=(32, 32)):
+    # zero-mean, unit-length float32 vector of the downsampled luma
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if gray.shape[1] != size[0] or gray.shape[0] != size[1]:
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    v = gray.astype(np.float32).ravel()
+    v -= v.mean()
+    n = np.linalg.norm(v)
+    return v / n if n > 0 else v
+
+
+def identity_of(name):
+    # 'WS_12.png' -> 'WS'; names without a number are their own identity
+    stem = os.path.splitext(name)[0]
+    m = re.match(r'^(.*)_(\d+)$', stem)
+    return m.group(1) if m else stem
+
+
+class FaceIndex:
+
+    def __init__(self, directory, size=(32, 32), margin=0.2, threshold=0.8,
+                 cascade=None, interval=1.0, crop_size=(112, 112)):
+
+        self.directory = directory
+        self.size      = size       # (width, height) the faces are downsampled to
+        self.dim       = size[0] * size[1]
+        self.margin    = margin     # same margin as FaceCropStore, for the same framing
+        self.threshold = threshold  # lowest correlation that counts as a match
+        self.cascade   = cascade    # to find the face in whole-frame images, or None
+        self.interval  = interval   # seconds between directory checks in poll()
+        self.crop_size = crop_size  # FaceCropStore's size: images up to it are crops
+        self.path      = os.path.join(directory, '.face_index')
+        self.names     = []         # enrolled file names, one per matrix row
+        self.labels    = []         # identity names
+        self.label_of  = np.zeros(0, np.int32)   # row -> index into labels
+        self.matrix    = np.zeros((0, self.dim), np.float32)
+        self.skipped   = set()      # images without a face, not retried until a rebuild
+        self.mtime     = None
+        self.last_poll = 0.0
+        self.matches   = 0
+        os.makedirs(self.path, exist_ok=True)
+        if self._load():
+            self.update()
+        else:
+            self.rebuild()
+
+    @property
+    def count(self):
+        return len(self.names)
+
+    def _files(self):
+        return os.path.join(self.path, 'features.f32'), os.path.join(self.path, 'index.json')
+
+    def _load(self):
+        # False if there is no usable index (missing, other size, damaged)
+        features, meta = self._files()
+        try:
+            with open(meta) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if tuple(info.get('size', ())) != tuple(self.size) or not os.path.exists(features):
+            return False
+        if info.get('cropped', False) != (self.cascade is not None):
+            return False
+        names = info['names']
+        rows = os.path.getsize(features) // (4 * self.dim)
+        if rows < len(names):
+            return False
+        if rows > len(names):
+            # rows appended but the names not saved (interrupted update): drop them
+            with open(features, 'r+b') as f:
+                f.truncate(len(names) * 4 * self.dim)
+        self._append_names(names)
+        self._map()
+        return True
+
+    def _map(self):
+        features = self._files()[0]
+        if self.count == 0:
+            self.matrix = np.zeros((0, self.dim), np.float32)
+        else:
+            self.matrix = np.memmap(features, np.float32, 'r', shape=(self.count, self.dim))
+
+    def _append_names(self, names):
+        rows = []
+        for name in names:
+            identity = identity_of(name)
+            if identity not in self.labels:
+                self.labels.append(identity)
+            rows.append(self.labels.index(identity))
+        self.names.extend(names)
+        self.label_of = np.concatenate([self.label_of, np.array(rows, np.int32)])
+
+    def _face(self, img):
+        if self.cascade is not None and (img.shape[1] > self.crop_size[0] or
+                                         img.shape[0] > self.crop_size[1]):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            faces = self.cascade.detectMultiScale(gray, 1.3, 5)
+            if len(faces) == 0:
+                return None
+            img = crop_face(img, max(faces, key=lambda b: b[2] * b[3]), self.margin)
+        return img
+
+    def rebuild(self):
+        features, meta = self._files()
+        for path in (features, meta):
+            if os.path.exists(path):
+                os.remove(path)
+        self.names, self.labels = [], []
+        self.label_of = np.zeros(0, np.int32)
+        self.skipped = set()
+        self.mtime = None
+        self._map()
+        return self.update()
+
+    def update(self):
+        # add new images; returns how many were added
+        self.mtime = os.stat(self.directory).st_mtime_ns
+        files = sorted(n for n in os.listdir(self.directory)
+                       if n.lower().endswith(IMAGE_SUFFIXES))
+        present = set(files)
+        if any(n not in present for n in self.names):
+            return self.rebuild()
+        known = set(self.names) | self.skipped
+        new, vectors = [], []
+        for name in files:
+            if name in known:
+                continue
+            img = cv2.imread(os.path.join(self.directory, name))
+            if img is None:
+                continue                              # e.g. still being written: retried
+            face = self._face(img)
+            if face is None:
+                self.skipped.add(name)
+                continue
+            new.append(name)
+            vectors.append(face_feature(face, self.size))
+        if not new:
+            return 0
+        features, meta = self._files()
+        # rows first, names last: an interrupted update leaves extra rows, which _load drops
+        self.matrix = None                            # release the old mapping
+        with open(features, 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, np.float32).tobytes())
+        self._append_names(new)
+        with open(meta + '.tmp', 'w') as f:
+            json.dump({'size': list(self.size), 'cropped': self.cascade is not None,
+                       'names': self.names}, f)
+        os.replace(meta + '.tmp', meta)
+        self._map()
+        return len(new)
+
+    def poll(self):
+        # update() at most every interval seconds, and only if the directory changed
+        now = time()
+        if now - self.last_poll < self.interval:
+            return 0
+        self.last_poll = now
+        if os.stat(self.directory).st_mtime_ns == self.mtime:
+            return 0
+        return self.update()
+
+    def features(self, frame, boxes):
+        # (faces x dim) matrix of the faces in a frame
+        out = np.zeros((len(boxes), self.dim), np.float32)
+        for i, box in enumerate(boxes):
+            face = crop_face(frame, box, self.margin, self.size)
+            if face is not None:
+                out[i] = face_feature(face, self.size)
+        return out
+
+    def match(self, features):
+        # best enrolled identity per row of features: [(identity or None, score), ...]
+        if len(features) == 0:
+            return []
+        if self.count == 0:
+            return [(None, 0.0)] * len(features)
+        scores = features @ self.matrix.T             # faces x enrolled, one product
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(features)), best]
+        results = []
+        for row, score in zip(best, best_scores):
+            if score >= self.threshold:
+                results.append((self.labels[self.label_of[row]], float(score)))
+                self.matches += 1
+            else:
+                results.append((None, float(score)))
+        return results
+
+    def match_faces(self, frame, boxes):
+        return self.match(self.features(frame, boxes))
+
+    def __str__(self):
+        return "Face index: {} images of {} identities, {} KB".format(
+            self.count, len(self.labels), self.count * self.dim * 4 // 1024)
+
+
+if __name__ == "__main__":
+
+    # index a directory (default known/) and time matching a frame's worth of faces
+    import sys
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'known'
+    cascade = cv2.CascadeClassifier(
+        "/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml")
+    t0 = time()
+    index = FaceIndex(directory, cascade=cascade)
+    print(index, "({:.2f} s to load and update)".format(time() - t0))
+    if index.count:
+        faces = np.asarray(index.matrix[:8])
+        t0 = time()
+        for _ in range(100):
+            results = index.match(faces)
+        print("matching {} faces: {:.3f} ms".format(len(faces), (time() - t0) * 10))
+        for name, (identity, score) in zip(index.names, results):
+            print("  {}: {} ({:.2f})".format(name, identity, score))
@@ -0,0 +1,160 @@
+# ws_face_store.py
+# Background writer of deduplicated face crops, for building enrollment datasets
+
+# grab_frame_from_video.py saves whole frames by hand. A FaceCropStore instead takes the
+# face boxes that face detection finds anyway and saves the faces themselves:
+#   store = FaceCropStore('known', identity='WS')
+#   for box in faces:
+#       store.add(img, box)           # before drawing on img
+#   ...
+#   store.close()
+# add() only cuts the box (plus a margin) out of the frame and resizes it to the fixed crop
+# size, which is cheap and leaves the frame free to be reused; everything else happens in
+# a background thread:
+#   - a 64-bit difference hash (dHash) of each crop is compared with the hashes of the last
+#     few crops kept for that identity; a crop within max_distance bits of one of them is a
+#     near-duplicate (the same face in consecutive frames) and is dropped
+#   - each identity gets at most `quota` crops, counting those already in the directory
+#   - crops are written in batches of `batch`, or after flush_interval seconds
+# If the writer falls behind, add() drops crops (counted in .dropped) instead of blocking
+# the detection loop. Files are named <identity>_<n>.<suffix>, as grab_frame names them.
+
+import os
+import re
+import threading
+from collections import deque
+from time import time
+import cv2
+import numpy as np
+
+
+def dhash(img):
+    # 64-bit difference hash: sign of the horizontal gradient of a 9x8 luma thumbnail
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def crop_face(frame, box, margin=0.2, size=(112, 112)):
+    # the box grown by the margin, clipped to the frame and resized to size (width, height)
+    x, y, w, h = [int(v) for v in box]
+    mx, my = int(w * margin), int(h * margin)
+    x0, y0 = max(x - mx, 0), max(y - my, 0)
+    x1, y1 = min(x + w + mx, frame.shape[1]), min(y + h + my, frame.shape[0])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return cv2.resize(frame[y0:y1, x0:x1], size, interpolation=cv2.INTER_AREA)
+
+
+class FaceCropStore:
+
+    def __init__(self, directory, identity='unknown', size=(112, 112), margin=0.2,
+                 max_distance=6, recent=32, quota=200, batch=16, flush_interval=2.0,
+                 queue_size=64, suffix='png'):
+
+        self.directory      = directory
+        self.identity       = identity     # default identity for add()
+        self.size           = size         # (width, height) of every saved crop
+        self.margin         = margin       # box grown by this fraction on each side
+        self.max_distance   = max_distance # hash bits; at or below is a near-duplicate
+        self.quota          = quota        # crops per identity, None for no limit
+        self.batch          = batch
+        self.flush_interval = flush_interval
+        self.suffix         = suffix
+        self.queue          = deque()
+        self.queue_size     = queue_size
+        self.wake           = threading.Event()
+        self.recent         = {}   # identity -> deque of hashes of the last kept crops
+        self.recent_len     = recent
+        self.counts         = {}   # identity -> crops in the directory
+        self.added          = 0
+        self.dropped        = 0    # queue full
+        self.duplicates     = 0
+        self.over_quota     = 0
+        self.written        = 0
+        self.closing        = False
+        os.makedirs(directory, exist_ok=True)
+        self._count_existing()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _count_existing(self):
+        # resume numbering and quotas from a previous run
+        pattern = re.compile(r'^(.*)_(\d+)\.' + re.escape(self.suffix) + '$')
+        for name in os.listdir(self.directory):
+            m = pattern.match(name)
+            if m:
+                ident, n = m.group(1), int(m.group(2))
+                self.counts[ident] = max(self.counts.get(ident, 0), n + 1)
+
+    def crop(self, frame, box):
+        return crop_face(frame, box, self.margin, self.size)
+
+    def add(self, frame, box, identity=None):
+        # detection thread: queue one face; False if it was dropped right away
+        identity = identity or self.identity
+        if self.quota is not None and self.counts.get(identity, 0) >= self.quota:
+            self.over_quota += 1
+            return False
+        if len(self.queue) >= self.queue_size:
+            self.dropped += 1
+            return False
+        crop = self.crop(frame, box)
+        if crop is None:
+            return False
+        self.queue.append((identity, crop))
+        self.added += 1
+        if len(self.queue) >= self.batch:
+            self.wake.set()
+        return True
+
+    def _is_duplicate(self, identity, h):
+        recent = self.recent.setdefault(identity, deque(maxlen=self.recent_len))
+        if any(hamming(h, r) <= self.max_distance for r in recent):
+            return True
+        recent.append(h)
+        return False
+
+    def _run(self):
+        pending = []
+        last_flush = time()
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            closing = self.closing   # read once, so nothing queued before close() is lost
+            while self.queue:
+                identity, crop = self.queue.popleft()
+                if self._is_duplicate(identity, dhash(crop)):
+                    self.duplicates += 1
+                    continue
+                n = self.counts.get(identity, 0)
+                if self.quota is not None and n >= self.quota:
+                    self.over_quota += 1
+                    continue
+                self.counts[identity] = n + 1
+                pending.append(('{}_{}.{}'.format(identity, n, self.suffix), crop))
+            if pending and (len(pending) >= self.batch or closing or
+                            time() - last_flush >= self.flush_interval):
+                for name, crop in pending:
+                    if cv2.imwrite(os.path.join(self.directory, name), crop):
+                        self.written += 1
+                pending = []
+                last_flush = time()
+            if closing and not self.queue:
+                break
+
+    def close(self):
+        # write everything still queued and stop the writer
+        self.closing = True
+        self.wake.set()
+        self.thread.join()
+
+    def __str__(self):
+        return ("Face crops: {} added, {} written, {} near-duplicates, {} over quota, "
+                "{} dropped".format(self.added, self.written, self.duplicates,
+                                    self.over_quota, self.dropped))
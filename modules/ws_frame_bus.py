@@ -0,0 +1,245 @@
+# ws_frame_bus.py
+# Shared-memory frame bus: one process owns the CSI camera and publishes its frames,
+# any number of other processes map the same memory and read them without copies.
+
+# Layout of the shared memory block:
+#   bus header:   magic, version, number of slots, bytes per slot, generation, last
+#                 published sequence
+#   slot headers: one per slot (seqlock counter, frame sequence, timestamp, shape, dtype)
+#   slot data:    one frame buffer per slot
+# Frame n is written into slot n % slots, so the newest frame is never the one being
+# overwritten. Each slot is protected by a seqlock: the writer makes the counter odd while
+# it writes and even again when done; a reader retries if it sees an odd counter or if the
+# counter changed while it was copying the slot. A reader that takes a view instead of a
+# copy has to check is_current(seq) after it is done with the pixels: a reader that falls
+# a whole ring behind would otherwise use a frame that was overwritten under it.
+# When the publisher closes (or is replaced by a larger one after a change of frame size)
+# it bumps the generation in the header of the old block; subscribers notice it on their
+# next read() and attach again to the block now published under the name.
+
+# Publisher side (the process that owns the sensor):
+#   picam.open(picam.gstreamer_pipeline); picam.publish('csi0'); picam.start()
+# Subscriber side (any other process):
+#   bus = FrameSubscriber('csi0'); seq, timestamp, frame = bus.read(copy=True)
+# or, without a copy:
+#   seq, timestamp, frame = bus.read(); ...use frame...; if bus.is_current(seq): ...
+
+import struct
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+BUS_MAGIC   = b'CSIB'
+BUS_VERSION = 2
+
+# magic, version, slots, slot_bytes, generation, last sequence
+BUS_HEADER  = struct.Struct('<4sIIQIQ')
+GENERATION_OFFSET = struct.calcsize('<4sIIQ')
+# seqlock, frame sequence, timestamp, height, width, channels, dtype string
+SLOT_HEADER = struct.Struct('<QQdIII8s')
+
+def _align(n, a=64):
+    return (n + a - 1) // a * a
+
+HEADER_BYTES = _align(BUS_HEADER.size)
+SLOT_HEADER_BYTES = _align(SLOT_HEADER.size)
+
+
+class FramePublisher:
+
+    def __init__(self, name, shape, dtype=np.uint8, slots=4, generation=0):
+
+        self.name = name
+        self.slots = slots
+        self.generation = generation   # one more than the block this one replaces
+        self.slot_bytes = _align(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.data_offset = HEADER_BYTES + slots * SLOT_HEADER_BYTES
+        size = self.data_offset + slots * self.slot_bytes
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left over from a publisher that died without cleaning up
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.buf = self.shm.buf
+        self.seq = 0
+        self.locks = [0] * slots
+        for i in range(slots):
+            SLOT_HEADER.pack_into(self.buf, self._slot_header(i), 0, 0, 0.0, 0, 0, 0, b'')
+        BUS_HEADER.pack_into(self.buf, 0, BUS_MAGIC, BUS_VERSION, slots, self.slot_bytes,
+                             generation, 0)
+
+    def _slot_header(self, i):
+        return HEADER_BYTES + i * SLOT_HEADER_BYTES
+
+    def write(self, frame, timestamp=None):
+        # copy one frame into the next slot; returns its sequence number
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError('frame of {} bytes does not fit the {} byte bus slots'.format(
+                frame.nbytes, self.slot_bytes))
+        if timestamp is None:
+            timestamp = time.time()
+        self.seq += 1
+        i = self.seq % self.slots
+        hdr = self._slot_header(i)
+        shape = frame.shape + (1,) * (3 - frame.ndim)
+        # seqlock: odd while writing
+        self.locks[i] += 1
+        struct.pack_into('<Q', self.buf, hdr, self.locks[i])
+        start = self.data_offset + i * self.slot_bytes
+        dst = np.ndarray(frame.shape, frame.dtype, self.buf, start)
+        np.copyto(dst, frame)
+        self.locks[i] += 1
+        SLOT_HEADER.pack_into(self.buf, hdr, self.locks[i], self.seq, timestamp,
+                              shape[0], shape[1], shape[2], frame.dtype.str.encode())
+        # publish last, so readers only ever see completed frames
+        struct.pack_into('<Q', self.buf, BUS_HEADER.size - 8, self.seq)
+        return self.seq
+
+    def close(self):
+        # subscribers see the bumped generation and attach to whatever replaces this block
+        struct.pack_into('<I', self.buf, GENERATION_OFFSET, self.generation + 1)
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FrameSubscriber:
+
+    def __init__(self, name, retries=100):
+
+        self.name = name
+        self.retries = retries
+        self.shm = None
+        self.retried = 0    # seqlock retries, a measure of reader/writer contention
+        self.missed = 0     # frames published but never returned by read()
+        self.attaches = 0   # times attached, i.e. 1 + publisher replacements followed
+        self._attach()
+
+    def _attach(self):
+        shm = shared_memory.SharedMemory(name=self.name)
+        # Python < 3.13 registers attached blocks too, and would unlink the publisher's
+        # memory when this process exits
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        magic, version, slots, slot_bytes, generation, _ = BUS_HEADER.unpack_from(shm.buf, 0)
+        if magic != BUS_MAGIC or version != BUS_VERSION:
+            shm.close()
+            raise ValueError('{} is not a version {} frame bus'.format(self.name, BUS_VERSION))
+        self.close()
+        self.shm = shm
+        self.buf = shm.buf
+        self.slots, self.slot_bytes, self.generation = slots, slot_bytes, generation
+        self.data_offset = HEADER_BYTES + self.slots * SLOT_HEADER_BYTES
+        self.last_seq = 0
+        self.attaches += 1
+
+    def replaced(self):
+        # True once the publisher of the attached block has closed or been replaced
+        return struct.unpack_from('<I', self.buf, GENERATION_OFFSET)[0] != self.generation
+
+    def latest(self):
+        return struct.unpack_from('<Q', self.buf, BUS_HEADER.size - 8)[0]
+
+    def read(self, wait=True, timeout=1.0, copy=False, out=None):
+        # returns (seq, timestamp, frame) for the newest frame, or (0, 0.0, None) if there
+        # is none within the timeout. With copy=True (or an `out` array of the right shape
+        # and dtype to fill) the frame is copied inside the seqlock window and is never
+        # torn. Otherwise it is a view into shared memory, valid only until the publisher
+        # wraps around the ring: call is_current(seq) after using it.
+        deadline = time.time() + timeout
+        while True:
+            if self.replaced():
+                try:
+                    self._attach()
+                except (FileNotFoundError, ValueError):
+                    pass   # the new block is not there yet (or never will be)
+            seq = self.latest()
+            if seq > self.last_seq:
+                item = self._read_slot(seq, copy or out is not None, out)
+                if item is not None:
+                    if self.last_seq:
+                        self.missed += seq - self.last_seq - 1
+                    self.last_seq = seq
+                    return item
+            if not wait or time.time() > deadline:
+                return 0, 0.0, None
+            time.sleep(0.001)
+
+    def _read_slot(self, seq, copy=False, out=None):
+        i = seq % self.slots
+        hdr = HEADER_BYTES + i * SLOT_HEADER_BYTES
+        for _ in range(self.retries):
+            lock, fseq, ts, h, w, c, dt = SLOT_HEADER.unpack_from(self.buf, hdr)
+            if lock & 1 or fseq != seq:
+                # being written, or already reused for a newer frame
+                self.retried += 1
+                if fseq > seq:
+                    return None
+                continue
+            shape = (h, w) if c == 1 else (h, w, c)
+            frame = np.ndarray(shape, np.dtype(dt.rstrip(b'\0').decode()), self.buf,
+                               self.data_offset + i * self.slot_bytes)
+            if copy:
+                if out is not None and out.shape == frame.shape and out.dtype == frame.dtype:
+                    np.copyto(out, frame)
+                    frame = out
+                else:
+                    frame = frame.copy()
+            # unchanged counter: a copy is complete; for a view only the header is
+            # consistent, the pixels are checked by is_current() after use
+            if struct.unpack_from('<Q', self.buf, hdr)[0] == lock:
+                return fseq, ts, frame
+            self.retried += 1
+        return None
+
+    def is_current(self, seq):
+        # True while the slot holding frame seq has not been rewritten
+        hdr = HEADER_BYTES + (seq % self.slots) * SLOT_HEADER_BYTES
+        lock, fseq = struct.unpack_from('<QQ', self.buf, hdr)
+        return fseq == seq and not lock & 1
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.buf = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass   # views handed out still reference the block; it goes away with them
+        self.shm = None
+
+
+if __name__ == "__main__":
+
+    # display the frames of a running publisher, e.g. python3 ws_frame_bus.py csi0
+    import sys
+    import cv2
+    from ws_pacing import poll_key
+
+    bus = FrameSubscriber(sys.argv[1] if len(sys.argv) > 1 else 'csi0')
+    torn = 0
+    display = None
+    while True:
+        seq, ts, frame = bus.read()
+        if frame is not None:
+            # work on the view, then make sure it was not overwritten meanwhile
+            if display is None or display.shape != frame.shape:
+                display = np.empty_like(frame)
+            np.copyto(display, frame)
+            if bus.is_current(seq):
+                cv2.imshow('Frame bus: ' + bus.name, display)
+            else:
+                torn += 1
+        # read() already waits for the next frame: only the key is polled
+        if poll_key() == ord('q'):
+            break
+    print('missed {} frames, {} torn, {} seqlock retries'.format(bus.missed, torn,
+                                                                 bus.retried))
+    frame = None  # drop the last view into shared memory before unmapping it
+    bus.close()
+    cv2.destroyAllWindows()
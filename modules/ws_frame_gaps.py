@@ -0,0 +1,164 @@
+# ws_frame_gaps.py
+# Dropped-frame accounting: the intervals between captured frames against the sensor period
+
+# CSI_Camera.fps is a smoothed rate, so a short stall or a few dropped sensor frames barely
+# move it. A FrameGapMonitor is a camera sink: it sees every grabbed frame in the capture
+# thread, with its arrival time, and compares each interval with the expected period
+# (1 / framerate of the sensor mode, see CSI_Camera.framerate):
+#   - an interval of more than `tolerance` periods is a gap; round(interval / period) - 1
+#     frames are counted as missed, and the gap is logged with its time and frame number
+#   - every interval's deviation from the period goes into a jitter histogram
+# Each frame also has the capture's own timestamp where the source gives one
+# (CAP_PROP_POS_MSEC: the GStreamer buffer time, from the sensor for nvarguscamerasrc, or
+# the position in a video file). That tells where a frame was lost:
+#   'source'   the capture timestamps jump too: the frame never came out of the sensor/ISP
+#              or GStreamer dropped it before appsink
+#   'capture'  the timestamps are continuous but the frame arrived late: our capture thread
+#              (or the consumer holding the GIL) did not read in time, and the frames waited
+#              in appsink
+# A raw replay reports the times of its recording, so a gap that was recorded is 'source'.
+# Without capture timestamps (synthetic frames) every gap is 'unknown'.
+#   gaps = FrameGapMonitor(camera)    # attaches itself as a sink
+#   ...
+#   print(gaps)                       # or gaps.summary(), gaps.events
+#   gaps.close()
+# The period is re-read when the camera is reconfigured, and the interval across a
+# reconfigure or reconnect is not counted.
+
+import threading
+from bisect import bisect_right
+from collections import deque
+import cv2
+
+# deviation of an interval from the period, ms; the first and last bins are open-ended
+JITTER_EDGES_MS = (-10, -5, -2, -1, -0.5, 0.5, 1, 2, 5, 10, 20, 50)
+
+
+class FrameGapMonitor:
+
+    def __init__(self, camera=None, fps=None, tolerance=1.5, events=1000,
+                 edges_ms=JITTER_EDGES_MS, attach=True):
+
+        self.camera    = camera
+        self.fps       = fps          # expected rate; None: from the camera's sensor mode
+        self.tolerance = tolerance    # periods; longer intervals are gaps
+        self.edges_ms  = tuple(edges_ms)
+        self.events    = deque(maxlen=events)   # recent gap events, oldest dropped
+        self.lock      = threading.Lock()       # summary() vs the capture thread
+        self.reset()
+        if camera is not None and attach:
+            camera.add_sink(self)
+
+    def reset(self):
+        with self.lock:
+            self.period    = None
+            self.epoch     = None     # (generation, reconnects) the intervals belong to
+            self.last      = None     # arrival time of the previous frame
+            self.last_pts  = None     # capture timestamp of the previous frame, seconds
+            self.frames    = 0
+            self.intervals = 0
+            self.gaps      = 0
+            self.missed    = {'source': 0, 'capture': 0, 'unknown': 0}
+            self.worst     = 0.0      # longest interval, seconds
+            self.jitter    = [0] * (len(self.edges_ms) + 1)
+            self.events.clear()
+
+    def expected_period(self):
+        camera = self.camera
+        if self.fps:
+            return 1.0 / self.fps
+        if camera is not None and camera.sensor_mode in camera.framerate:
+            return 1.0 / camera.framerate[camera.sensor_mode]
+        capture = camera.video_capture if camera is not None else None
+        fps = capture.get(cv2.CAP_PROP_FPS) if hasattr(capture, 'get') else 0
+        return 1.0 / fps if fps and fps > 0 else 1.0 / 30   # as the camera watchdog does
+
+    def _capture_time(self):
+        # the capture's timestamp of the frame just read (the sink runs right after read())
+        capture = self.camera.video_capture if self.camera is not None else None
+        if not hasattr(capture, 'get'):
+            return None
+        ms = capture.get(cv2.CAP_PROP_POS_MSEC)
+        return ms / 1000.0 if ms and ms > 0 else None
+
+    def __call__(self, frame, t, seq):
+        # the camera sink: runs in the capture thread
+        camera = self.camera
+        epoch = (camera.generation, camera.reconnects) if camera is not None else None
+        pts = self._capture_time()
+        with self.lock:
+            if epoch != self.epoch or self.period is None:
+                self.epoch = epoch
+                self.period = self.expected_period()
+                self.last = self.last_pts = None
+            self.frames += 1
+            if self.last is not None:
+                self._interval(t, t - self.last, pts, seq)
+            self.last, self.last_pts = t, pts
+
+    def _interval(self, t, interval, pts, seq):
+        period = self.period
+        self.intervals += 1
+        self.worst = max(self.worst, interval)
+        self.jitter[bisect_right(self.edges_ms, (interval - period) * 1000)] += 1
+        if interval <= self.tolerance * period:
+            return
+        missed = max(int(round(interval / period)) - 1, 1)
+        where = 'unknown'
+        if pts is not None and self.last_pts is not None:
+            if pts - self.last_pts > self.tolerance * period:
+                where = 'source'
+                missed = max(int(round((pts - self.last_pts) / period)) - 1, 1)
+            else:
+                where = 'capture'
+        self.gaps += 1
+        self.missed[where] += missed
+        self.events.append({'time': t, 'frame': seq, 'interval_ms': interval * 1000,
+                            'missed': missed, 'where': where})
+
+    def histogram(self):
+        # [(upper edge ms or None for the overflow bin, count), ...]
+        with self.lock:
+            return list(zip(self.edges_ms + (None,), self.jitter))
+
+    def summary(self):
+        with self.lock:
+            return {'frames': self.frames, 'period_ms': (self.period or 0) * 1000,
+                    'gaps': self.gaps, 'missed': sum(self.missed.values()),
+                    'missed_source': self.missed['source'],
+                    'missed_capture': self.missed['capture'],
+                    'missed_unknown': self.missed['unknown'],
+                    'worst_ms': self.worst * 1000,
+                    'jitter': list(zip(self.edges_ms + (None,), self.jitter))}
+
+    def close(self):
+        if self.camera is not None:
+            self.camera.remove_sink(self)
+
+    def __str__(self):
+        s = self.summary()
+        return ("Frame gaps: {frames} frames at {period_ms:.1f} ms, {gaps} gaps, {missed} "
+                "frames missed (source {missed_source}, capture {missed_capture}, unknown "
+                "{missed_unknown}), longest interval {worst_ms:.1f} ms".format(**s))
+
+
+if __name__ == "__main__":
+
+    # gap accounting of the CSI camera in sensor mode 3 (60 fps) for ten seconds
+    import time
+    import ws_csi_camera as ws
+
+    camera = ws.CSI_Camera(display_fps=False)
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=ws.S_MODE_3_1280_720_60,
+                                     display_width=640, display_height=360)
+    camera.open(camera.gstreamer_pipeline)
+    camera.start()
+    gaps = FrameGapMonitor(camera)
+    time.sleep(10)
+    gaps.close()
+    camera.release()
+    print(gaps)
+    for edge, count in gaps.histogram():
+        print("  {:>6} ms: {}".format('>' if edge is None else '<' + str(edge), count))
+    for e in list(gaps.events)[-10:]:
+        print("  frame {frame}: {interval_ms:.1f} ms, {missed} missed ({where})".format(**e))
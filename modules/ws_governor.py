@@ -0,0 +1,205 @@
+# ws_governor.py
+# Overload governor: degrade the work per frame step by step when processing falls behind
+
+# When face detection cannot keep up, the loop just falls behind: the displayed rate drops
+# and latency grows. The governor watches the end-to-end latency (grab to display) and the
+# measured cost of each processing stage, and moves through a list of degradation levels
+# to keep the latency under a target:
+#   0 'full'         everything, every frame
+#   1 'no_eyes'      skip eye detection
+#   2 'cadence_2'    detect faces on every 2nd frame, reuse the boxes in between
+#   3 'half_scale'   ... and detect on a half-size image
+#   4 'cadence_3'    ... on every 3rd frame
+#   5 'display_2'    ... and only refresh the display every 2nd frame
+# It steps down one level after `patience` overloaded frames in a row and back up one level
+# after `recover` frames with headroom, with a pause after every change so the effect of
+# the new level is measured before the next decision. The current level is exposed through
+# level/settings and metric().
+# Stage costs are per frame: a stage that only runs on some frames (detection every 2nd
+# frame, display every 2nd) counts as 0 on the others, so its cost is amortized over the
+# frames and a cadence level does lower it. The CPU load is only a tie-breaker, and only
+# the load of other processes: the detector's own threads keeping the cores busy is what
+# they are for, but when the latency is already close to the target and other processes
+# compete for the CPU, the governor degrades instead of waiting for the target to be hit.
+
+#   governor = Governor(target_latency=0.1, budget=1 / 30)
+#   s = governor.settings                          # what to do for this frame
+#   with governor.stage('detect'): ...             # time the stages
+#   governor.update(latency)                       # once per frame, after display
+
+import os
+from time import time
+
+LEVELS = [
+    dict(name='full',       eyes=True,  detect_every=1, detect_scale=1.0, display_every=1),
+    dict(name='no_eyes',    eyes=False, detect_every=1, detect_scale=1.0, display_every=1),
+    dict(name='cadence_2',  eyes=False, detect_every=2, detect_scale=1.0, display_every=1),
+    dict(name='half_scale', eyes=False, detect_every=2, detect_scale=0.5, display_every=1),
+    dict(name='cadence_3',  eyes=False, detect_every=3, detect_scale=0.5, display_every=1),
+    dict(name='display_2',  eyes=False, detect_every=3, detect_scale=0.5, display_every=2),
+]
+
+
+class CpuLoad:
+
+    # CPU utilization (0..1 of all cores) of everything but this process: the whole
+    # machine from /proc/stat (the load average where /proc/stat does not exist) minus
+    # this process's own user + system time (os.times). Sampled at most every interval
+    # seconds.
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.last     = None     # (time, busy jiffies, total jiffies)
+        self.value    = 0.0      # other processes
+        self.machine  = 0.0      # whole machine, this process included
+        self.process  = 0.0      # this process
+        self.cpus     = os.cpu_count() or 1
+        self.last_process = None   # (time, process cpu seconds)
+
+    def _sample(self):
+        with open('/proc/stat') as f:
+            fields = [int(v) for v in f.readline().split()[1:]]
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)   # idle + iowait
+        return sum(fields) - idle, sum(fields)
+
+    def _process(self, now):
+        t = os.times()
+        used = t.user + t.system
+        if self.last_process is not None and now > self.last_process[0]:
+            self.process = min((used - self.last_process[1]) /
+                               ((now - self.last_process[0]) * self.cpus), 1.0)
+        self.last_process = (now, used)
+
+    def read(self):
+        now = time()
+        if self.last is not None and now - self.last[0] < self.interval:
+            return self.value
+        self._process(now)
+        try:
+            busy, total = self._sample()
+        except (OSError, ValueError, IndexError):
+            self.machine = min(os.getloadavg()[0] / self.cpus, 1.0) \
+                           if hasattr(os, 'getloadavg') else 0.0
+            busy = total = 0
+        else:
+            if self.last is not None and total > self.last[2]:
+                self.machine = (busy - self.last[1]) / (total - self.last[2])
+        self.last = (now, busy, total)
+        self.value = max(self.machine - self.process, 0.0)
+        return self.value
+
+
+class _StageTimer:
+
+    def __init__(self, governor, name):
+        self.governor = governor
+        self.name     = name
+
+    def __enter__(self):
+        self.t0 = time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.governor.record(self.name, time() - self.t0)
+
+
+class Governor:
+
+    def __init__(self, target_latency=0.1, budget=None, levels=LEVELS, cpu_high=0.9,
+                 headroom=0.6, patience=5, recover=60, settle=15, alpha=0.9):
+
+        self.target_latency = target_latency   # seconds, grab to display
+        self.budget         = budget    # seconds of processing per frame, e.g. 1/fps
+        self.levels         = levels
+        self.cpu_high       = cpu_high  # load of other processes that counts as contention
+        self.headroom       = headroom  # fraction of target/budget/cpu_high to step back up
+        self.patience       = patience  # overloaded frames in a row before degrading
+        self.recover        = recover   # frames with headroom in a row before restoring
+        self.settle         = settle    # frames ignored after every level change
+        self.alpha          = alpha     # smoothing of latency and stage timings
+        self.level          = 0
+        self.latency        = 0.0       # smoothed end-to-end latency, seconds
+        self.timings        = {}        # stage -> smoothed seconds per frame
+        self.pending        = {}        # stage -> seconds in the current frame
+        self.cpu            = CpuLoad()
+        self.over           = 0         # consecutive overloaded frames
+        self.under          = 0         # consecutive frames with headroom
+        self.hold           = 0         # frames left to settle
+        self.changes        = 0
+        self.frame          = 0
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def stage(self, name):
+        # context manager timing one processing stage
+        return _StageTimer(self, name)
+
+    def record(self, name, seconds):
+        # time spent in a stage during the current frame; smoothed in update()
+        self.pending[name] = self.pending.get(name, 0.0) + seconds
+
+    def _close_frame(self):
+        # every stage seen so far gets a sample for this frame, 0 if it did not run
+        for name in set(self.timings) | set(self.pending):
+            seconds = self.pending.get(name, 0.0)
+            old = self.timings.get(name)
+            self.timings[name] = seconds if old is None else \
+                                 self.alpha * old + (1 - self.alpha) * seconds
+        self.pending = {}
+
+    def detect_now(self):
+        # whether this frame gets a fresh face detection at the current level
+        return self.frame % self.settings['detect_every'] == 0
+
+    def display_now(self):
+        return self.frame % self.settings['display_every'] == 0
+
+    def cost(self):
+        # smoothed processing time per frame, all stages, amortized over the frames
+        return sum(self.timings.values())
+
+    def update(self, latency):
+        # once per frame with its grab-to-display latency; returns the (new) level
+        self._close_frame()
+        self.frame += 1
+        self.latency = latency if self.frame == 1 else \
+                       self.alpha * self.latency + (1 - self.alpha) * latency
+        if self.hold > 0:
+            self.hold -= 1
+            return self.level
+        cpu = self.cpu.read()
+        cost = self.cost()
+        near_target = self.latency > self.headroom * self.target_latency
+        overloaded = self.latency > self.target_latency or \
+                     (self.budget is not None and cost > self.budget) or \
+                     (near_target and cpu > self.cpu_high)
+        relaxed = not near_target and cpu < self.cpu_high and \
+                  (self.budget is None or cost < self.headroom * self.budget)
+        self.over = self.over + 1 if overloaded else 0
+        self.under = self.under + 1 if relaxed else 0
+        if self.over >= self.patience and self.level < len(self.levels) - 1:
+            self._set_level(self.level + 1)
+        elif self.under >= self.recover and self.level > 0:
+            self._set_level(self.level - 1)
+        return self.level
+
+    def _set_level(self, level):
+        self.level = level
+        self.over = self.under = 0
+        self.hold = self.settle
+        self.changes += 1
+        # stages skipped at the new level must not keep counting toward the cost
+        self.timings = {}
+        self.pending = {}
+
+    def metric(self):
+        return {'level': self.level, 'name': self.settings['name'],
+                'latency_ms': self.latency * 1000, 'cost_ms': self.cost() * 1000,
+                'cpu': self.cpu.value, 'process_cpu': self.cpu.process,
+                'changes': self.changes}
+
+    def __str__(self):
+        return "Governor level {level} ({name}): latency {latency_ms:.0f} ms, " \
+               "processing {cost_ms:.0f} ms, cpu {process_cpu:.0%} (others {cpu:.0%})".format(**self.metric())
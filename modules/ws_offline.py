@@ -0,0 +1,125 @@
+# ws_offline.py
+# Offline face detection over recorded video, as fast as the machine allows
+
+# Live face detection is tied to the camera and the display rate. Over a recorded file
+# neither applies, and the only question is how fast the whole file can be processed:
+#   - a reader thread decodes ahead into a bounded queue (prefetch frames), so decoding
+#     overlaps detection instead of alternating with it
+#   - face detection runs on a pool of worker threads (OpenCV releases the GIL)
+#   - the pool returns results in submission order, so detections come out in frame order
+#   - the detections of every frame are written as one JSON line:
+#       {"frame": 0, "time": 0.0, "faces": [[x, y, w, h], ...], "eyes": [...]}
+# This is a ws_pipeline.Pipeline over an iterable source, whose queues wait instead of
+# dropping, so every frame of the file is processed exactly once. The report compares the
+# achieved rate with the file's own frame rate, e.g. 'x3.2 real time'.
+#   summary = process_video('walk.mp4', 'walk_faces.jsonl', workers=4)
+
+import json
+from time import time
+import cv2
+from ws_pipeline import Pipeline, Stage, to_gray, detect_faces, detect_eyes
+
+
+class VideoFrames:
+
+    # iterable of (frame, seconds into the video) from a file or a VideoCapture-like
+    # object; times come from CAP_PROP_POS_MSEC where the capture has it, else from the
+    # frame number and rate
+
+    def __init__(self, source):
+
+        self.capture = cv2.VideoCapture(source) if isinstance(source, str) else source
+        fps = self.capture.get(cv2.CAP_PROP_FPS) if hasattr(self.capture, 'get') else 0
+        if not fps or fps <= 0:
+            # e.g. SyntheticSource.fps, or a method such as RawReplay.fps()
+            fps = getattr(self.capture, 'fps', None)
+            fps = fps() if callable(fps) else fps
+        self.fps = fps if isinstance(fps, (int, float)) and fps > 0 else None
+        self.frames = 0
+        self.decode_time = 0.0    # seconds spent in read(), i.e. decoding
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def __iter__(self):
+        while True:
+            t0 = time()
+            ok, frame = self.capture.read()
+            self.decode_time += time() - t0
+            if not ok or frame is None:
+                break
+            ms = self.capture.get(cv2.CAP_PROP_POS_MSEC) if hasattr(self.capture, 'get') \
+                 else 0
+            t = ms / 1000.0 if ms and ms > 0 else (self.frames / self.fps if self.fps else 0.0)
+            self.frames += 1
+            yield frame, t
+
+    def release(self):
+        self.capture.release()
+
+
+def _detections(item):
+    boxes = lambda b: [[int(v) for v in box] for box in b]
+    line = {'frame': item['seq'] - 1, 'time': round(item['timestamp'], 4),
+            'faces': boxes(item.get('faces', ()))}
+    if 'eyes' in item:
+        line['eyes'] = boxes(item['eyes'])
+    return line
+
+
+def process_video(source, output, workers=4, prefetch=16, eyes=False, detect=detect_faces,
+                  progress=None, name=None):
+    # detect faces in every frame of source (a path or a capture object, e.g. from
+    # ws_sources.open_source(..., paced=False)) and write the detections to output (JSON
+    # lines); returns a summary dict. progress: print a line every that many frames;
+    # name: how the source is reported (default: source itself)
+    frames = VideoFrames(source)
+    if not frames.isOpened():
+        raise SystemExit("Unable to open video {}".format(source))
+    pipe = Pipeline(frames, queue_size=prefetch)
+    pipe.add(Stage('gray', to_gray, mode='thread'))
+    # enough room in front of the pool to keep every worker busy
+    pipe.add(Stage('detect', detect, mode='thread', workers=workers, queue_size=2 * workers))
+    if eyes:
+        pipe.add(Stage('eyes', detect_eyes, mode='inline'))
+    count = [0, 0]   # frames, faces
+    t0 = time()
+    with open(output, 'w') as out:
+
+        def write(item):
+            line = _detections(item)
+            out.write(json.dumps(line) + '\n')
+            count[0] += 1
+            count[1] += len(line['faces'])
+            if progress and count[0] % progress == 0:
+                print("{} frames, {:.1f} fps".format(count[0], count[0] / (time() - t0)))
+
+        stats = pipe.run(write)
+    elapsed = time() - t0
+    frames.release()
+    fps = count[0] / elapsed if elapsed > 0 else 0.0
+    return {'source': name or str(source), 'output': output, 'frames': count[0], 'faces': count[1],
+            'seconds': elapsed, 'fps': fps, 'video_fps': frames.fps or 0.0,
+            'realtime': fps / frames.fps if frames.fps else 0.0,
+            'decode_ms': frames.decode_time / frames.frames * 1000 if frames.frames else 0.0,
+            'workers': workers, 'stages': stats}
+
+
+def print_summary(s):
+    print("{source}: {frames} frames in {seconds:.2f} sec, {fps:.1f} fps "
+          "(video {video_fps:.1f} fps, x{realtime:.1f} real time), {faces} faces -> "
+          "{output}".format(**s))
+    print("  decoding {decode_ms:.1f} ms per frame, detection on {workers} workers: "
+          "{latency_ms:.1f} ms per frame".format(latency_ms=s['stages']['detect']['latency_ms'],
+                                                 **s))
+
+
+if __name__ == "__main__":
+
+    # python3 ws_offline.py VIDEO [OUTPUT [WORKERS]]
+    import sys
+
+    video = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else video.rsplit('.', 1)[0] + '_faces.jsonl'
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print_summary(process_video(video, output, workers=workers, progress=300))
@@ -0,0 +1,113 @@
+# ws_overlay.py
+# Cached text overlay (HUD) for camera displays
+
+# cv2.putText with LINE_AA is surprisingly expensive when it is called for every string on
+# every frame. Here each label is rendered once into a small sprite (premultiplied color plus
+# an alpha mask) and only re-rendered when its text changes. At display time the sprites are
+# blended into the display image inside their own rectangles; nothing else is touched.
+
+# Overlays are meant for the display path only: compose() writes into a display buffer and
+# never into the frame handed to analytics.
+
+import cv2
+import numpy as np
+
+
+class TextSprite:
+
+    def __init__(self, font_face=cv2.FONT_HERSHEY_SIMPLEX, scale=.6, color=(255,255,255),
+                 thickness=1, pad=2):
+
+        self.font_face = font_face
+        self.scale     = scale
+        self.color     = color
+        self.thickness = thickness
+        self.pad       = pad
+        self.text      = None
+        self.image     = None  # premultiplied color, float32 h x w x 3
+        self.inv_alpha = None  # 1 - alpha, float32 h x w x 1
+        self.baseline  = 0     # offset from the top of the sprite to the text baseline
+        self.renders   = 0     # number of times the sprite was (re)rendered
+
+    def set_text(self, text):
+        # re-render only when the text actually changes; return True if it did
+        if text == self.text:
+            return False
+        self.text = text
+        (w, h), base = cv2.getTextSize(text, self.font_face, self.scale, self.thickness)
+        p = self.pad
+        mask = np.zeros((h + base + 2*p, w + 2*p), np.uint8)
+        cv2.putText(mask, text, (p, p + h), self.font_face, self.scale, 255,
+                    self.thickness, cv2.LINE_AA)
+        alpha = mask.astype(np.float32)[..., None] * (1.0 / 255)
+        self.image     = alpha * np.array(self.color, np.float32)
+        self.inv_alpha = 1.0 - alpha
+        self.baseline  = p + h
+        self.renders  += 1
+        return True
+
+    def blend(self, dst, x, y):
+        # blend the sprite into dst (uint8 BGR) with its text baseline at (x, y), in place
+        if self.image is None:
+            return
+        top, left = y - self.baseline, x - self.pad
+        h, w = self.image.shape[:2]
+        # clip the sprite rectangle against the destination
+        y0, x0 = max(top, 0), max(left, 0)
+        y1, x1 = min(top + h, dst.shape[0]), min(left + w, dst.shape[1])
+        if y0 >= y1 or x0 >= x1:
+            return
+        sy, sx = y0 - top, x0 - left
+        roi = dst[y0:y1, x0:x1]
+        img = self.image[sy:sy + y1 - y0, sx:sx + x1 - x0]
+        inv = self.inv_alpha[sy:sy + y1 - y0, sx:sx + x1 - x0]
+        if dst.ndim == 2:
+            # grayscale destination: use the luma of the sprite color
+            roi[:] = roi * inv[..., 0] + img.mean(axis=2)
+        else:
+            roi[:] = roi * inv + img
+
+
+class Overlay:
+
+    def __init__(self, font_face=cv2.FONT_HERSHEY_SIMPLEX, scale=.6, color=(255,255,255),
+                 thickness=1):
+
+        self.font_face = font_face
+        self.scale     = scale
+        self.color     = color
+        self.thickness = thickness
+        self.items     = {}    # name -> [position, TextSprite]
+        self.canvas    = None  # display buffer reused by render()
+
+    def set_text(self, name, text, position):
+        # add or update a label; the sprite is only re-rendered if the text changed
+        item = self.items.get(name)
+        if item is None:
+            sprite = TextSprite(self.font_face, self.scale, self.color, self.thickness)
+            item = self.items[name] = [position, sprite]
+        item[0] = position
+        return item[1].set_text(text)
+
+    def remove(self, name):
+        self.items.pop(name, None)
+
+    def clear(self):
+        self.items = {}
+
+    def compose(self, dst, offset=(0,0)):
+        # blend all labels into dst in place; offset shifts them, e.g. for the right-hand
+        # pane of a side-by-side display
+        ox, oy = offset
+        for (x, y), sprite in self.items.values():
+            sprite.blend(dst, x + ox, y + oy)
+        return dst
+
+    def render(self, frame):
+        # copy frame into a reused display buffer and compose the labels there, so the
+        # caller's frame stays clean
+        if self.canvas is None or self.canvas.shape != frame.shape or \
+           self.canvas.dtype != frame.dtype:
+            self.canvas = np.empty_like(frame)
+        np.copyto(self.canvas, frame)
+        return self.compose(self.canvas)
@@ -0,0 +1,109 @@
+# ws_pacing.py
+# Deadline-based frame pacing for display loops
+
+# The display loops used cv2.waitKey(5/20/30) as their frame limiter, a delay tuned by trial
+# that adds itself to the processing time, so the loop rate and latency depend on how long
+# each iteration happened to take and on GUI polling. A FramePacer instead computes a
+# deadline per frame from the sensor framerate table (CSI_Camera.framerate) and sleeps
+# precisely until it: a coarse sleep to just before the deadline, then a short spin. With a
+# camera the deadlines are phase-locked to its frame arrivals (offset seconds after each
+# grab), so the loop wakes up just as a new frame is there.
+
+# An iteration that overruns its deadline is not made up for: the pacer returns at once and
+# moves on to the next deadline, counting the missed ones. Wake-up error and lateness are
+# kept for report(). Keyboard/GUI events are still pumped, but without waiting:
+#   pacer = FramePacer(camera=picam)
+#   while True:
+#       ...show...
+#       pacer.wait()
+#       if poll_key() == 27:
+#           break
+#   print(pacer)
+
+from collections import deque
+from time import sleep, time
+import numpy as np
+
+DEFAULT_FPS = 30   # for sources without a sensor mode, e.g. webcams and files
+
+
+def poll_key():
+    # pump HighGUI events and return the key pressed (& 0xFF), -1 & 0xFF if none, without
+    # the waitKey(n) delay. pollKey() needs OpenCV 4.5.3+; older builds wait 1 ms.
+    import cv2
+    if hasattr(cv2, 'pollKey'):
+        return cv2.pollKey() & 0xFF
+    return cv2.waitKey(1) & 0xFF
+
+
+class FramePacer:
+
+    def __init__(self, fps=None, camera=None, offset=0.002, spin=0.0005, history=1000):
+
+        self.fps      = fps       # fixed rate; None: from camera.framerate[sensor_mode]
+        self.camera   = camera    # phase-lock the deadlines to this camera's grabs
+        self.offset   = offset    # wake this long after the expected frame arrival
+        self.spin     = spin      # the last part of each wait is spun, not slept
+        self.deadline = None
+        self.frames   = 0         # wait() calls
+        self.missed   = 0         # deadlines that had already passed
+        self.errors   = deque(maxlen=history)   # wake time - deadline, on-time waits
+        self.lateness = deque(maxlen=history)   # how late the overruns were
+
+    @property
+    def period(self):
+        # follows the camera's sensor mode, e.g. after reconfigure()
+        fps = self.fps
+        if fps is None and self.camera is not None:
+            fps = self.camera.framerate.get(self.camera.sensor_mode)
+        return 1.0 / (fps or DEFAULT_FPS)
+
+    def _align(self, deadline, period):
+        # move the deadline onto the camera's frame grid: offset after an expected grab
+        if self.camera is None or not self.camera.running:
+            return deadline
+        ref = self.camera.last_grab + self.offset
+        return ref + round((deadline - ref) / period) * period
+
+    def wait(self):
+        # sleep until the next deadline; returns the seconds it was missed by (0 if met)
+        period = self.period
+        now = time()
+        if self.deadline is None:
+            self.deadline = now
+        deadline = self._align(self.deadline + period, period)
+        self.frames += 1
+        late = now - deadline
+        if late > 0:
+            # overran: skip to the first deadline still ahead
+            skipped = int(late // period) + 1
+            self.missed += skipped
+            self.lateness.append(late)
+            self.deadline = deadline + (skipped - 1) * period
+            return late
+        if -late > self.spin:
+            sleep(-late - self.spin)
+        while time() < deadline:
+            pass
+        self.errors.append(time() - deadline)
+        self.deadline = deadline
+        return 0.0
+
+    def reset(self):
+        self.deadline = None
+
+    def report(self):
+        errors = np.array(self.errors) * 1000
+        late = np.array(self.lateness) * 1000
+        return {'frames': self.frames, 'missed': self.missed,
+                'target_fps': 1.0 / self.period,
+                'jitter_ms': errors.std() if len(errors) else 0.0,
+                'wake_p99_ms': np.percentile(errors, 99) if len(errors) else 0.0,
+                'late_mean_ms': late.mean() if len(late) else 0.0,
+                'late_max_ms': late.max() if len(late) else 0.0}
+
+    def __str__(self):
+        r = self.report()
+        return ("Pacing at {target_fps:.0f} fps: {frames} frames, {missed} deadlines missed "
+                "(mean {late_mean_ms:.1f} ms late, max {late_max_ms:.1f} ms), wake-up "
+                "jitter {jitter_ms:.2f} ms, p99 {wake_p99_ms:.2f} ms".format(**r))
@@ -0,0 +1,415 @@
+# ws_pipeline.py
+# Composable streaming pipeline: read -> stages -> display, with per-stage threads or
+# processes, bounded queues with drop policies and per-stage statistics
+
+# Every face-detection/display script repeats the same serial read -> resize -> gray ->
+# detect -> draw -> show loop, so the slowest step limits everything. Here each step is a
+# Stage, and stages are chained into a Pipeline:
+#
+#   pipe = Pipeline(camera)                                   # or any iterable of frames
+#   pipe.add(Stage('gray', to_gray))                          # inline: upstream's thread
+#   pipe.add(Stage('detect', detect_faces, mode='thread', workers=2))
+#   pipe.add(Stage('draw', draw_faces, mode='thread'))
+#   pipe.run(show)                                            # sink runs in this thread
+#
+# A stage function takes and returns an item dict ({'frame': ..., plus whatever earlier
+# stages added}); returning None drops the item. Modes:
+#   inline   runs in the thread of the stage before it, no queue in between
+#   thread   own thread; with workers > 1 a thread pool (OpenCV releases the GIL)
+#   process  a process pool of workers; the function must be a picklable top-level one
+# Pools keep their results in submission order, so frames reach the sink in capture order
+# even when several are processed at once. Queues between stages are bounded; when one is
+# full the 'drop_oldest' policy discards the oldest waiting item, 'drop_newest' the
+# incoming one and 'block' makes the upstream stage wait (never used for the camera feed,
+# which must not block the capture thread).
+# stop() closes every queue: waiting threads wake up, further items are dropped and every
+# thread sees the end of the stream. An exception in the source or in a stage ends the
+# stream too, and run() raises it once the pipeline has stopped.
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from time import time
+
+STOP = object()   # end of stream marker
+
+
+class DropQueue:
+
+    def __init__(self, size=2, policy='drop_oldest'):
+
+        if policy not in ('drop_oldest', 'drop_newest', 'block'):
+            raise ValueError("policy must be 'drop_oldest', 'drop_newest' or 'block'")
+        self.size = size
+        self.policy = policy
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if self.closed and item is not STOP:
+                return
+            if item is not STOP and len(self.items) >= self.size:
+                if self.policy == 'drop_newest':
+                    self.dropped += 1
+                    return
+                if self.policy == 'drop_oldest':
+                    self.items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self.items) >= self.size and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def get(self):
+        # STOP once the queue is closed, whatever is still waiting in it
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return STOP
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Stage:
+
+    def __init__(self, name, fn, mode='inline', workers=1, queue_size=2,
+                 drop=None, smoothing=0.9):
+
+        if mode not in ('inline', 'thread', 'process'):
+            raise ValueError("mode must be 'inline', 'thread' or 'process'")
+        self.name = name
+        self.fn = fn
+        self.mode = mode
+        self.workers = workers
+        # drop=None: follow the pipeline, which drops for a camera and waits for a file
+        self.drop = drop
+        self.queue = DropQueue(queue_size, drop or 'drop_oldest') if mode != 'inline' \
+                     else None
+        self.smoothing = smoothing
+        self.processed = 0
+        self.filtered = 0        # items the function dropped by returning None
+        self.latency = 0.0       # smoothed ms per item spent in fn (wall time)
+        self.t_first = None
+        self.t_last = None
+
+    def _record(self, t0, t1):
+        ms = (t1 - t0) * 1000
+        a = self.smoothing
+        self.latency = a * self.latency + (1 - a) * ms if self.processed else ms
+        self.processed += 1
+        if self.t_first is None:
+            self.t_first = t1
+        self.t_last = t1
+
+    def call(self, item):
+        # run fn in the current thread
+        t0 = time()
+        out = self.fn(item)
+        self._record(t0, time())
+        return out
+
+    def stats(self):
+        span = (self.t_last - self.t_first) if self.processed > 1 else 0
+        return {'mode': self.mode, 'workers': self.workers, 'processed': self.processed,
+                'throughput': (self.processed - 1) / span if span else 0.0,
+                'latency_ms': self.latency, 'filtered': self.filtered,
+                'dropped': self.queue.dropped if self.queue is not None else 0,
+                'queued': len(self.queue) if self.queue is not None else 0}
+
+
+def _timed(fn, item):
+    # runs in a pool worker; the start/end times come back with the result
+    t0 = time()
+    out = fn(item)
+    return out, t0, time()
+
+
+class Pipeline:
+
+    def __init__(self, source, queue_size=2, drop='drop_oldest'):
+
+        # source: a CSI_Camera (fed from its capture thread, never blocking it) or any
+        # iterable of frames or (frame, timestamp) pairs (fed from a reader thread, which
+        # waits for room: 'block')
+        self.source = source
+        self.stages = []
+        self.groups = []   # lists of stages that share one thread (a queued stage + inlines)
+        self.head = DropQueue(queue_size, drop if hasattr(source, 'add_sink') else 'block')
+        self.out = None
+        self.queues = []
+        self.threads = []
+        self.pools = []
+        self.seq = 0
+        self.running = False
+        self.error = None   # the first exception of the source or a stage
+        self.sink_stats = Stage('sink', None)
+
+    def add(self, stage):
+        if stage.queue is not None and stage.drop is None:
+            stage.queue.policy = self.head.policy
+        self.stages.append(stage)
+        return self
+
+    def _feed(self, frame, timestamp=None, seq=None):
+        self.seq = seq if seq is not None else self.seq + 1
+        self.head.put({'frame': frame, 'seq': self.seq,
+                       'timestamp': timestamp if timestamp is not None else time()})
+
+    def _fail(self, e):
+        if self.error is None:
+            self.error = e
+
+    def _read_iterable(self):
+        try:
+            for frame in self.source:
+                if not self.running:
+                    break
+                if isinstance(frame, tuple):
+                    self._feed(*frame)
+                else:
+                    self._feed(frame)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self.head.put(STOP)
+
+    def _run_group(self, inq, group, outq):
+        # one thread: take items from inq, run the first stage (on its pool if it has one)
+        # and the inline stages after it, and pass the results on in order
+        first, rest = group[0], group[1:]
+        pool = None
+        if first.mode == 'process':
+            pool = ProcessPoolExecutor(first.workers)
+        elif first.mode == 'thread' and first.workers > 1:
+            pool = ThreadPoolExecutor(first.workers)
+        if pool is not None:
+            self.pools.append(pool)
+        pending = deque()
+
+        def finish(item):
+            for stage in rest:
+                if item is None:
+                    return
+                item = stage.call(item)
+                if item is None:
+                    stage.filtered += 1
+            if item is not None:
+                outq.put(item)
+
+        try:
+            while True:
+                item = inq.get()
+                if item is STOP:
+                    break
+                if pool is None:
+                    out = first.call(item)
+                    if out is None:
+                        first.filtered += 1
+                    finish(out)
+                    continue
+                pending.append(pool.submit(_timed, first.fn, item))
+                # keep at most `workers` items in flight; results leave in submission order
+                while pending and (len(pending) >= first.workers or pending[0].done()):
+                    out, t0, t1 = pending.popleft().result()
+                    first._record(t0, t1)
+                    if out is None:
+                        first.filtered += 1
+                    finish(out)
+            while pending:
+                out, t0, t1 = pending.popleft().result()
+                first._record(t0, t1)
+                if out is None:
+                    first.filtered += 1
+                finish(out)
+        except Exception as e:
+            # a failing stage ends the stream instead of leaving the sink waiting; run()
+            # raises the error
+            self._fail(e)
+        finally:
+            outq.put(STOP)
+
+    def start(self):
+        # one thread per queued stage, shared with the inline stages that follow it (a
+        # leading inline stage gets a thread of its own)
+        self.groups = []
+        for stage in self.stages:
+            if stage.mode == 'inline' and self.groups:
+                self.groups[-1].append(stage)
+            else:
+                self.groups.append([stage])
+        self.running = True
+        self.error = None
+        inq = self.head
+        self.queues = [inq]
+        for i, group in enumerate(self.groups):
+            # the queue in front of the next group, or the one the sink reads from (which
+            # drops like the head queue: a camera feed drops, a file feed waits)
+            outq = self.groups[i + 1][0].queue if i + 1 < len(self.groups) else \
+                   DropQueue(self.head.size, self.head.policy)
+            t = threading.Thread(target=self._run_group, args=(inq, group, outq),
+                                 daemon=True)
+            self.threads.append(t)
+            self.queues.append(outq)
+            inq = outq
+        self.out = inq
+        for t in self.threads:
+            t.start()
+        if hasattr(self.source, 'add_sink'):
+            self.source.add_sink(self._feed)
+        else:
+            t = threading.Thread(target=self._read_iterable, daemon=True)
+            self.threads.append(t)
+            t.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if hasattr(self.source, 'remove_sink'):
+            self.source.remove_sink(self._feed)
+        # wake every thread waiting on a queue, whether to put or to get
+        for q in self.queues:
+            q.close()
+            q.put(STOP)
+        for t in self.threads:
+            t.join(2.0)
+        self.threads = []
+        for pool in self.pools:
+            pool.shutdown(wait=False)
+
+    def run(self, sink, frames=None):
+        # Pull processed items in this thread (HighGUI wants the main thread) and hand
+        # them to sink(item); stops when sink returns False, after `frames` items, or at
+        # the end of the source. Returns the per-stage statistics; raises the exception
+        # that ended the stream if the source or a stage failed.
+        if not self.running:
+            self.start()
+        n = 0
+        try:
+            while frames is None or n < frames:
+                item = self.out.get()
+                if item is STOP:
+                    break
+                t0 = time()
+                keep_going = sink(item)
+                self.sink_stats._record(t0, time())
+                n += 1
+                if keep_going is False:
+                    break
+        finally:
+            self.stop()
+        if self.error is not None:
+            raise self.error
+        return self.stats()
+
+    def stats(self):
+        stats = {s.name: s.stats() for s in self.stages}
+        stats['sink'] = self.sink_stats.stats()
+        stats['sink']['dropped'] = self.out.dropped if self.out is not None else 0
+        stats['source'] = {'dropped': self.head.dropped}
+        return stats
+
+    def print_stats(self):
+        print("{:10s} {:8s} {:>7s} {:>9s} {:>8s} {:>10s} {:>8s} {:>8s}".format(
+            'stage', 'mode', 'workers', 'processed', 'per sec', 'latency ms', 'dropped',
+            'filtered'))
+        for name, s in self.stats().items():
+            if name == 'source':
+                print("{:10s} dropped at the head of the pipeline: {}".format(name, s['dropped']))
+                continue
+            print("{:10s} {:8s} {:7d} {:9d} {:8.1f} {:10.2f} {:8d} {:8d}".format(
+                name, s['mode'], s['workers'], s['processed'], s['throughput'],
+                s['latency_ms'], s['dropped'], s['filtered']))
+
+
+# Stage functions for face detection. They are top-level functions so that they also
+# work in 'process' mode; the cascades are loaded once per thread/process.
+
+_cascades = threading.local()
+
+def _cascade(name):
+    import cv2
+    c = getattr(_cascades, name, None)
+    if c is None:
+        c = cv2.CascadeClassifier("/usr/share/opencv4/haarcascades/haarcascade_{}.xml".format(
+            name))
+        setattr(_cascades, name, c)
+    return c
+
+def to_gray(item):
+    import cv2
+    frame = item['frame']
+    item['gray'] = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return item
+
+def detect_faces(item):
+    item['faces'] = _cascade('frontalface_default').detectMultiScale(item['gray'], 1.3, 5)
+    return item
+
+def detect_eyes(item):
+    eyes = []
+    for (x, y, w, h) in item['faces']:
+        for (ex, ey, ew, eh) in _cascade('eye').detectMultiScale(item['gray'][y:y+h, x:x+w]):
+            eyes.append((x + ex, y + ey, ew, eh))
+    item['eyes'] = eyes
+    return item
+
+def draw_detections(item):
+    import cv2
+    img = item['frame'].copy()   # the captured frame may be shared; draw on a copy
+    for (x, y, w, h) in item.get('faces', ()):
+        cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
+    for (x, y, w, h) in item.get('eyes', ()):
+        cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    item['display'] = img
+    return item
+
+
+def face_detect_pipeline(source, detect_workers=2, eyes=True):
+    pipe = Pipeline(source)
+    pipe.add(Stage('gray', to_gray, mode='thread'))
+    pipe.add(Stage('detect', detect_faces, mode='thread', workers=detect_workers))
+    if eyes:
+        pipe.add(Stage('eyes', detect_eyes, mode='inline'))
+    pipe.add(Stage('draw', draw_detections, mode='thread'))
+    return pipe
+
+
+if __name__ == "__main__":
+
+    import cv2
+    import ws_csi_camera as ws
+    from ws_pacing import poll_key
+
+    sensor_mode = ws.S_MODE_3_1280_720_60
+    dispW, dispH = ws.DISP_W_M3_M4_one_half, ws.DISP_H_M3_M4_one_half
+    camera = ws.CSI_Camera(display_fps=False)
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=sensor_mode,
+                                     display_width=dispW, display_height=dispH)
+    camera.open(camera.gstreamer_pipeline)
+    camera.start()
+
+    def show(item):
+        cv2.imshow("Face Detect pipeline", item['display'])
+        return poll_key() != 27   # paced by the pipeline, not by a key delay
+
+    pipe = face_detect_pipeline(camera)
+    pipe.run(show)
+    pipe.print_stats()
+    camera.release()
+    cv2.destroyAllWindows()
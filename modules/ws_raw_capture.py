@@ -0,0 +1,245 @@
+# ws_raw_capture.py
+# Raw frame capture for deterministic replay
+
+# JPEG snapshots lose data and video codecs add decode cost on replay. A raw capture is two
+# files:
+#   <name>.raw  frames exactly as grabbed, appended sequentially through a memory map
+#   <name>.idx  one fixed-size record per frame: offset, timestamp, sequence, shape, dtype
+# Nothing is re-encoded. On replay every frame is an np.frombuffer view straight into the
+# memory-mapped .raw file.
+
+# Recording from a CSI_Camera (the writer runs as a sink in the capture thread, so every
+# grabbed frame is recorded exactly once):
+#   writer = RawWriter('field_run')
+#   camera.add_sink(writer.write)
+#   ...
+#   camera.remove_sink(writer.write); writer.close()
+# Replaying through a CSI_Camera, at the recorded speed or as fast as possible:
+#   camera.open(RawReplay('field_run', speed=1.0))   # speed=None: unlimited
+
+import mmap
+import os
+import time
+import cv2
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('timestamp', '<f8'), ('seq', '<u8'),
+                        ('height', '<u4'), ('width', '<u4'), ('channels', '<u4'),
+                        ('dtype', 'S8')])
+
+def _align(n, a=64):
+    return (n + a - 1) // a * a
+
+
+class RawWriter:
+
+    def __init__(self, name, chunk_bytes=256 << 20, flush_every=30):
+
+        self.name = name
+        self.chunk_bytes = chunk_bytes    # the .raw file grows in steps of this size
+        self.flush_every = flush_every    # index records between flushes
+        self.data = open(name + '.raw', 'w+b')
+        self.index = open(name + '.idx', 'wb')
+        self.capacity = chunk_bytes
+        self.data.truncate(self.capacity)
+        self.mm = mmap.mmap(self.data.fileno(), self.capacity)
+        self.offset = 0
+        self.frames = 0
+        self.record = np.zeros(1, INDEX_DTYPE)
+
+    def _grow(self, needed):
+        self.mm.close()
+        while self.capacity < needed:
+            self.capacity += self.chunk_bytes
+        self.data.truncate(self.capacity)
+        self.mm = mmap.mmap(self.data.fileno(), self.capacity)
+
+    def write(self, frame, timestamp=None, seq=None):
+        # append one frame; usable directly as a CSI_Camera sink
+        if timestamp is None:
+            timestamp = time.time()
+        if seq is None:
+            seq = self.frames
+        frame = np.ascontiguousarray(frame)
+        end = self.offset + frame.nbytes
+        if end > self.capacity:
+            self._grow(end)
+        dst = np.ndarray(frame.shape, frame.dtype, self.mm, self.offset)
+        np.copyto(dst, frame)
+        shape = frame.shape + (1,) * (3 - frame.ndim)
+        r = self.record[0]
+        r['offset'], r['timestamp'], r['seq'] = self.offset, timestamp, seq
+        r['height'], r['width'], r['channels'] = shape
+        r['dtype'] = frame.dtype.str.encode()
+        self.index.write(self.record.tobytes())
+        self.offset = _align(end)
+        self.frames += 1
+        if self.frames % self.flush_every == 0:
+            self.index.flush()
+
+    def close(self):
+        # trim the preallocated tail of the .raw file
+        self.index.close()
+        self.mm.close()
+        self.data.truncate(self.offset)
+        self.data.close()
+
+
+class RawReader:
+
+    def __init__(self, name):
+
+        self.name = name
+        self.index = np.fromfile(name + '.idx', INDEX_DTYPE)
+        self.file = open(name + '.raw', 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size \
+                  else None
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self, i):
+        # read-only view of frame i, straight from the memory map
+        r = self.index[i]
+        h, w, c = int(r['height']), int(r['width']), int(r['channels'])
+        shape = (h, w) if c == 1 else (h, w, c)
+        dtype = np.dtype(r['dtype'].decode())
+        return np.frombuffer(self.mm, dtype, h * w * c, int(r['offset'])).reshape(shape)
+
+    def __iter__(self):
+        for i in range(len(self.index)):
+            yield self.index[i]['seq'], self.index[i]['timestamp'], self.frame(i)
+
+    def close(self):
+        try:
+            if self.mm is not None:
+                self.mm.close()
+        except BufferError:
+            # frames handed out are still referenced; the map goes away with them
+            pass
+        self.file.close()
+
+
+class RawReplay:
+
+    # VideoCapture-like source (read/isOpened/release) that replays a raw capture, at the
+    # recorded pace scaled by speed, or as fast as possible when speed is None
+
+    def __init__(self, name, speed=1.0, loop=False):
+
+        self.reader = RawReader(name)
+        self.speed = speed
+        self.loop = loop
+        self.pos = 0
+        self.start = None   # (wall clock, recorded timestamp) of the first replayed frame
+
+    def isOpened(self):
+        return self.reader is not None and len(self.reader) > 0
+
+    def read(self):
+        if self.reader is None:
+            return False, None
+        if self.pos >= len(self.reader):
+            if not self.loop:
+                return False, None
+            self.pos = 0
+            self.start = None
+        ts = float(self.reader.index[self.pos]['timestamp'])
+        if self.speed:
+            if self.start is None:
+                self.start = (time.time(), ts)
+            delay = self.start[0] + (ts - self.start[1]) / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if self.reader is None:
+                return False, None   # released while waiting for the frame's time
+        frame = self.reader.frame(self.pos)
+        self.pos += 1
+        return True, frame
+
+    def frame_interval(self):
+        # seconds from the last frame handed out to the next one at the replay speed, i.e.
+        # the recorded gap that read() is waiting out; CSI_Camera's watchdog allows for it
+        # before it takes the replay for stalled. None when not paced.
+        reader = self.reader
+        if reader is None or not self.speed or not 0 < self.pos < len(reader):
+            return None
+        index = reader.index
+        return float(index[self.pos]['timestamp'] - index[self.pos - 1]['timestamp']) / \
+               self.speed
+
+    def get(self, prop):
+        # the VideoCapture properties that have a meaning here, from the recording: the
+        # time of the frame last read (ms since the first frame) and the recorded rate;
+        # 0 for anything else, as VideoCapture does
+        reader = self.reader
+        if reader is None or len(reader) == 0:
+            return 0.0
+        t = reader.index['timestamp']
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return float(t[max(self.pos - 1, 0)] - t[0]) * 1000
+        if prop == cv2.CAP_PROP_FPS and len(reader) > 1 and t[-1] > t[0]:
+            return (len(reader) - 1) / float(t[-1] - t[0])
+        return 0.0
+
+    def fps(self):
+        # the recorded frame rate at the replay speed, e.g. to pace a display of the
+        # replay; None when not paced
+        reader = self.reader
+        if reader is None or not self.speed or len(reader) < 2:
+            return None
+        t = reader.index['timestamp']
+        return (len(reader) - 1) / float(t[-1] - t[0]) * self.speed if t[-1] > t[0] else None
+
+    def release(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+if __name__ == "__main__":
+
+    #   python3 ws_raw_capture.py record NAME [seconds] [sensor_mode]
+    #   python3 ws_raw_capture.py replay NAME [speed]      speed 0: as fast as possible
+    import sys
+    import ws_csi_camera as ws
+    from ws_pacing import FramePacer, poll_key
+
+    command, name = sys.argv[1], sys.argv[2]
+    camera = ws.CSI_Camera(display_fps=False)
+    if command == 'record':
+        seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+        sensor_mode = int(sys.argv[4]) if len(sys.argv) > 4 else ws.S_MODE_3_1280_720_60
+        dispW, dispH = ws.DISP_ONE_QUARTER[sensor_mode]
+        camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=sensor_mode,
+                                         display_width=dispW, display_height=dispH)
+        camera.open(camera.gstreamer_pipeline)
+        writer = RawWriter(name)
+        camera.add_sink(writer.write)
+        camera.start()
+        time.sleep(seconds)
+        camera.stop()
+        camera.remove_sink(writer.write)
+        writer.close()
+        print("Recorded {} frames, {:.1f} MB".format(writer.frames, writer.offset / 1e6))
+    else:
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+        replay = RawReplay(name, speed=speed or None)
+        camera.open(replay)
+        camera.start()
+        # shown at the recorded rate (30 fps when replaying as fast as possible)
+        pacer = FramePacer(fps=replay.fps(), camera=camera)
+        t0 = time.time()
+        while camera.running:
+            ok, frame = camera.read()
+            if ok:
+                cv2.imshow("Replay: " + name, frame)
+            pacer.wait()
+            if poll_key() == ord('q'):
+                break
+        print(pacer)
+        print("Replayed {} frames in {:.1f} sec".format(camera.frames_grabbed,
+                                                       time.time() - t0))
+        cv2.destroyAllWindows()
+    camera.release()
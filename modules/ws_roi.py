@@ -0,0 +1,173 @@
+# ws_roi.py
+# Digital zoom: steer a camera's region of interest (CSI_Camera.set_roi) to a detected face
+
+# Seeing a face at full sensor resolution used to mean capturing all of 3264x2464 and
+# cropping in Python. With an ROI nvvidconv does the crop, so only the face region crosses
+# into Python. An RoiFollower drives that from face detections:
+#   - zoomed out (whole frame, usually scaled down): the largest face gets an ROI of
+#     `size` sensor pixels centred on it, captured at full resolution
+#   - zoomed in: the face nearest the ROI centre is tracked; the ROI is only moved when
+#     the face leaves the inner part of the ROI (`margin` on each side), because every
+#     move of a hardware ROI rebuilds the pipeline
+#   - after `patience` frames without a face it zooms out again
+# A hardware ROI move (CSI_Camera.reconfigure) takes seconds, so it runs in a thread of
+# its own instead of blocking the loop that calls update(), and is made at most every
+# `min_interval` seconds; moves asked for meanwhile are dropped (counted in .skipped) and
+# asked for again by the next detections. A capture-thread crop is moved at once.
+# Detections are given in the coordinates of the frame they were found in; the follower
+# maps them to sensor pixels through the camera's current ROI. While a move is in progress
+# and for `settle` frames after it detections are ignored, since they may still come from
+# frames of the old ROI.
+#   follower = RoiFollower(camera, size=(816, 616))
+#   faces = detect(frame)
+#   follower.update(faces, frame.shape)
+#   ...
+#   follower.close()
+
+import threading
+from time import time
+
+SETTLE_FRAMES = 3
+
+
+def roi_around(center, size, full):
+    # (left, top, right, bottom) of size (width, height) centred on center, shifted to
+    # lie inside a full = (width, height) frame
+    w, h = min(size[0], full[0]), min(size[1], full[1])
+    left = min(max(int(center[0] - w / 2), 0), full[0] - w)
+    top = min(max(int(center[1] - h / 2), 0), full[1] - h)
+    return (left, top, left + w, top + h)
+
+
+class RoiFollower:
+
+    def __init__(self, camera, size=None, margin=0.25, patience=15, settle=SETTLE_FRAMES,
+                 min_interval=2.0):
+
+        self.camera       = camera
+        self.size         = size       # ROI (width, height) in sensor pixels; None: 1/4 frame
+        self.margin       = margin     # share of the ROI on each side the face may drift into
+        self.patience     = patience   # frames without a face before zooming out
+        self.settle       = settle
+        self.min_interval = min_interval   # seconds between hardware ROI moves
+        self.lost         = 0
+        self.hold         = 0
+        self.moves        = 0
+        self.skipped      = 0          # moves dropped: one in progress or the last too recent
+        self.mover        = None       # thread rebuilding the pipeline for a hardware move
+        self.last_move    = 0.0        # end of the last hardware move
+
+    @property
+    def moving(self):
+        return self.mover is not None and self.mover.is_alive()
+
+    @property
+    def zoomed(self):
+        return self.camera.roi is not None
+
+    def to_full(self, box, frame_shape):
+        # a box (x, y, w, h) in frame coordinates -> sensor/source coordinates
+        full = self.camera.full_size()
+        left, top, right, bottom = self.camera.roi or (0, 0, full[0], full[1])
+        sx = (right - left) / frame_shape[1]
+        sy = (bottom - top) / frame_shape[0]
+        x, y, w, h = box
+        return (left + x * sx, top + y * sy, w * sx, h * sy)
+
+    def _move(self, center):
+        full = self.camera.full_size()
+        size = self.size or (full[0] // 4, full[1] // 4)
+        return self._set_roi(roi_around(center, size, full))
+
+    def _set_roi(self, roi):
+        # False if the move was dropped
+        if not self.camera.hardware_roi():
+            self.camera.set_roi(roi)
+            self.moves += 1
+            self.hold = self.settle
+            return True
+        if self.moving or time() - self.last_move < self.min_interval:
+            self.skipped += 1
+            return False
+        self.moves += 1
+        self.mover = threading.Thread(target=self._rebuild, args=(roi,), daemon=True)
+        self.mover.start()
+        return True
+
+    def _rebuild(self, roi):
+        self.camera.set_roi(roi)
+        self.last_move = time()
+        self.hold = self.settle
+
+    def update(self, faces, frame_shape):
+        # once per processed frame with its detections; returns the camera's ROI
+        if self.moving:
+            return self.camera.roi
+        if self.hold > 0:
+            self.hold -= 1
+            return self.camera.roi
+        boxes = [self.to_full(b, frame_shape) for b in faces]
+        if not boxes:
+            self.lost += 1
+            if self.zoomed and self.lost >= self.patience and self._set_roi(None):
+                self.lost = 0
+            return self.camera.roi
+        self.lost = 0
+        centers = [(x + w / 2, y + h / 2, w * h) for (x, y, w, h) in boxes]
+        roi = self.camera.roi
+        if roi is None:
+            cx, cy, _ = max(centers, key=lambda c: c[2])
+            self._move((cx, cy))
+            return self.camera.roi
+        left, top, right, bottom = roi
+        rx, ry = (left + right) / 2, (top + bottom) / 2
+        cx, cy, _ = min(centers, key=lambda c: (c[0] - rx) ** 2 + (c[1] - ry) ** 2)
+        mx, my = (right - left) * self.margin, (bottom - top) * self.margin
+        if not (left + mx <= cx <= right - mx and top + my <= cy <= bottom - my):
+            self._move((cx, cy))
+        return self.camera.roi
+
+    def close(self):
+        # wait for a move in progress
+        if self.mover is not None:
+            self.mover.join()
+            self.mover = None
+
+
+if __name__ == "__main__":
+
+    # follow a face in sensor mode 0: quarter-scale overview, full-resolution ROI on a face
+    import cv2
+    import ws_csi_camera as ws
+    from ws_pacing import FramePacer, poll_key
+
+    sensor_mode = ws.S_MODE_0_3264_2464_21
+    dispW, dispH = ws.DISP_ONE_QUARTER[sensor_mode]
+    camera = ws.CSI_Camera(display_fps=False)
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=sensor_mode,
+                                     display_width=dispW, display_height=dispH)
+    camera.open(camera.gstreamer_pipeline)
+    camera.start()
+    cascade = cv2.CascadeClassifier(
+        "/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml")
+    follower = RoiFollower(camera, size=(dispW, dispH))
+    # one detection per camera frame instead of spinning on the same frame
+    pacer = FramePacer(camera=camera)
+    while True:
+        ok, frame = camera.latest()
+        if ok:
+            gray = camera.gray_of(frame)
+            faces = cascade.detectMultiScale(gray, 1.3, 5)
+            follower.update(faces, gray.shape)
+            img = camera.bgr_of(frame)
+            for (x, y, w, h) in faces:
+                cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
+            cv2.imshow("ROI follower", img)
+        pacer.wait()
+        if poll_key() in (27, ord('q')):
+            break
+    print(pacer)
+    follower.close()
+    print("ROI moves: {} ({} dropped)".format(follower.moves, follower.skipped))
+    camera.release()
+    cv2.destroyAllWindows()
@@ -0,0 +1,79 @@
+# ws_sources.py
+# Frame sources besides the CSI cameras, for CSI_Camera.open()
+
+# CSI_Camera.open() takes a GStreamer pipeline, a V4L2 device number or any object with the
+# VideoCapture read()/isOpened()/release() methods. open_source() turns a source name as
+# given on a command line or in a config file into one of those:
+#   'csi'          (not handled here: the caller builds a pipeline for the CSI camera)
+#   '1'            V4L2 device 1, e.g. a USB webcam
+#   'raw:NAME'     a raw capture replayed at the recorded speed (ws_raw_capture.py)
+#   'synthetic'    generated frames, no hardware needed (SyntheticSource)
+#   anything else  a video file, decoded by OpenCV
+# With paced=False raw captures and synthetic frames come as fast as they are read, for
+# offline processing (ws_offline.py); a synthetic source then needs a frame count.
+# Files, raw captures and synthetic frames make every workload runnable on a plain PC or in
+# CI, without a camera.
+
+import time
+import cv2
+import numpy as np
+
+
+class SyntheticSource:
+
+    # VideoCapture-like source of generated BGR frames at a fixed rate: a static gradient
+    # with a bright square moving across it, so motion-dependent code has something to see
+
+    def __init__(self, width=640, height=480, fps=30, frames=None, paced=True):
+
+        self.width  = width
+        self.height = height
+        self.fps    = fps
+        self.frames = frames     # None: endless
+        self.paced  = paced      # False: no waiting, fps is only the nominal rate
+        self.count  = 0
+        self.next_time = None
+        gx = np.linspace(0, 255, width, dtype=np.float32)
+        gy = np.linspace(0, 255, height, dtype=np.float32)
+        self.background = np.dstack([np.broadcast_to(gx, (height, width)),
+                                     np.broadcast_to(gy[:, None], (height, width)),
+                                     np.full((height, width), 96, np.float32)]).astype(np.uint8)
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if not self.opened or (self.frames is not None and self.count >= self.frames):
+            return False, None
+        if self.fps and self.paced:
+            now = time.time()
+            if self.next_time is None:
+                self.next_time = now
+            elif self.next_time > now:
+                time.sleep(self.next_time - now)
+            self.next_time += 1.0 / self.fps
+        # a new array every frame: CSI_Camera hands frames out without copying
+        frame = self.background.copy()
+        side = max(self.height // 6, 8)
+        x = (self.count * 4) % max(self.width - side, 1)
+        y = (self.height - side) // 2
+        frame[y:y + side, x:x + side] = 255
+        self.count += 1
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+
+def open_source(source, width=640, height=480, fps=30, paced=True, frames=None):
+    # a capture object or device number for CSI_Camera.open(); see the list above
+    source = str(source)
+    if source.isdigit():
+        return int(source)
+    if source == 'synthetic':
+        return SyntheticSource(width, height, fps, frames=frames, paced=paced)
+    if source.startswith('raw:'):
+        from ws_raw_capture import RawReplay
+        return RawReplay(source[4:], speed=1.0 if paced else None)
+    return cv2.VideoCapture(source)
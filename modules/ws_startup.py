@@ -0,0 +1,145 @@
+# ws_startup.py
+# Parallel camera bring-up with a startup-time breakdown per camera
+
+# Opening a CSI camera is dominated by nvargus warm-up: building the pipeline and waiting
+# for the first frame. Opening two cameras one after the other pays that twice. Here every
+# camera is opened in its own thread, so the warm-ups overlap and startup takes about as
+# long as the slowest camera.
+
+# A camera that misses the timeout is left to its thread, which releases it as soon as it
+# opens; deciding 'timed out' and starting the camera happen under one lock, so a camera is
+# either started and handed to the caller, or released, never both or neither.
+
+# The breakdown starts with the imports: the time from interpreter start to open_cameras(),
+# i.e. starting Python and importing cv2, numpy and the modules before a camera can be
+# opened. That is paid once, before any camera, so it is the same in every report; it is
+# read from the process start time in /proc (0 where there is none).
+
+# Each camera is described by a dict:
+#   {'sensor_id': 0, 'sensor_mode': 2, 'display_width': 480, 'display_height': 270}
+#   {'device': 1}                      a V4L2 device such as a USB webcam
+# plus optional 'flip_method', 'color_format', 'display_fps' and 'stats' (see ws_stats.py).
+
+import os
+import threading
+from time import time
+import ws_csi_camera as ws
+
+
+def process_start_time():
+    # wall-clock time this process (the interpreter) started, or None where /proc is missing
+    try:
+        with open('/proc/self/stat') as f:
+            # fields after the parenthesized command name; starttime is field 22
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as f:
+            boot = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+    return boot + start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+class CameraStartup:
+
+    # startup breakdown for one camera, all times in seconds
+    def __init__(self, spec):
+        self.spec        = spec
+        self.camera      = None
+        self.ok          = False
+        self.timed_out   = False
+        self.done        = False  # bring-up finished: started, released or failed
+        self.lock        = threading.Lock()   # done vs timed_out
+        self.import_time = 0.0   # interpreter start to open_cameras() (shared, paid once)
+        self.open_time   = 0.0   # constructing the pipeline / VideoCapture
+        self.first_frame = 0.0   # from pipeline open to the first frame
+        self.total       = 0.0   # from the start of bring-up until first frame
+        self.error       = None
+
+    def __str__(self):
+        name = 'device {}'.format(self.spec['device']) if 'device' in self.spec \
+               else 'sensor {}'.format(self.spec.get('sensor_id', 0))
+        if self.timed_out:
+            status = 'TIMED OUT'
+        elif not self.ok:
+            status = 'FAILED ({})'.format(self.error)
+        else:
+            status = 'ok'
+        return ('{:10s} import {:6.3f}  open {:6.3f}  first frame {:6.3f}  '
+                'total {:6.3f} sec  {}'.format(name, self.import_time, self.open_time,
+                                               self.first_frame, self.total, status))
+
+
+def _bring_up(report, t_start):
+    try:
+        _open(report, t_start)
+    finally:
+        with report.lock:
+            report.done = True
+            late = report.timed_out
+            if report.ok and not late:
+                report.camera.start()
+        if late and report.camera is not None:
+            # open_cameras() has already given up on this camera
+            report.camera.release()
+
+
+def _open(report, t_start):
+    spec = report.spec
+    camera = ws.CSI_Camera(display_fps=spec.get('display_fps', True), stats=spec.get('stats'))
+    report.camera = camera
+    try:
+        if 'device' in spec:
+            camera.open(spec['device'])
+        else:
+            camera.create_gstreamer_pipeline(sensor_id=spec.get('sensor_id', 0),
+                                             sensor_mode=spec.get('sensor_mode', 3),
+                                             display_width=spec.get('display_width', 1280),
+                                             display_height=spec.get('display_height', 720),
+                                             flip_method=spec.get('flip_method', 0),
+                                             color_format=spec.get('color_format', 'BGR'))
+            camera.open(camera.gstreamer_pipeline)
+    except Exception as e:
+        report.error = e
+        return
+    report.open_time   = camera.open_time
+    report.first_frame = camera.first_frame_time
+    report.total       = time() - t_start
+    report.ok = camera.video_capture is not None and camera.frame is not None
+    if not report.ok and report.error is None:
+        report.error = 'no frame'
+
+
+def open_cameras(specs, timeout=15.0, verbose=True):
+    # Open all cameras concurrently; returns a list of CameraStartup reports (in the order
+    # of specs) once every camera has delivered its first frame or the timeout expired.
+    # report.camera is the started CSI_Camera when report.ok is True.
+    t_start = time()
+    t_process = process_start_time()
+    reports = [CameraStartup(spec) for spec in specs]
+    for r in reports:
+        # the clock-tick resolution of the process start can put it just after t_start
+        r.import_time = max(t_start - t_process, 0.0) if t_process is not None else 0.0
+    threads = [threading.Thread(target=_bring_up, args=(r, t_start), daemon=True)
+               for r in reports]
+    for t in threads:
+        t.start()
+    deadline = t_start + timeout
+    for r, t in zip(reports, threads):
+        t.join(max(deadline - time(), 0))
+        with r.lock:
+            if not r.done:
+                # still waiting for nvargus; the thread releases the camera when it opens
+                r.timed_out = True
+                r.total = time() - t_start
+    if verbose:
+        print('Camera startup: {:.3f} sec'.format(time() - t_start))
+        for r in reports:
+            print('  ' + str(r))
+    return reports
+
+
+def release_cameras(reports):
+    # release the cameras open_cameras() handed out (timed-out ones release themselves)
+    for r in reports:
+        if r.camera is not None and not r.timed_out:
+            r.camera.release()
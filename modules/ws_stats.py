@@ -0,0 +1,242 @@
+# ws_stats.py
+# Frame-rate statistics strategies for CSI_Camera
+
+# A camera reports three kinds of events to its stats strategy:
+#   grabbed(t)    the capture thread got a new frame at time t
+#   read(t)       a consumer took a frame (latest(), read(), read_gray())
+#   displayed(t)  the application showed a frame (it calls camera.displayed())
+# labels() gives the HUD lines for the camera overlay and summary() a dict for logging.
+# Each event is only ever reported from one thread, so a strategy keeps separate state per
+# event kind and needs no lock on the hot path.
+
+# Strategies:
+#   'none'       NoStats: the camera does not call it at all, so statistics cost nothing
+#   'ema'        EMAStats: exponentially smoothed grab and read rates (the classic HUD)
+#   'windowed'   WindowedStats: frames grabbed/read/displayed in the last full window
+#   'histogram'  HistogramStats: histograms of the intervals between events
+# Select one by name or pass an instance:
+#   camera = CSI_Camera(stats='windowed')
+#   camera = CSI_Camera(stats=HistogramStats(edges_ms=(5, 10, 20, 50)))
+
+import threading
+from bisect import bisect_right
+from time import time
+
+
+class Stats:
+
+    # interface; every method may be overridden independently
+    enabled = True
+
+    def grabbed(self, t):
+        pass
+
+    def read(self, t):
+        pass
+
+    def displayed(self, t):
+        pass
+
+    def reset(self):
+        pass
+
+    def summary(self):
+        return {}
+
+    def labels(self):
+        return []
+
+
+class NoStats(Stats):
+
+    # recognized by the camera, which then skips every stats call
+    enabled = False
+
+
+class EMAStats(Stats):
+
+    def __init__(self, alpha=0.95):
+
+        self.alpha = alpha   # smoothing factor for estimating the rates
+        self.reset()
+
+    def reset(self):
+        self.fps       = 0      # grabbed frames/sec in camera thread
+        self.FRS       = 0      # frames/sec read by external program
+        self.last_grab = None
+        self.last_read = None
+
+    def _update(self, rate, last, t):
+        if last is None or t <= last:
+            return rate
+        return self.alpha * rate + (1 - self.alpha) / (t - last)
+
+    def grabbed(self, t):
+        self.fps = self._update(self.fps, self.last_grab, t)
+        self.last_grab = t
+
+    def read(self, t):
+        self.FRS = self._update(self.FRS, self.last_read, t)
+        self.last_read = t
+
+    def summary(self):
+        return {'grab_fps': self.fps, 'read_fps': self.FRS}
+
+    def labels(self):
+        return ["Frames Read/   Sec: {:3.1f}".format(self.FRS),
+                "Frames Grabbed/Sec: {:3.1f}".format(self.fps)]
+
+
+class WindowedStats(Stats):
+
+    # Counts per window of `interval` seconds, like the old RepeatTimer counters but
+    # without a timer thread: the window is rolled over by whichever event first arrives
+    # after it has ended.
+
+    def __init__(self, interval=1.0):
+
+        self.interval  = interval
+        self.roll_lock = threading.Lock()   # only taken once per window
+        self.reset()
+
+    def reset(self):
+        self.window_end   = time() + self.interval
+        self.n_grabbed    = 0   # running totals, each written by one thread only
+        self.n_read       = 0
+        self.n_displayed  = 0
+        self.marks        = (0, 0, 0)   # totals at the start of the current window
+        self.last_grabbed   = 0   # counts of the last complete window
+        self.last_read      = 0
+        self.last_displayed = 0
+
+    def _roll(self, t):
+        with self.roll_lock:
+            if t < self.window_end:
+                return
+            totals = (self.n_grabbed, self.n_read, self.n_displayed)
+            self.last_grabbed, self.last_read, self.last_displayed = \
+                (n - m for n, m in zip(totals, self.marks))
+            self.marks = totals
+            # a window without any events counts as empty, not as part of this one
+            if t - self.window_end >= self.interval:
+                self.last_grabbed = self.last_read = self.last_displayed = 0
+            self.window_end = t + self.interval
+
+    def grabbed(self, t):
+        if t >= self.window_end:
+            self._roll(t)
+        self.n_grabbed += 1
+
+    def read(self, t):
+        if t >= self.window_end:
+            self._roll(t)
+        self.n_read += 1
+
+    def displayed(self, t):
+        if t >= self.window_end:
+            self._roll(t)
+        self.n_displayed += 1
+
+    def summary(self):
+        return {'grab_fps': self.last_grabbed / self.interval,
+                'read_fps': self.last_read / self.interval,
+                'display_fps': self.last_displayed / self.interval}
+
+    def labels(self):
+        return ["Frames Displayed (PS): {}".format(self.last_displayed),
+                "Frames Grabbed (PS): {}".format(self.last_grabbed)]
+
+
+# interval histogram bin edges in ms; the last bin collects everything above
+HISTOGRAM_EDGES_MS = (2, 4, 6, 8, 10, 12, 14, 17, 20, 25, 33, 40, 50, 67, 100, 200, 500)
+
+
+class _Intervals:
+
+    # histogram of the intervals between consecutive events of one kind
+    def __init__(self, edges_ms):
+        self.edges  = [e / 1000.0 for e in edges_ms]
+        self.counts = [0] * (len(self.edges) + 1)
+        self.first  = None
+        self.last   = None
+        self.n      = 0
+
+    def add(self, t):
+        if self.last is not None:
+            self.counts[bisect_right(self.edges, t - self.last)] += 1
+        else:
+            self.first = t
+        self.last = t
+        self.n += 1
+
+    def rate(self):
+        if self.n < 2 or self.last <= self.first:
+            return 0.0
+        return (self.n - 1) / (self.last - self.first)
+
+    def percentile(self, q):
+        # upper edge (ms) of the bin holding the q-th percentile interval
+        total = sum(self.counts)
+        if not total:
+            return 0.0
+        target, seen = q / 100.0 * total, 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                break
+        return self.edges[min(i, len(self.edges) - 1)] * 1000
+
+
+class HistogramStats(Stats):
+
+    def __init__(self, edges_ms=HISTOGRAM_EDGES_MS):
+
+        self.edges_ms = tuple(edges_ms)
+        self.reset()
+
+    def reset(self):
+        self.grabs   = _Intervals(self.edges_ms)
+        self.reads   = _Intervals(self.edges_ms)
+        self.display = _Intervals(self.edges_ms)
+
+    def grabbed(self, t):
+        self.grabs.add(t)
+
+    def read(self, t):
+        self.reads.add(t)
+
+    def displayed(self, t):
+        self.display.add(t)
+
+    def histogram(self, kind='grab'):
+        # [(upper edge ms or None for the overflow bin, count), ...]
+        h = {'grab': self.grabs, 'read': self.reads, 'display': self.display}[kind]
+        return list(zip(self.edges_ms + (None,), h.counts))
+
+    def summary(self):
+        return {'grab_fps': self.grabs.rate(), 'read_fps': self.reads.rate(),
+                'display_fps': self.display.rate(),
+                'grab_p50_ms': self.grabs.percentile(50),
+                'grab_p99_ms': self.grabs.percentile(99),
+                'read_p99_ms': self.reads.percentile(99)}
+
+    def labels(self):
+        return ["Grab {:3.1f}/sec  p50 <{:.0f} ms  p99 <{:.0f} ms".format(
+                    self.grabs.rate(), self.grabs.percentile(50), self.grabs.percentile(99)),
+                "Read {:3.1f}/sec  p99 <{:.0f} ms".format(
+                    self.reads.rate(), self.reads.percentile(99))]
+
+
+STATS = {'none': NoStats, 'ema': EMAStats, 'windowed': WindowedStats,
+         'histogram': HistogramStats}
+
+
+def make_stats(stats):
+    # a strategy instance from a name in STATS, an instance, or None ('none')
+    if stats is None:
+        return NoStats()
+    if isinstance(stats, str):
+        if stats not in STATS:
+            raise ValueError("stats must be one of {}".format(', '.join(STATS)))
+        return STATS[stats]()
+    return stats
@@ -0,0 +1,220 @@
+# ws_stereo.py
+# Stereo rectification and block-matching disparity for the dual-camera path
+
+# The rectification maps depend only on the calibration and the frame size, so they are
+# computed once per resolution, in the fixed-point CV_16SC2 format that cv2.remap handles
+# fastest, and cached. Both eyes are remapped in parallel (cv2.remap releases the GIL) into
+# preallocated output buffers. The optional disparity step runs StereoBM on downscaled
+# grayscale copies of the rectified pair, also into preallocated buffers.
+
+# The calibration file is either an .npz (numpy.savez) or an OpenCV .yml/.xml FileStorage,
+# holding K1, D1, K2, D2 (intrinsics and distortion of the left and right cameras), R, T
+# (rotation and translation from left to right) and image_size ([width, height] used for
+# calibration), and optionally sensor_mode, the mode it was taken in (default 0, the full
+# field of view). Intrinsics are carried over to the sensor mode and resolution the
+# cameras run at: the sensor modes crop and bin the pixel array differently
+# (ws_csi_camera.SENSOR_GEOMETRY), so a 3264x1848 frame is not a squeezed 3264x2464 one.
+
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from ws_csi_camera import SENSOR_SIZE, SENSOR_GEOMETRY
+
+CALIBRATION_KEYS = ('K1', 'D1', 'K2', 'D2', 'R', 'T', 'image_size')
+
+
+def load_calibration(path, keys=CALIBRATION_KEYS):
+    # also used for single-camera calibrations (see ws_undistort.py)
+    if path.endswith('.npz'):
+        data = np.load(path)
+        calib = {k: np.array(data[k], np.float64) if k in data else None for k in keys}
+    else:
+        fs = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+        if not fs.isOpened():
+            raise IOError("Unable to open calibration file " + path)
+        calib = {k: fs.getNode(k).mat() for k in keys}
+        fs.release()
+    missing = [k for k, v in calib.items() if v is None]
+    if missing:
+        raise ValueError("Calibration file {} is missing {}".format(path, ', '.join(missing)))
+    calib['image_size'] = tuple(int(v) for v in np.ravel(calib['image_size']))
+    calib['sensor_mode'] = _optional_mode(path)
+    if 'T' in calib:
+        calib['T'] = calib['T'].reshape(3, 1)
+    for k in ('D', 'D1', 'D2'):
+        if k in calib:
+            calib[k] = calib[k].reshape(1, -1)
+    return calib
+
+
+def _optional_mode(path):
+    # the sensor mode stored with a calibration, 0 if there is none
+    if path.endswith('.npz'):
+        data = np.load(path)
+        return int(data['sensor_mode']) if 'sensor_mode' in data else 0
+    fs = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+    node = fs.getNode('sensor_mode')
+    mode = 0 if node.empty() else int(node.real())
+    fs.release()
+    return mode
+
+
+def scaled_intrinsics(K, calib_size, size, sensor_mode=None, calib_mode=0):
+    # K calibrated on calib_size frames of calib_mode, for size frames of sensor_mode.
+    # Between two modes K goes through sensor pixels: undo the calibration mode's scaling,
+    # binning and crop offset, then apply the target mode's crop and binning. Only then is
+    # it scaled to the frame size. sensor_mode None: the calibration's own mode.
+    K = K.astype(np.float64, copy=True)
+    native = calib_size
+    if sensor_mode is not None and sensor_mode != calib_mode:
+        (cw, ch), (left, top, binning) = SENSOR_SIZE[calib_mode], SENSOR_GEOMETRY[calib_mode]
+        K[0, :] *= cw / calib_size[0] * binning
+        K[1, :] *= ch / calib_size[1] * binning
+        K[0, 2] += left
+        K[1, 2] += top
+        left, top, binning = SENSOR_GEOMETRY[sensor_mode]
+        K[0, 2] -= left
+        K[1, 2] -= top
+        K[:2, :] /= binning
+        native = SENSOR_SIZE[sensor_mode]
+    K[0, :] *= size[0] / native[0]
+    K[1, :] *= size[1] / native[1]
+    return K
+
+
+class StereoRectifier:
+
+    def __init__(self, calibration, alpha=0, num_disparities=64, block_size=15,
+                 disparity_scale=0.5, smoothing=0.9):
+
+        self.calib = load_calibration(calibration) if isinstance(calibration, str) \
+                     else calibration
+        self.alpha = alpha                      # 0: crop to valid pixels, 1: keep all
+        self.maps = {}                          # (sensor mode, (w, h)) -> maps and Q
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.outputs = {}                       # (shape, eye) -> rectified image buffer
+        self.disparity_scale = disparity_scale  # disparity runs on frames scaled by this
+        self.matcher = cv2.StereoBM_create(numDisparities=num_disparities,
+                                           blockSize=block_size)
+        self.small = {}                         # downscaled gray buffers for StereoBM
+        self.disp = None
+        self.timing = {'remap': 0.0, 'disparity': 0.0}  # smoothed ms per stage
+        self.smoothing = smoothing
+
+    def _maps(self, size, sensor_mode=None):
+        # rectification maps for one mode and resolution, computed on first use and cached
+        entry = self.maps.get((sensor_mode, size))
+        if entry is None:
+            c = self.calib
+            calib_mode = c.get('sensor_mode', 0)
+            K1 = scaled_intrinsics(c['K1'], c['image_size'], size, sensor_mode, calib_mode)
+            K2 = scaled_intrinsics(c['K2'], c['image_size'], size, sensor_mode, calib_mode)
+            R1, R2, P1, P2, Q, _, _ = cv2.stereoRectify(K1, c['D1'], K2, c['D2'], size,
+                                                        c['R'], c['T'], alpha=self.alpha)
+            left  = cv2.initUndistortRectifyMap(K1, c['D1'], R1, P1, size, cv2.CV_16SC2)
+            right = cv2.initUndistortRectifyMap(K2, c['D2'], R2, P2, size, cv2.CV_16SC2)
+            entry = self.maps[(sensor_mode, size)] = (left, right, Q)
+        return entry
+
+    def _output(self, img, eye):
+        key = (img.shape, img.dtype, eye)
+        out = self.outputs.get(key)
+        if out is None:
+            out = self.outputs[key] = np.empty_like(img)
+        return out
+
+    def _time(self, stage, t0):
+        ms = (time() - t0) * 1000
+        a = self.smoothing
+        self.timing[stage] = a * self.timing[stage] + (1 - a) * ms if self.timing[stage] else ms
+
+    def rectify(self, imgL, imgR, sensor_mode=None):
+        # returns the rectified pair; the arrays are reused on the next call
+        t0 = time()
+        size = (imgL.shape[1], imgL.shape[0])
+        (mL1, mL2), (mR1, mR2), _ = self._maps(size, sensor_mode)
+        outL, outR = self._output(imgL, 0), self._output(imgR, 1)
+        job = self.pool.submit(cv2.remap, imgR, mR1, mR2, cv2.INTER_LINEAR, outR)
+        cv2.remap(imgL, mL1, mL2, cv2.INTER_LINEAR, outL)
+        job.result()
+        self._time('remap', t0)
+        return outL, outR
+
+    def disparity(self, rectL, rectR):
+        # block-matching disparity (in pixels of the downscaled image) of a rectified pair
+        t0 = time()
+        h, w = rectL.shape[:2]
+        size = (max(int(w * self.disparity_scale), 1), max(int(h * self.disparity_scale), 1))
+        small = []
+        for eye, img in enumerate((rectL, rectR)):
+            key = (size, eye)
+            if key not in self.small:
+                self.small[key] = (np.empty((size[1], size[0]), np.uint8),
+                                   np.empty((h, w), np.uint8))
+            dst, gray = self.small[key]
+            if gray.shape != (h, w):
+                gray = np.empty((h, w), np.uint8)
+                self.small[key] = (dst, gray)
+            if img.ndim == 3:
+                cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, gray)
+                img = gray
+            cv2.resize(img, size, dst, interpolation=cv2.INTER_AREA)
+            small.append(dst)
+        if self.disp is None or self.disp.shape != (size[1], size[0]):
+            self.disp = np.empty((size[1], size[0]), np.int16)
+        self.matcher.compute(small[0], small[1], self.disp)
+        self._time('disparity', t0)
+        # StereoBM returns fixed-point disparities with 4 fractional bits
+        return self.disp
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def display(calibration, sensor_mode=2, dispW=960, dispH=540, show_disparity=True):
+    # rectified side-by-side view of two picams (sensor 0 left, sensor 1 right), with
+    # horizontal guide lines and an optional disparity window
+    from ws_startup import open_cameras, release_cameras
+    from ws_pacing import FramePacer, poll_key
+
+    reports = open_cameras([dict(sensor_id=0, sensor_mode=sensor_mode, display_fps=False,
+                                 display_width=dispW, display_height=dispH),
+                            dict(sensor_id=1, sensor_mode=sensor_mode, display_fps=False,
+                                 display_width=dispW, display_height=dispH)])
+    if not all(r.ok and not r.timed_out for r in reports):
+        print("Unable to open both cameras")
+        release_cameras(reports)
+        return
+    left, right = [r.camera for r in reports]
+    stereo = StereoRectifier(calibration)
+    pacer = FramePacer(camera=left)
+    while True:
+        okL, imgL = left.read()
+        okR, imgR = right.read()
+        if okL and okR:
+            rectL, rectR = stereo.rectify(imgL, imgR, sensor_mode)
+            img = np.hstack((rectL, rectR))
+            for y in range(0, img.shape[0], 40):
+                cv2.line(img, (0, y), (img.shape[1], y), (0, 255, 0), 1)
+            cv2.imshow("Rectified", img)
+            if show_disparity:
+                disp = stereo.disparity(rectL, rectR)
+                vis = cv2.convertScaleAbs(disp, alpha=255.0 / (16 * stereo.matcher.getNumDisparities()))
+                cv2.imshow("Disparity", cv2.applyColorMap(vis, cv2.COLORMAP_JET))
+            print("remap {remap:5.1f} ms  disparity {disparity:5.1f} ms".format(**stereo.timing),
+                  end='\r')
+        pacer.wait()
+        if poll_key() == ord('q'):
+            break
+    print(pacer)
+    stereo.close()
+    left.release()
+    right.release()
+    cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+
+    import sys
+    display(sys.argv[1] if len(sys.argv) > 1 else 'stereo_calibration.npz')
@@ -0,0 +1,148 @@
+# ws_threading.py
+# CPU affinity and scheduling policy for capture, processing and display threads
+
+# On the 4-core Nano the camera capture threads, OpenCV's own worker pool (used by
+# detectMultiScale, resize, ...) and the HighGUI loop all compete for the same cores, which
+# shows up as jitter in the grab rate. A ThreadPolicy pins the capture threads to their own
+# core(s), keeps the processing (main) thread and OpenCV's pool on the others, caps the size
+# of that pool, and can raise the priority of the capture threads.
+
+# Usage:
+#   policy = POLICIES['pinned']
+#   policy.apply_processing()          # in the main thread, before starting the cameras
+#   camera.thread_policy = policy      # the capture thread applies apply_capture() itself
+#   camera.start()
+
+# Run this file to compare the policies on grab jitter and throughput under a face
+# detection load:  python3 ws_threading.py [sensor_mode] [seconds]
+
+import os
+import threading
+import cv2
+
+# the cores this process was allowed to use at startup
+ALL_CORES = set(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else set()
+
+
+class ThreadPolicy:
+
+    def __init__(self, capture_cores=None, processing_cores=None, cv_threads=None,
+                 capture_nice=None, capture_fifo=None):
+
+        self.capture_cores    = capture_cores     # set of cores for capture threads
+        self.processing_cores = processing_cores  # set of cores for everything else
+        self.cv_threads       = cv_threads        # cv2.setNumThreads for processing
+        self.capture_nice     = capture_nice      # e.g. -10 (needs CAP_SYS_NICE)
+        self.capture_fifo     = capture_fifo      # SCHED_FIFO priority (needs root)
+
+    def __str__(self):
+        return 'capture cores {}, processing cores {}, cv threads {}, nice {}, fifo {}'.format(
+            sorted(self.capture_cores) if self.capture_cores else 'all',
+            sorted(self.processing_cores) if self.processing_cores else 'all',
+            self.cv_threads if self.cv_threads is not None else 'default',
+            self.capture_nice, self.capture_fifo)
+
+    def apply_processing(self):
+        # call from the main (processing/display) thread. Threads inherit the affinity of
+        # the thread that creates them, so OpenCV's pool and the capture threads started
+        # after this begin on the processing cores.
+        _set_affinity(0, self.processing_cores or ALL_CORES)
+        cv2.setNumThreads(self.cv_threads if self.cv_threads is not None else -1)
+
+    def apply_capture(self):
+        # call from inside a capture thread: affinity and priority are per native thread
+        tid = threading.get_native_id()
+        if self.capture_cores:
+            _set_affinity(tid, self.capture_cores)
+        else:
+            _set_affinity(tid, ALL_CORES)
+        if self.capture_nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, self.capture_nice)
+            except (PermissionError, AttributeError) as e:
+                print("Unable to renice capture thread: {}".format(e))
+        if self.capture_fifo is not None:
+            try:
+                os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(self.capture_fifo))
+            except (PermissionError, AttributeError) as e:
+                print("Unable to set SCHED_FIFO on capture thread: {}".format(e))
+
+
+def _set_affinity(tid, cores):
+    if not cores or not hasattr(os, 'sched_setaffinity'):
+        return
+    # ignore cores this machine does not have
+    cores = set(cores) & ALL_CORES or ALL_CORES
+    os.sched_setaffinity(tid, cores)
+
+
+# Policies for the 4-core Nano: the capture threads get core 3, processing cores 0-2
+POLICIES = {
+    'default':     ThreadPolicy(),
+    'pinned':      ThreadPolicy(capture_cores={3}, processing_cores={0, 1, 2}, cv_threads=3),
+    'pinned_nice': ThreadPolicy(capture_cores={3}, processing_cores={0, 1, 2}, cv_threads=3,
+                                capture_nice=-10),
+    'single_cv':   ThreadPolicy(capture_cores={3}, processing_cores={0, 1, 2}, cv_threads=1),
+}
+
+
+def benchmark(camera, policies=POLICIES, seconds=10):
+    # Run the camera under each policy with a face detection load in this thread, and
+    # report grab rate, grab interval jitter and detection throughput
+    from collections import deque
+    from time import time
+    import numpy as np
+
+    face_cascade = cv2.CascadeClassifier(
+        "/usr/share/opencv4/haarcascades/haarcascade_frontalface_default.xml")
+    results = {}
+    for name, policy in policies.items():
+        camera.stop()
+        policy.apply_processing()
+        camera.thread_policy = policy
+        camera.grab_log = deque(maxlen=100000)
+        camera.start()
+        detected = 0
+        t_end = time() + seconds
+        while time() < t_end:
+            ok, gray = camera.read_gray()
+            if not ok:
+                continue
+            face_cascade.detectMultiScale(gray, 1.3, 5)
+            detected += 1
+        camera.stop()
+        times = np.array(camera.grab_log)
+        camera.grab_log = None
+        dt = np.diff(times) * 1000
+        if len(dt) < 2:
+            print("{}: no frames".format(name))
+            continue
+        results[name] = dict(grab_fps=len(dt) / (times[-1] - times[0]),
+                             jitter_ms=dt.std(), p99_ms=np.percentile(dt, 99),
+                             max_ms=dt.max(), detect_fps=detected / seconds)
+    print("{:12s} {:>8s} {:>10s} {:>8s} {:>8s} {:>10s}".format(
+        'policy', 'grab fps', 'jitter ms', 'p99 ms', 'max ms', 'detect fps'))
+    for name, r in results.items():
+        print("{:12s} {grab_fps:8.1f} {jitter_ms:10.2f} {p99_ms:8.1f} {max_ms:8.1f} "
+              "{detect_fps:10.1f}".format(name, **r))
+    POLICIES['default'].apply_processing()
+    return results
+
+
+if __name__ == "__main__":
+
+    import sys
+    import ws_csi_camera as ws
+
+    sensor_mode = int(sys.argv[1]) if len(sys.argv) > 1 else ws.S_MODE_3_1280_720_60
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    dispW, dispH = ws.DISP_ONE_QUARTER[sensor_mode]
+
+    camera = ws.CSI_Camera(display_fps=False)
+    # detection only needs luma: capture GRAY8 and skip both color conversions
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=sensor_mode,
+                                     display_width=dispW, display_height=dispH,
+                                     color_format='GRAY8')
+    camera.open(camera.gstreamer_pipeline)
+    benchmark(camera, seconds=seconds)
+    camera.release()
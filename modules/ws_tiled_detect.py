@@ -0,0 +1,192 @@
+# ws_tiled_detect.py
+# Tile-parallel Haar cascade detection for high-resolution frames
+
+# detectMultiScale over a full 3264x2464 frame is one long serial scan, so face detection
+# in sensor mode 0 only keeps up when the frame is downscaled, and small or distant faces
+# are lost. Here the frame is split into overlapping tiles and the tiles are scanned on a
+# thread pool (OpenCV releases the GIL), so detection at full resolution scales with the
+# number of cores.
+
+# The tiles overlap by the largest expected face (max_face), so every face up to that size
+# lies completely inside at least one tile; the scan of each tile is limited to faces of at
+# most max_face. A face that straddles a tile edge can also be found, cut off, in the
+# neighbouring tile, and one found whole in two tiles is found twice: the detections of
+# all tiles are merged by non-maximum suppression (vectorized in numpy). Boxes are ranked
+# by score and suppressed by intersection over union; a box lying mostly inside a larger
+# one (a partial face at a tile edge, or a spurious detection within a face) is absorbed
+# by the larger box, whatever their scores.
+
+# Each tile scan may still use OpenCV's own worker pool; with a ThreadPolicy (see
+# ws_threading.py) cv_threads=1 keeps the two from oversubscribing the cores.
+
+#   detector = TiledDetector(max_face=400, workers=4)
+#   faces = detector.detect(gray)          # N x 4 array of (x, y, w, h)
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+import cv2
+import numpy as np
+
+CASCADE_DIR = "/usr/share/opencv4/haarcascades/"
+
+
+def tile_grid(width, height, tile, overlap):
+    # (x, y, w, h) of tiles of at most tile x tile covering the frame, spread evenly so
+    # that neighbours overlap by at least `overlap`
+    def starts(size):
+        if size <= tile:
+            return [0]
+        n = -(-(size - overlap) // (tile - overlap))
+        return np.linspace(0, size - tile, n).round().astype(int).tolist()
+    return np.array([(x, y, min(tile, width - x), min(tile, height - y))
+                     for y in starts(height) for x in starts(width)], np.int32).reshape(-1, 4)
+
+
+def nms(boxes, scores, threshold=0.3):
+    # Greedy non-maximum suppression of (x, y, w, h) boxes, highest score first. A kept box
+    # drops a lower-ranked one whose intersection over union with it exceeds `threshold`,
+    # unless it lies in that one, and drops any smaller box (of any rank) when their
+    # intersection covers more than `threshold` of the smaller one. Returns the indices
+    # of the kept boxes.
+    n = len(boxes)
+    if n == 0:
+        return np.zeros(0, np.intp)
+    b = np.asarray(boxes, np.float32)
+    area = b[:, 2] * b[:, 3]
+    # score first, larger box on ties
+    order = np.lexsort((-area, -np.asarray(scores, np.float32)))
+    b, area = b[order], area[order]
+    x1, y1 = b[:, 0], b[:, 1]
+    x2, y2 = x1 + b[:, 2], y1 + b[:, 3]
+    iw = np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :])
+    ih = np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :])
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+    iou = inter / np.maximum(area[:, None] + area[None, :] - inter, 1)
+    contained = inter / np.maximum(np.minimum(area[:, None], area[None, :]), 1) > threshold
+    # larger[i, j]: box i is the larger one (the higher ranked one on equal areas)
+    rank = np.arange(n)
+    larger = (area[:, None] > area[None, :]) | \
+             ((area[:, None] == area[None, :]) & (rank[:, None] < rank[None, :]))
+    # suppress[i, j]: box i, when kept, drops box j; a box never drops the larger box it
+    # lies in, which absorbs it instead
+    absorbs = contained & larger
+    suppress = (np.triu(iou > threshold, 1) & ~absorbs.T) | absorbs
+    keep = np.ones(n, bool)
+    for i in range(n):
+        if keep[i]:
+            keep &= ~suppress[i]
+    return order[keep]
+
+
+class TiledDetector:
+
+    def __init__(self, cascade='haarcascade_frontalface_default.xml', max_face=400,
+                 min_face=24, scale_factor=1.1, min_neighbors=5, tile=None, workers=4,
+                 nms_threshold=0.3):
+
+        self.cascade_file  = cascade if '/' in cascade else CASCADE_DIR + cascade
+        self.max_face      = max_face        # largest face (pixels) to look for
+        self.min_face      = min_face
+        self.scale_factor  = scale_factor
+        self.min_neighbors = min_neighbors
+        self.tile          = tile or 3 * max_face   # tile side; the overlap is max_face
+        self.nms_threshold = nms_threshold
+        self.workers       = workers
+        self.pool          = ThreadPoolExecutor(workers) if workers > 1 else None
+        self.local         = threading.local()   # one classifier per worker thread
+        self.grids         = {}     # (width, height) -> tile grid
+        self.timing        = {'tiles': 0.0, 'nms': 0.0}   # last detect(), seconds
+
+    def _classifier(self):
+        c = getattr(self.local, 'cascade', None)
+        if c is None:
+            c = self.local.cascade = cv2.CascadeClassifier(self.cascade_file)
+        return c
+
+    def grid(self, width, height):
+        g = self.grids.get((width, height))
+        if g is None:
+            g = self.grids[(width, height)] = tile_grid(width, height, self.tile,
+                                                        self.max_face)
+        return g
+
+    def _scan(self, gray, tile):
+        x, y, w, h = tile
+        rects, neighbors = self._classifier().detectMultiScale2(
+            gray[y:y + h, x:x + w], self.scale_factor, self.min_neighbors,
+            minSize=(self.min_face, self.min_face), maxSize=(self.max_face, self.max_face))
+        if len(rects) == 0:
+            return None
+        rects = np.asarray(rects, np.int32).reshape(-1, 4)
+        rects[:, 0] += x
+        rects[:, 1] += y
+        return rects, np.asarray(neighbors, np.float32).ravel()
+
+    def detect(self, gray):
+        # N x 4 int32 array of (x, y, w, h) in frame coordinates
+        t0 = time()
+        tiles = self.grid(gray.shape[1], gray.shape[0])
+        if self.pool is not None and len(tiles) > 1:
+            found = list(self.pool.map(lambda t: self._scan(gray, t), tiles))
+        else:
+            found = [self._scan(gray, t) for t in tiles]
+        found = [f for f in found if f is not None]
+        t1 = time()
+        if not found:
+            faces = np.zeros((0, 4), np.int32)
+        else:
+            boxes = np.concatenate([f[0] for f in found])
+            scores = np.concatenate([f[1] for f in found])
+            faces = boxes[nms(boxes, scores, self.nms_threshold)]
+        self.timing['tiles'] = t1 - t0
+        self.timing['nms'] = time() - t1
+        return faces
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+if __name__ == "__main__":
+
+    # full-resolution face detection in sensor mode 0, shown at quarter scale
+    import sys
+    import ws_csi_camera as ws
+    from ws_overlay import Overlay
+    from ws_pacing import FramePacer, poll_key
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    sensor_mode = ws.S_MODE_0_3264_2464_21
+    fullW, fullH = ws.SENSOR_SIZE[sensor_mode]
+    dispW, dispH = ws.DISP_ONE_QUARTER[sensor_mode]
+
+    camera = ws.CSI_Camera(display_fps=False)
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=sensor_mode,
+                                     display_width=fullW, display_height=fullH,
+                                     color_format='GRAY8')
+    camera.open(camera.gstreamer_pipeline)
+    camera.start()
+    detector = TiledDetector(workers=workers)
+    scale = dispW / fullW
+    hud = Overlay(scale=.6, color=(255,255,255))
+    pacer = FramePacer(camera=camera)
+    while True:
+        ok, gray = camera.read_gray()
+        if ok:
+            faces = detector.detect(gray)
+            img = cv2.cvtColor(cv2.resize(gray, (dispW, dispH)), cv2.COLOR_GRAY2BGR)
+            for (x, y, w, h) in (faces * scale).astype(int):
+                cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
+            hud.set_text('tiles', "{} tiles: {:.0f} ms".format(
+                len(detector.grid(fullW, fullH)), detector.timing['tiles'] * 1000), (10,20))
+            hud.compose(img)
+            cv2.imshow("Tiled face detect", img)
+        pacer.wait()
+        if poll_key() == 27:
+            break
+    print(pacer)
+    detector.close()
+    camera.release()
+    cv2.destroyAllWindows()
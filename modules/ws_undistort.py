@@ -0,0 +1,153 @@
+# ws_undistort.py
+# Lens undistortion with precomputed remap tables, for single-camera pipelines
+
+# cv2.undistort recomputes the full distortion mapping on every call. Here the mapping is
+# built once per (sensor mode, display size) as fixed-point CV_16SC2 remap tables and
+# applied with cv2.remap into a preallocated buffer. The tables are also cached on disk,
+# keyed by a hash of the calibration, so later runs skip initUndistortRectifyMap entirely.
+# A cache file is written under a temporary name and renamed into place, and one that
+# cannot be read is recomputed, so an interrupted run never breaks the next ones.
+# Different sensor modes crop and bin the sensor differently, so the camera matrix is
+# carried over to the frame's mode before it is scaled to the frame size
+# (ws_stereo.scaled_intrinsics), and the mode is part of the key even when two modes share
+# an output size.
+
+# The calibration file (.npz or OpenCV .yml/.xml) holds K, D and image_size, as written
+# by cv2.calibrateCamera, and optionally the sensor_mode it was taken in (default 0). For
+# detection crops, undistort_roi() remaps only a rectangle of the undistorted image
+# instead of the whole frame.
+
+# Usage with a CSI_Camera:
+#   undistorter = Undistorter('picam_calibration.npz')
+#   ok, frame = camera.read()
+#   img = undistorter.undistort(frame, camera.sensor_mode)
+
+import cv2
+import hashlib
+import os
+import zipfile
+import numpy as np
+from ws_stereo import load_calibration, scaled_intrinsics
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'csi_camera', 'undistort')
+
+
+class Undistorter:
+
+    def __init__(self, calibration, alpha=0, cache_dir=CACHE_DIR):
+
+        self.calib = load_calibration(calibration, ('K', 'D', 'image_size')) \
+                     if isinstance(calibration, str) else calibration
+        self.alpha = alpha          # 0: crop to valid pixels, 1: keep every source pixel
+        self.cache_dir = cache_dir  # None disables the on-disk cache
+        self.maps = {}              # (sensor_mode, (width, height)) -> (map1, map2)
+        self.outputs = {}           # (shape, dtype) -> output buffer
+        self.roi_outputs = {}       # (shape, dtype) -> ROI output buffer
+        h = hashlib.sha1()
+        for k in ('K', 'D', 'image_size', 'sensor_mode'):
+            h.update(np.ascontiguousarray(self.calib.get(k, 0), np.float64).tobytes())
+        h.update(repr(alpha).encode())
+        self.calib_hash = h.hexdigest()[:16]
+
+    def _cache_file(self, sensor_mode, size):
+        return os.path.join(self.cache_dir, '{}_mode{}_{}x{}.npz'.format(
+            self.calib_hash, sensor_mode, size[0], size[1]))
+
+    def tables(self, sensor_mode, size):
+        # remap tables for one (sensor mode, size): from memory, then disk, then computed
+        key = (sensor_mode, size)
+        maps = self.maps.get(key)
+        if maps is not None:
+            return maps
+        path = self._cache_file(sensor_mode, size) if self.cache_dir else None
+        if path and os.path.exists(path):
+            maps = self._load(path)
+        if maps is None:
+            c = self.calib
+            K = scaled_intrinsics(c['K'], c['image_size'], size, sensor_mode,
+                                  c.get('sensor_mode', 0))
+            newK, _ = cv2.getOptimalNewCameraMatrix(K, c['D'], size, self.alpha, size)
+            maps = cv2.initUndistortRectifyMap(K, c['D'], None, newK, size, cv2.CV_16SC2)
+            if path:
+                self._save(path, maps)
+        self.maps[key] = maps
+        return maps
+
+    def _load(self, path):
+        # None if the cache file is unreadable (e.g. truncated): it is then recomputed
+        try:
+            with np.load(path) as data:
+                return (data['map1'], data['map2'])
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+            print("Ignoring damaged undistortion cache {}: {}".format(path, e))
+            return None
+
+    def _save(self, path, maps):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.savez(f, map1=maps[0], map2=maps[1])
+            os.replace(tmp, path)
+        except OSError as e:
+            print("Unable to cache undistortion tables: {}".format(e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _buffer(self, pool, shape, dtype):
+        out = pool.get((shape, dtype))
+        if out is None:
+            out = pool[(shape, dtype)] = np.empty(shape, dtype)
+        return out
+
+    def undistort(self, frame, sensor_mode=None):
+        # undistorted copy of frame, in a buffer that is reused on the next call
+        h, w = frame.shape[:2]
+        map1, map2 = self.tables(sensor_mode, (w, h))
+        out = self._buffer(self.outputs, frame.shape, frame.dtype)
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, out)
+
+    def undistort_roi(self, frame, roi, sensor_mode=None):
+        # undistort only the rectangle roi = (x, y, w, h) of the undistorted image, e.g. a
+        # detection crop; the whole frame is still the remap source
+        h, w = frame.shape[:2]
+        map1, map2 = self.tables(sensor_mode, (w, h))
+        x, y, rw, rh = roi
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + rw, w), min(y + rh, h)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        shape = (y1 - y0, x1 - x0) + frame.shape[2:]
+        out = self._buffer(self.roi_outputs, shape, frame.dtype)
+        return cv2.remap(frame, map1[y0:y1, x0:x1], map2[y0:y1, x0:x1], cv2.INTER_LINEAR, out)
+
+
+if __name__ == "__main__":
+
+    # show the raw and undistorted picam image side by side
+    import sys
+    import ws_csi_camera as ws
+    from ws_pacing import FramePacer, poll_key
+
+    calibration = sys.argv[1] if len(sys.argv) > 1 else 'picam_calibration.npz'
+    sensor_mode = int(sys.argv[2]) if len(sys.argv) > 2 else ws.S_MODE_2_1920_1080_30
+    dispW, dispH = ws.DISP_ONE_QUARTER[sensor_mode]
+
+    camera = ws.CSI_Camera(display_fps=False)
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=sensor_mode,
+                                     display_width=dispW, display_height=dispH)
+    camera.open(camera.gstreamer_pipeline)
+    camera.start()
+    undistorter = Undistorter(calibration)
+    pacer = FramePacer(camera=camera)
+    while True:
+        ok, frame = camera.read()
+        if ok:
+            cv2.imshow("Raw | Undistorted",
+                       np.hstack((frame, undistorter.undistort(frame, sensor_mode))))
+        pacer.wait()
+        if poll_key() == ord('q'):
+            break
+    print(pacer)
+    camera.release()
+    cv2.destroyAllWindows()
@@ -5,62 +5,46 @@
 # NVIDIA Jetson Nano Developer Kit using OpenCV
 # Drivers for the camera and OpenCV are included in the base image
 
+import os
+import sys
 import cv2
 
-# gstreamer_pipeline returns a GStreamer pipeline for capturing from the CSI camera
-# Defaults to 1280x720 @ 60fps
+# the camera class is the shared core in modules/ws_csi_camera.py; it builds the GStreamer
+# pipeline for the CSI camera from a sensor mode, with the framerate that mode needs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules"))
+import ws_csi_camera as ws
+from ws_pacing import FramePacer, poll_key
+
 # Flip the image by setting the flip_method (most common values: 0 and 2)
 # display_width and display_height determine the size of the window on the screen
 
 
-def gstreamer_pipeline(
-    capture_width=1280,
-    capture_height=720,
-    display_width=1280,
-    display_height=720,
-    framerate=60,
-    flip_method=0,
-):
-    return (
-        "nvarguscamerasrc ! "
-        "video/x-raw(memory:NVMM), "
-        "width=(int)%d, height=(int)%d, "
-        "format=(string)NV12, framerate=(fraction)%d/1 ! "
-        "nvvidconv flip-method=%d ! "
-        "video/x-raw, width=(int)%d, height=(int)%d, format=(string)BGRx ! "
-        "videoconvert ! "
-        "video/x-raw, format=(string)BGR ! appsink"
-        % (
-            capture_width,
-            capture_height,
-            framerate,
-            flip_method,
-            display_width,
-            display_height,
-        )
-    )
-
 def show_camera():
     # To flip the image, modify the flip_method parameter (0 and 2 are the most common)
 
-    capText = gstreamer_pipeline(capture_width=3264, capture_height=2464, framerate=21,
-                                flip_method=0, display_width=640, display_height=480) # WS values
-
-    cap = cv2.VideoCapture(capText, cv2.CAP_GSTREAMER)
-    if cap.isOpened():
+    camera = ws.CSI_Camera(display_fps=False)
+    camera.create_gstreamer_pipeline(sensor_id=0, sensor_mode=ws.S_MODE_0_3264_2464_21,
+                                     flip_method=0, display_width=640, display_height=480) # WS values
+    camera.open(camera.gstreamer_pipeline)
+    if camera.video_capture is not None and camera.video_capture.isOpened():
+        camera.start()
         window_handle = cv2.namedWindow("CSI Camera", cv2.WINDOW_AUTOSIZE)
+        # one iteration per camera frame, woken just after it arrives
+        pacer = FramePacer(camera=camera)
         # Window
         while cv2.getWindowProperty("CSI Camera", 0) >= 0:
-            ret_val, img = cap.read()
-            cv2.imshow("CSI Camera", img)
-            # This also acts as
-            keyCode = cv2.waitKey(1) & 0xFF
+            ret_val, img = camera.read()
+            if ret_val:
+                cv2.imshow("CSI Camera", img)
+            pacer.wait()
+            keyCode = poll_key()
             # Stop the program on the ESC key
             if keyCode == 27:
                 break
-        cap.release()
+        print(pacer)
+        camera.release()
         cv2.destroyAllWindows()
-        print(capText)  # WS mod
+        print(camera.gstreamer_pipeline)  # WS mod
 
     else:
         print("Unable to open camera")